@@ -20,22 +20,42 @@
 
 """
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+import os
+import time
+
 import numpy as np
+from tqdm import tqdm
+from hyperspy.signals import BaseSignal, Signal1D
 
 from pyxem.signals.indexation_results import TemplateMatchingResults
+from pyxem.signals.indexation_results import CompactTemplateMatchingResults
 from pyxem.signals.indexation_results import VectorMatchingResults
 
 from pyxem.signals import transfer_navigation_axes
 from pyxem.signals import select_method_from_method_dict
 
+from pyxem.libraries.compiled_template_library import CompiledTemplateLibrary
+
 from pyxem.utils.indexation_utils import (
     correlate_library,
+    correlate_library_sparse,
+    correlate_library_polar,
+    correlate_library_hierarchical,
+    correlate_library_coherent,
+    correlate_library_low_rank,
+    correlate_library_ann,
     zero_mean_normalized_correlation,
     fast_correlation,
+    get_magnitude_index,
     index_magnitudes,
     match_vectors,
+    matches_to_arrays,
+    prescreen_phases,
     OrientationResult,
     get_nth_best_solution,
+    refine_orientations,
 )
 
 
@@ -53,13 +73,22 @@ class IndexationGenerator:
     ----------
     signal : ElectronDiffraction2D
         The signal of electron diffraction patterns to be indexed.
-    diffraction_library : DiffractionLibrary
-        The library of simulated diffraction patterns for indexation.
+    diffraction_library : DiffractionLibrary or CompiledTemplateLibrary
+        The library of simulated diffraction patterns for indexation. A
+        CompiledTemplateLibrary is always matched with the 'sparse' engine.
+
+    Attributes
+    ----------
+    pruning_counts : dict
+        Number of 'phase_correlations' (pattern and phase pairs) and
+        'template_correlations' skipped by the phase pre-screening of the last
+        call to :meth:`correlate`, None if it was not used.
     """
 
     def __init__(self, signal, diffraction_library):
         self.signal = signal
         self.library = diffraction_library
+        self.pruning_counts = None
 
     def correlate(
         self,
@@ -67,6 +96,10 @@ class IndexationGenerator:
         method="fast_correlation",
         mask=None,
         print_help=False,
+        engine="loop",
+        chunk_size=1024,
+        compact=False,
+        phase_prescreen=None,
         *args,
         **kwargs,
     ):
@@ -81,9 +114,31 @@ class IndexationGenerator:
             Name of method used to compute correlation between templates and diffraction patterns. Can be
             'fast_correlation' or 'zero_mean_normalized_correlation'.
         mask : Array
-            Array with the same size as signal (in navigation) or None
+            Boolean array or Signal2D with the navigation shape of the signal,
+            True at the positions to be indexed, e.g. from
+            :meth:`Diffraction2D.get_navigation_mask`. If None all positions
+            are indexed.
         print_help : bool
             Display information about the method used.
+        engine : str
+            Either 'loop' (default), which correlates each pattern with one
+            template at a time through map(), or 'sparse', which packs each
+            phase into a sparse template matrix and scores `chunk_size`
+            patterns with a single matrix product. Ignored when the library
+            is a CompiledTemplateLibrary, which is always matched with the
+            'sparse' engine and needs no preprocessing.
+        chunk_size : int
+            Number of patterns correlated at once by the 'sparse' engine.
+        compact : bool
+            If True the results are returned as CompactTemplateMatchingResults,
+            typed arrays that are smaller and faster to process and save.
+        phase_prescreen : float
+            If given, the radial profile of each pattern is first compared
+            with the radial profile of each phase and only the phases scoring
+            at least phase_prescreen times the best phase (e.g. 0.8) are
+            correlated, see :func:`prescreen_phases`. The number of skipped
+            correlations is stored in `pruning_counts`. Requires the 'sparse'
+            engine.
         *args : arguments
             Arguments passed to map().
         **kwargs : arguments
@@ -94,7 +149,8 @@ class IndexationGenerator:
         matching_results : TemplateMatchingResults
             Navigation axes of the electron diffraction signal containing
             correlation results for each diffraction pattern, in the form
-            [Library Number , [z, x, z], Correlation Score]
+            [Library Number , [z, x, z], Correlation Score], or
+            CompactTemplateMatchingResults if compact.
 
         """
         signal = self.signal
@@ -105,16 +161,52 @@ class IndexationGenerator:
             "zero_mean_normalized_correlation": zero_mean_normalized_correlation,
         }
 
-        if mask is None:
-            # Index at all real space pixels
-            mask = 1
-
         # tests if selected method is a valid argument, and can print help for selected method.
         chosen_function = select_method_from_method_dict(
             method, method_dict, print_help
         )
 
-        # adds a normalisation to library
+        image_shape = signal.axes_manager.signal_shape[::-1]
+        if isinstance(library, CompiledTemplateLibrary) or engine == "sparse":
+            library = _get_compiled_library(library, image_shape)
+            engine = "sparse"
+
+        self.pruning_counts = None
+        if engine == "sparse":
+            correlation_function = correlate_library_sparse
+            if phase_prescreen is not None:
+                self.pruning_counts = {
+                    "phase_correlations": 0,
+                    "template_correlations": 0,
+                }
+                correlation_function = partial(
+                    _correlate_prescreened,
+                    threshold=phase_prescreen,
+                    pruning_counts=self.pruning_counts,
+                )
+            matches = _correlate_in_chunks(
+                signal,
+                correlation_function,
+                library,
+                n_largest,
+                method,
+                mask,
+                chunk_size,
+                compact,
+            )
+
+            return _get_matching_results(matches, signal, compact)
+        elif engine != "loop":
+            raise ValueError(
+                "The engine `{}` is not recognised, use 'loop' or "
+                "'sparse'.".format(engine)
+            )
+        elif phase_prescreen is not None:
+            raise ValueError("Phase pre-screening requires the 'sparse' engine.")
+
+        # adds a normalisation to a copy of the library, leaving the user's
+        # library untouched
+        normed_library = {}
         for phase in library.keys():
             norm_array = np.ones(
                 library[phase]["intensities"].shape[0]
@@ -122,9 +214,16 @@ class IndexationGenerator:
 
             for i, intensity_array in enumerate(library[phase]["intensities"]):
                 norm_array[i] = np.linalg.norm(intensity_array)
-            library[phase][
-                "pattern_norms"
-            ] = norm_array  # puts this normalisation into the library
+            normed_library[phase] = dict(library[phase], pattern_norms=norm_array)
+        library = normed_library
+
+        mask = _get_navigation_mask(mask, signal.axes_manager.navigation_shape[::-1])
+        if mask is None:
+            # Index at all real space pixels
+            mask = 1
+        else:
+            # iterated by map() alongside the signal
+            mask = Signal1D(mask[..., np.newaxis])
 
         matches = signal.map(
             correlate_library,
@@ -135,22 +234,709 @@ class IndexationGenerator:
             inplace=False,
             **kwargs,
         )
+        if compact:
+            return _get_matching_results(matches.data, signal, compact)
 
         matching_results = TemplateMatchingResults(matches)
         matching_results = transfer_navigation_axes(matching_results, signal)
 
         return matching_results
 
+    def correlate_polar(
+        self,
+        n_largest=5,
+        method="fast_correlation",
+        mask=None,
+        dr=1,
+        dt=None,
+        chunk_size=256,
+        compact=False,
+    ):
+        """Correlates the library with the electron diffraction signal in
+        polar coordinates, scoring all in-plane rotations of each template
+        with a single FFT based cross-correlation along theta.
+
+        The library only needs to contain the out-of-plane orientations (e.g.
+        one template per zone axis), which reduces the library size and the
+        correlation cost by roughly the number of in-plane rotation steps. The
+        in-plane rotation giving the best correlation is added to the first
+        Euler angle of the matching template.
+
+        Parameters
+        ----------
+        n_largest : int
+            The n orientations with the highest correlation values are returned.
+        method : str
+            Name of method used to compute correlation between templates and
+            diffraction patterns. Can be 'fast_correlation' or
+            'zero_mean_normalized_correlation'.
+        mask : Array
+            Boolean array or Signal2D with the navigation shape of the signal,
+            True at the positions to be indexed, e.g. from
+            :meth:`Diffraction2D.get_navigation_mask`. If None all positions
+            are indexed.
+        dr : float
+            Radial coordinate spacing of the polar grid, see
+            :meth:`Diffraction2D.as_polar`. Ignored if the library is a polar
+            CompiledTemplateLibrary.
+        dt : float
+            Angular coordinate spacing (in radians) of the polar grid, which
+            sets the in-plane angular resolution. Ignored if the library is a
+            polar CompiledTemplateLibrary.
+        chunk_size : int
+            Number of patterns correlated at once.
+        compact : bool
+            If True the results are returned as CompactTemplateMatchingResults,
+            typed arrays that are smaller and faster to process and save.
+
+        Returns
+        -------
+        matching_results : TemplateMatchingResults
+            Navigation axes of the electron diffraction signal containing
+            correlation results for each diffraction pattern, in the form
+            [Library Number , [z, x, z], Correlation Score], or
+            CompactTemplateMatchingResults if compact.
+
+        Notes
+        -----
+        The patterns are reprojected with
+        :func:`pyxem.utils.expt_utils.reproject_polar` one chunk at a time
+        rather than through :meth:`Diffraction2D.as_polar`. The FFT along theta
+        needs theta sampled evenly over the full circle, whereas the
+        PolarDiffraction2D returned by as_polar covers only the range of
+        theta spanned by the pixels, and reprojecting the whole signal first
+        would hold a second copy of the dataset in memory.
+
+        """
+        signal = self.signal
+        library = self.library
+
+        image_shape = signal.axes_manager.signal_shape[::-1]
+        library = _get_compiled_library(library, image_shape, polar=True, dr=dr, dt=dt)
+
+        matches = _correlate_in_chunks(
+            signal,
+            correlate_library_polar,
+            library,
+            n_largest,
+            method,
+            mask,
+            chunk_size,
+            compact,
+        )
+
+        return _get_matching_results(matches, signal, compact)
+
+    def correlate_hierarchical(
+        self,
+        n_largest=5,
+        method="fast_correlation",
+        mask=None,
+        resolutions=None,
+        n_candidates=5,
+        chunk_size=256,
+        compact=False,
+    ):
+        """Correlates the library with the electron diffraction signal by a
+        coarse-to-fine search over orientations.
+
+        The library is organised in levels of increasing angular resolution,
+        down to the full library. Each pattern is correlated with every
+        template of the coarsest level, then at each finer level only with the
+        templates close to the best candidates of the previous level. This
+        evaluates a small fraction of a densely sampled library, at the risk
+        of missing the best match when it lies far from all coarse
+        candidates.
+
+        Parameters
+        ----------
+        n_largest : int
+            The n orientations with the highest correlation values are returned.
+        method : str
+            Name of method used to compute correlation between templates and
+            diffraction patterns. Can be 'fast_correlation' or
+            'zero_mean_normalized_correlation'.
+        mask : Array
+            Boolean array or Signal2D with the navigation shape of the signal,
+            True at the positions to be indexed, e.g. from
+            :meth:`Diffraction2D.get_navigation_mask`. If None all positions
+            are indexed.
+        resolutions : list of float, optional
+            Angular resolutions (degrees) of the coarse levels, which should be
+            larger than the orientation spacing of the library. If None, the
+            hierarchy built by :meth:`CompiledTemplateLibrary.build_hierarchy`
+            on the library is used, or else resolutions of (4.0,). A hierarchy
+            with other resolutions is built on a copy of the library, which
+            is not modified.
+        n_candidates : int
+            Number of best templates whose neighbourhood is searched at each
+            finer level.
+        chunk_size : int
+            Number of patterns correlated at once.
+        compact : bool
+            If True the results are returned as CompactTemplateMatchingResults,
+            typed arrays that are smaller and faster to process and save.
+
+        Returns
+        -------
+        matching_results : TemplateMatchingResults
+            Navigation axes of the electron diffraction signal containing
+            correlation results for each diffraction pattern, in the form
+            [Library Number , [z, x, z], Correlation Score], or
+            CompactTemplateMatchingResults if compact.
+
+        """
+        signal = self.signal
+        library = self.library
+
+        image_shape = signal.axes_manager.signal_shape[::-1]
+        library = _get_compiled_library(library, image_shape)
+        if resolutions is None:
+            resolutions = library.hierarchy_resolutions or (4.0,)
+        resolutions = tuple(sorted((float(r) for r in resolutions), reverse=True))
+        library = _build_search_structure(
+            library,
+            self.library,
+            (library.hierarchy_resolutions,),
+            (resolutions,),
+            CompiledTemplateLibrary.build_hierarchy,
+        )
+
+        matches = _correlate_in_chunks(
+            signal,
+            partial(correlate_library_hierarchical, n_candidates=n_candidates),
+            library,
+            n_largest,
+            method,
+            mask,
+            chunk_size,
+            compact,
+        )
+
+        return _get_matching_results(matches, signal, compact)
+
+    def correlate_coherent(
+        self,
+        n_largest=5,
+        method="fast_correlation",
+        mask=None,
+        radius=None,
+        threshold=0.9,
+        compact=False,
+    ):
+        """Correlates the library with the electron diffraction signal,
+        seeding the search at each probe position with the orientations
+        found at its neighbours.
+
+        The navigation grid is walked row by row. The patterns of the first
+        row are correlated one at a time, each seeded by the best matches of
+        its left neighbour, and the patterns of each following row together,
+        each seeded by the best matches of the three neighbours in the row
+        above. Each pattern is first correlated with the templates within
+        `radius` of its seeds, and the full library is only searched when the
+        best local correlation falls short of the best seed correlation by
+        more than a fraction 1 - `threshold` of it, which in grains of
+        uniform orientation avoids most of the template sweep.
+
+        Parameters
+        ----------
+        n_largest : int
+            The n orientations with the highest correlation values are returned.
+        method : str
+            Name of method used to compute correlation between templates and
+            diffraction patterns. Can be 'fast_correlation' or
+            'zero_mean_normalized_correlation'.
+        mask : Array
+            Boolean array or Signal2D with the navigation shape of the signal,
+            True at the positions to be indexed, e.g. from
+            :meth:`Diffraction2D.get_navigation_mask`. If None all positions
+            are indexed.
+        radius : float, optional
+            Misorientation (degrees) around the neighbours' best orientations
+            searched first. If None, the neighbours built by
+            :meth:`CompiledTemplateLibrary.build_neighbours` on the library
+            are used, or else a radius of 5 degrees. Neighbours within another
+            radius are built on a copy of the library, which is not modified.
+        threshold : float
+            Fraction of the neighbours' best correlation below which the full
+            library is searched. Values closer to 1 are more robust at grain
+            boundaries but slower.
+        compact : bool
+            If True the results are returned as CompactTemplateMatchingResults,
+            typed arrays that are smaller and faster to process and save.
+
+        Returns
+        -------
+        matching_results : TemplateMatchingResults
+            Navigation axes of the electron diffraction signal containing
+            correlation results for each diffraction pattern, in the form
+            [Library Number , [z, x, z], Correlation Score], or
+            CompactTemplateMatchingResults if compact.
+
+        """
+        signal = self.signal
+        library = self.library
+
+        image_shape = signal.axes_manager.signal_shape[::-1]
+        library = _get_compiled_library(library, image_shape)
+        if radius is None:
+            radius = library.neighbour_radius or 5.0
+        library = _build_search_structure(
+            library,
+            self.library,
+            (library.neighbour_radius,),
+            (float(radius),),
+            CompiledTemplateLibrary.build_neighbours,
+        )
+
+        # walk the last navigation axis fastest, other axes form the rows
+        nav_shape = signal.axes_manager.navigation_shape[::-1]
+        if not nav_shape:
+            raise ValueError(
+                "correlate_coherent() needs a signal with at least one "
+                "navigation axis."
+            )
+        grid_shape = (int(np.prod(nav_shape[:-1])), nav_shape[-1])
+        images = signal.data.reshape(grid_shape + image_shape)
+        mask = _get_navigation_mask(mask, nav_shape)
+        if mask is not None:
+            mask = mask.reshape(grid_shape)
+
+        matches, _ = correlate_library_coherent(
+            images, library, n_largest, method, mask=mask, threshold=threshold
+        )
+        matches = matches.reshape(nav_shape + matches.shape[2:])
+
+        return _get_matching_results(matches, signal, compact)
+
+    def correlate_low_rank(
+        self,
+        n_largest=5,
+        method="fast_correlation",
+        mask=None,
+        rank=None,
+        n_candidates=50,
+        chunk_size=256,
+        compact=False,
+    ):
+        """Correlates the library with the electron diffraction signal using
+        a low rank approximation of the library to shortlist candidates.
+
+        The templates of each phase are compressed by a truncated singular
+        value decomposition. Each pattern is projected onto the retained
+        singular vectors, approximate correlations with all templates are
+        computed from `rank` numbers per template, and only the
+        `n_candidates` best candidates are correlated exactly.
+
+        Parameters
+        ----------
+        n_largest : int
+            The n orientations with the highest correlation values are returned.
+        method : str
+            Name of method used to compute correlation between templates and
+            diffraction patterns. Can be 'fast_correlation' or
+            'zero_mean_normalized_correlation'.
+        mask : Array
+            Boolean array or Signal2D with the navigation shape of the signal,
+            True at the positions to be indexed, e.g. from
+            :meth:`Diffraction2D.get_navigation_mask`. If None all positions
+            are indexed.
+        rank : int, optional
+            Number of singular vectors retained. If None, the compressed
+            templates built by :meth:`CompiledTemplateLibrary.build_low_rank`
+            on the library are used, or else a rank of 50. Another rank is
+            built on a copy of the library, which is not modified.
+        n_candidates : int
+            Number of candidates per pattern and phase correlated exactly.
+            Larger values are slower but less likely to miss the best match.
+        chunk_size : int
+            Number of patterns correlated at once.
+        compact : bool
+            If True the results are returned as CompactTemplateMatchingResults,
+            typed arrays that are smaller and faster to process and save.
+
+        Returns
+        -------
+        matching_results : TemplateMatchingResults
+            Navigation axes of the electron diffraction signal containing
+            correlation results for each diffraction pattern, in the form
+            [Library Number , [z, x, z], Correlation Score], or
+            CompactTemplateMatchingResults if compact.
+
+        """
+        signal = self.signal
+        library = self.library
+
+        image_shape = signal.axes_manager.signal_shape[::-1]
+        library = _get_compiled_library(library, image_shape)
+        if rank is None:
+            rank = library.low_rank or 50
+        library = _build_search_structure(
+            library,
+            self.library,
+            (library.low_rank,),
+            (int(rank),),
+            CompiledTemplateLibrary.build_low_rank,
+        )
+
+        matches = _correlate_in_chunks(
+            signal,
+            partial(correlate_library_low_rank, n_candidates=n_candidates),
+            library,
+            n_largest,
+            method,
+            mask,
+            chunk_size,
+            compact,
+        )
+
+        return _get_matching_results(matches, signal, compact)
+
+    def correlate_ann(
+        self,
+        n_largest=5,
+        method="fast_correlation",
+        mask=None,
+        n_tables=None,
+        n_bits=None,
+        n_probes=0,
+        chunk_size=256,
+        compact=False,
+    ):
+        """Correlates the library with the electron diffraction signal using
+        an approximate nearest neighbour search over the templates.
+
+        Only the templates sharing a bucket of a locality sensitive hashing
+        index with a pattern are correlated, so the cost per pattern grows
+        slower than the library size. The best matches may be missed; see
+        :func:`pyxem.utils.indexation_utils.get_ann_recall` to measure the
+        recall against exhaustive matching.
+
+        Parameters
+        ----------
+        n_largest : int
+            The n orientations with the highest correlation values are returned.
+        method : str
+            Name of method used to compute correlation between templates and
+            diffraction patterns. Can be 'fast_correlation' or
+            'zero_mean_normalized_correlation'.
+        mask : Array
+            Boolean array or Signal2D with the navigation shape of the signal,
+            True at the positions to be indexed, e.g. from
+            :meth:`Diffraction2D.get_navigation_mask`. If None all positions
+            are indexed.
+        n_tables : int, optional
+            Number of hash tables of the index. If None, the number of tables
+            of the index built by :meth:`CompiledTemplateLibrary.build_ann_index`
+            on the library is used, or else 16. An index with other
+            parameters is built on a copy of the library, which is not
+            modified.
+        n_bits : int, optional
+            Number of bits of the hash of each table. If None, the number of
+            bits of the index of the library is used, or else 8.
+        n_probes : int
+            Number of additional buckets probed per table. Larger values
+            increase the recall at the cost of correlating more templates.
+        chunk_size : int
+            Number of patterns correlated at once.
+        compact : bool
+            If True the results are returned as CompactTemplateMatchingResults,
+            typed arrays that are smaller and faster to process and save.
+
+        Returns
+        -------
+        matching_results : TemplateMatchingResults
+            Navigation axes of the electron diffraction signal containing
+            correlation results for each diffraction pattern, in the form
+            [Library Number , [z, x, z], Correlation Score], or
+            CompactTemplateMatchingResults if compact.
+
+        """
+        signal = self.signal
+        library = self.library
+
+        image_shape = signal.axes_manager.signal_shape[::-1]
+        library = _get_compiled_library(library, image_shape)
+        built = library.ann_parameters
+        if n_tables is None:
+            n_tables = built[0] if built is not None else 16
+        if n_bits is None:
+            n_bits = built[1] if built is not None else 8
+        parameters = (int(n_tables), int(n_bits), 0)
+        if built is not None and built[:2] == parameters[:2]:
+            # keep the random seed of the library index
+            parameters = built
+        library = _build_search_structure(
+            library,
+            self.library,
+            built,
+            parameters,
+            CompiledTemplateLibrary.build_ann_index,
+        )
+
+        matches = _correlate_in_chunks(
+            signal,
+            partial(correlate_library_ann, n_probes=n_probes),
+            library,
+            n_largest,
+            method,
+            mask,
+            chunk_size,
+            compact,
+        )
+
+        return _get_matching_results(matches, signal, compact)
+
+
+def _get_compiled_library(library, image_shape, polar=False, dr=1, dt=None):
+    """The CompiledTemplateLibrary matched with patterns of a given shape.
+
+    Parameters
+    ----------
+    library : DiffractionLibrary or CompiledTemplateLibrary
+        Library of the indexation generator. A DiffractionLibrary is compiled,
+        a CompiledTemplateLibrary is checked and returned as is.
+    image_shape : tuple
+        Shape (height, width) of the diffraction patterns.
+    polar : bool
+        Whether the library is matched on the polar grid.
+    dr, dt : float
+        Polar grid spacing used to compile a DiffractionLibrary, see
+        :meth:`CompiledTemplateLibrary.from_diffraction_library_polar`.
+
+    Returns
+    -------
+    library : CompiledTemplateLibrary
+    """
+    if isinstance(library, CompiledTemplateLibrary):
+        if polar and not library.is_polar:
+            raise ValueError(
+                "The library must be compiled with "
+                "CompiledTemplateLibrary.from_diffraction_library_polar()."
+            )
+        if library.is_polar and not polar:
+            raise ValueError("Polar libraries must be matched with correlate_polar().")
+        _check_library_shape(library, image_shape)
+        return library
+    if polar:
+        return CompiledTemplateLibrary.from_diffraction_library_polar(
+            library, image_shape, dr=dr, dt=dt
+        )
+    return CompiledTemplateLibrary.from_diffraction_library(library, image_shape)
+
+
+def _build_search_structure(library, user_library, built, parameters, build):
+    """The library with a search structure built with given parameters.
+
+    Parameters
+    ----------
+    library : CompiledTemplateLibrary
+        Compiled library to be matched.
+    user_library : DiffractionLibrary or CompiledTemplateLibrary
+        Library of the indexation generator. If it is `library`, the
+        structure is built on a copy so that it is not modified.
+    built : tuple
+        Parameters the structure of `library` was built with.
+    parameters : tuple
+        Parameters of the structure to be matched with.
+    build : callable
+        Method of CompiledTemplateLibrary building the structure, called
+        with `parameters`.
+
+    Returns
+    -------
+    library : CompiledTemplateLibrary
+    """
+    if built == parameters:
+        return library
+    if library is user_library:
+        library = library.copy()
+    build(library, *parameters)
+    return library
+
+
+def _check_library_shape(library, image_shape):
+    """Raises a ValueError if a CompiledTemplateLibrary was compiled for
+    patterns of another shape."""
+    if library.detector_shape != tuple(image_shape):
+        raise ValueError(
+            "The library was compiled for patterns of shape {}, but the "
+            "signal has patterns of shape {}.".format(
+                library.detector_shape, tuple(image_shape)
+            )
+        )
+
+
+def _get_navigation_mask(mask, nav_shape):
+    """Boolean navigation mask of the positions to be indexed.
+
+    Parameters
+    ----------
+    mask : Array, Signal, scalar or None
+        Mask with one value per navigation position of the signal, e.g. from
+        :meth:`Diffraction2D.get_navigation_mask`, where non zero values mark
+        the positions to be indexed. None or a scalar indexes all positions.
+    nav_shape : tuple
+        Navigation shape of the signal, in array order.
+
+    Returns
+    -------
+    mask : numpy.array or None
+        Boolean array of shape nav_shape, or None to index all positions.
+    """
+    if mask is None or np.isscalar(mask):
+        return None
+    mask = np.asarray(getattr(mask, "data", mask), dtype=bool)
+    if mask.size != int(np.prod(nav_shape)):
+        raise ValueError(
+            "The mask shape {} does not match the navigation shape {} of the "
+            "signal.".format(mask.shape, tuple(nav_shape))
+        )
+    return mask.reshape(nav_shape)
+
+
+def _correlate_in_chunks(
+    signal,
+    correlation_function,
+    library,
+    n_largest,
+    method,
+    mask,
+    chunk_size,
+    compact=False,
+):
+    """Runs a stack correlation function, such as `correlate_library_sparse`,
+    over the navigation space of a signal in chunks of `chunk_size` patterns.
+
+    Parameters
+    ----------
+    signal : ElectronDiffraction2D
+        The signal of electron diffraction patterns to be indexed, may be lazy.
+    correlation_function : callable
+        Function taking (images, library, n_largest, method) and returning
+        an array of shape (n_images, <num phases>*n_largest, 3).
+    library : CompiledTemplateLibrary
+        Library compiled for the signal shape of `signal`.
+    n_largest : int
+        The number of well correlated simulations to be retained.
+    method : str
+        Name of method used to compute correlation.
+    mask : Array
+        Navigation mask, see :func:`_get_navigation_mask`.
+    chunk_size : int
+        Number of patterns correlated at once.
+    compact : bool
+        If True the results of each chunk are converted to typed arrays as
+        they are computed.
+
+    Returns
+    -------
+    matches : numpy.array or tuple
+        Object array of shape (<navigation shape>, <num phases>*n_largest, 3),
+        or if compact the (phase_index, euler, correlation) arrays returned by
+        `matches_to_arrays`.
+    """
+    nav_shape = signal.axes_manager.navigation_shape[::-1]
+    sig_shape = signal.axes_manager.signal_shape[::-1]
+    n_patterns = int(np.prod(nav_shape))
+    images = signal.data.reshape((n_patterns,) + sig_shape)
+
+    mask = _get_navigation_mask(mask, nav_shape)
+    if mask is None:
+        positions = np.arange(n_patterns)
+    else:
+        positions = np.flatnonzero(mask)
+
+    n_matches = len(library) * n_largest
+    if compact:
+        phase_index = np.full((n_patterns, n_matches), -1, dtype=np.int32)
+        euler = np.full((n_patterns, n_matches, 3), np.nan)
+        correlation = np.full((n_patterns, n_matches), np.nan)
+    else:
+        matches = np.empty((n_patterns, n_matches, 3), dtype="object")
+    for start in range(0, len(positions), chunk_size):
+        chunk = positions[start : start + chunk_size]
+        chunk_matches = correlation_function(
+            np.asarray(images[chunk]), library, n_largest, method
+        )
+        if compact:
+            chunk_phase_index, chunk_euler, chunk_correlation = matches_to_arrays(
+                chunk_matches
+            )
+            phase_index[chunk] = chunk_phase_index
+            euler[chunk] = chunk_euler
+            correlation[chunk] = chunk_correlation
+        else:
+            matches[chunk] = chunk_matches
+
+    if compact:
+        return (
+            phase_index.reshape(nav_shape + (n_matches,)),
+            euler.reshape(nav_shape + (n_matches, 3)),
+            correlation.reshape(nav_shape + (n_matches,)),
+        )
+    return matches.reshape(nav_shape + matches.shape[1:])
+
+
+def _correlate_prescreened(
+    images, library, n_largest, method, threshold, pruning_counts
+):
+    """Runs `correlate_library_sparse` on the phases selected by
+    `prescreen_phases`, adding the number of skipped correlations to
+    `pruning_counts`."""
+    phase_mask = prescreen_phases(images, library, threshold)
+    n_templates = np.array([len(phase["orientations"]) for phase in library.values()])
+    pruned_phases = np.count_nonzero(~phase_mask, axis=0)
+    pruning_counts["phase_correlations"] += int(pruned_phases.sum())
+    pruning_counts["template_correlations"] += int(pruned_phases.dot(n_templates))
+    return correlate_library_sparse(
+        images, library, n_largest, method, phase_mask=phase_mask
+    )
+
+
+def _get_matching_results(matches, signal, compact):
+    """Wraps correlation results over the navigation space of a signal.
+
+    Parameters
+    ----------
+    matches : numpy.array or tuple
+        Object array of shape (<navigation shape>, m, 3), or the tuple of
+        typed arrays returned by `matches_to_arrays`.
+    signal : ElectronDiffraction2D
+        The indexed signal, whose navigation axes calibration is transferred.
+    compact : bool
+        If True returns CompactTemplateMatchingResults, otherwise
+        TemplateMatchingResults.
+
+    Returns
+    -------
+    matching_results : TemplateMatchingResults or CompactTemplateMatchingResults
+    """
+    if compact:
+        if not isinstance(matches, tuple):
+            matches = matches_to_arrays(matches)
+        return CompactTemplateMatchingResults.from_arrays(*matches, signal=signal)
+
+    matching_results = TemplateMatchingResults(matches)
+    matching_results = transfer_navigation_axes(matching_results, signal)
+
+    return matching_results
+
 
 class ProfileIndexationGenerator:
     """Generates an indexer for data using a number of methods.
 
     Parameters
     ----------
-    profile : ElectronDiffraction1D
-        The signal of diffraction profiles to be indexed.
-    library : ProfileSimulation
+    magnitudes : array_like or BaseSignal
+        The peak magnitudes of a diffraction profile to be indexed, or a
+        signal holding the peak magnitudes of the profile at each navigation
+        position.
+    simulation : ProfileSimulation
         The simulated profile data.
+    mapping : bool
+        If True (default) and `magnitudes` is a signal, the profile at each
+        navigation position is indexed.
 
     """
 
@@ -165,7 +951,9 @@ class ProfileIndexationGenerator:
         Parameters
         ----------
         tolerance : float
-            The n orientations with the highest correlation values are returned.
+            Max allowed difference in percent between a peak magnitude and a
+            simulated magnitude for assigning the hkl of the latter to the
+            peak.
         keys : list
             If more than one phase present in library it is recommended that
             these are submitted. This allows a mapping from the number to the
@@ -179,9 +967,27 @@ class ProfileIndexationGenerator:
         Returns
         -------
         matching_results : ProfileIndexation
+            The indexation of the profile, or a signal of the indexation of
+            the profile at each navigation position.
 
         """
-        return index_magnitudes(np.array(self.magnitudes), self.simulation, tolerance)
+        magnitude_index = get_magnitude_index(self.simulation)
+        if self.map and isinstance(self.magnitudes, BaseSignal):
+            return self.magnitudes.map(
+                index_magnitudes,
+                simulation=self.simulation,
+                tolerance=tolerance,
+                magnitude_index=magnitude_index,
+                inplace=False,
+                *args,
+                **kwargs,
+            )
+        return index_magnitudes(
+            np.array(self.magnitudes),
+            self.simulation,
+            tolerance,
+            magnitude_index=magnitude_index,
+        )
 
 
 def _refine_best_orientations(
@@ -416,6 +1222,222 @@ def _refine_orientation(
     return res
 
 
+def _get_refinement_positions(orientations, vectors):
+    """Gathers the solutions and diffraction vectors at each navigation
+    position, in the order map() iterates over them.
+
+    Returns
+    -------
+    nav_shape : tuple
+        Navigation shape of `orientations`, in array order.
+    positions : list
+        The (single_match_result, k_xy) of each navigation position, with
+        k_xy as a float array of shape (n_peaks, 2).
+    """
+    nav_shape = tuple(orientations.axes_manager.navigation_shape[::-1])
+    positions = []
+    for position in np.ndindex(nav_shape):
+        single_match_result = orientations.data[position]
+        if not isinstance(single_match_result[0], tuple):  # pragma: no cover
+            single_match_result = single_match_result[0]
+        k_xy = vectors.data[position]
+        if k_xy.dtype == "object":
+            k_xy = k_xy[0]
+        positions.append(
+            (single_match_result, np.asarray(k_xy, dtype=float).reshape(-1, 2))
+        )
+    return nav_shape, positions
+
+
+def _stack_refinement_results(results, nav_shape):
+    """Arranges the (top_matches, rhkls) refined at each navigation position
+    like the data of map() over `_refine_best_orientations`."""
+    indexation = np.empty(len(results), dtype="object")
+    rhkls = np.empty(len(results), dtype="object")
+    for i, (top_matches, position_rhkls) in enumerate(results):
+        indexation[i] = top_matches
+        rhkls[i] = position_rhkls
+
+    if nav_shape == ():
+        return indexation[0], rhkls[0]
+    return indexation.reshape(nav_shape), rhkls.reshape(nav_shape)
+
+
+def _refine_positions(
+    positions,
+    library,
+    accelarating_voltage,
+    camera_length,
+    n_best=0,
+    rank=0,
+    index_error_tol=0.2,
+    method="leastsq",
+    vary_angles=True,
+    vary_center=False,
+    vary_scale=False,
+):
+    """Refines the solutions of a list of navigation positions.
+
+    With method 'batched' all the solutions are refined at once with
+    :func:`refine_orientations`, otherwise each position is refined with
+    lmfit by `_refine_best_orientations`.
+
+    Parameters
+    ----------
+    positions : list
+        The (single_match_result, k_xy) of each navigation position, see
+        `_get_refinement_positions`.
+
+    Returns
+    -------
+    results : list
+        The (top_matches, rhkls) of each position.
+    """
+    if method != "batched":
+        return [
+            tuple(
+                _refine_best_orientations(
+                    single_match_result,
+                    k_xy,
+                    library,
+                    accelarating_voltage=accelarating_voltage,
+                    camera_length=camera_length,
+                    n_best=n_best,
+                    rank=rank,
+                    index_error_tol=index_error_tol,
+                    method="leastsq",
+                    vary_angles=vary_angles,
+                    vary_center=vary_center,
+                    vary_scale=vary_scale,
+                )
+            )
+            for single_match_result, k_xy in positions
+        ]
+
+    # Gather the solutions to refine and their vectors over all positions
+    solutions, peaks, n_refined = [], [], []
+    for single_match_result, k_xy in positions:
+        n_matches = len(single_match_result)
+        n = min(n_matches, n_best if n_best else n_matches - rank)
+        solutions += [
+            get_nth_best_solution(single_match_result, rank=i)
+            for i in range(rank, rank + n)
+        ]
+        peaks += [k_xy] * n
+        n_refined.append(n)
+
+    num_peaks = np.array([len(k_xy) for k_xy in peaks], dtype=int)
+    peak_mask = np.arange(num_peaks.max(initial=0)) < num_peaks[:, None]
+    k_xy = np.zeros(peak_mask.shape + (2,))
+    k_xy[peak_mask] = np.concatenate(peaks + [np.empty((0, 2))])
+
+    inverse_bases = np.array(
+        [np.linalg.inv(s.lattice.reciprocal().base) for s in library.structures]
+    )
+    phase_indices = np.array([s.phase_index for s in solutions], dtype=int)
+    rotations, centers, scales, hklss, error_hklss = refine_orientations(
+        k_xy,
+        peak_mask,
+        np.array([s.rotation_matrix for s in solutions]).reshape(-1, 3, 3),
+        np.array([(s.center_x, s.center_y) for s in solutions]).reshape(-1, 2),
+        np.array([s.scale for s in solutions], dtype=float),
+        inverse_bases[phase_indices],
+        get_electron_wavelength(accelarating_voltage),
+        vary_angles=vary_angles,
+        vary_center=vary_center,
+        vary_scale=vary_scale,
+    )
+
+    refined = []
+    for j, (solution, n) in enumerate(zip(solutions, num_peaks)):
+        error_hkls = error_hklss[j, :n]
+        valid_peak_count = np.count_nonzero(
+            np.max(error_hkls, axis=-1) < index_error_tol
+        )
+        refined.append(
+            OrientationResult(
+                phase_index=solution.phase_index,
+                rotation_matrix=rotations[j],
+                match_rate=(valid_peak_count * (1 / n)) if n else 0,
+                error_hkls=error_hkls,
+                total_error=np.mean(error_hkls),
+                scale=scales[j],
+                center_x=centers[j, 0],
+                center_y=centers[j, 1],
+            )
+        )
+    rhklss = [np.rint(hklss[j, :n]) for j, n in enumerate(num_peaks)]
+
+    # Split the results back over the navigation positions
+    results = []
+    start = 0
+    for n in n_refined:
+        top_matches = np.empty(n, dtype="object")
+        for i in range(n):
+            top_matches[i] = refined[start + i]
+        results.append((top_matches, np.asarray(rhklss[start : start + n])))
+        start += n
+    return results
+
+
+# Library of the refinement worker processes, set once per worker
+_worker_library = None
+
+
+def _init_refinement_worker(library):
+    global _worker_library
+    _worker_library = library
+
+
+def _refine_shard(positions, kwargs):
+    return _refine_positions(positions, _worker_library, **kwargs)
+
+
+def _refine_positions_parallel(positions, library, n_jobs, show_progressbar, **kwargs):
+    """Refines navigation positions with `_refine_positions` in a pool of
+    `n_jobs` processes.
+
+    The library is sent once to each worker, and the positions are split into
+    contiguous shards whose results are reassembled in order.
+
+    Returns
+    -------
+    results : list
+        The (top_matches, rhkls) of each position.
+    report : dict
+        'n_jobs', 'n_positions', 'time' (seconds) and 'positions_per_second'.
+    """
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count() or 1
+    start = time.perf_counter()
+    n_shards = min(len(positions), 4 * n_jobs)
+    bounds = np.linspace(0, len(positions), n_shards + 1).astype(int)
+    results = [None] * n_shards
+    with ProcessPoolExecutor(
+        max_workers=n_jobs, initializer=_init_refinement_worker, initargs=(library,),
+    ) as executor:
+        futures = {
+            executor.submit(_refine_shard, positions[i:j], kwargs): shard
+            for shard, (i, j) in enumerate(zip(bounds[:-1], bounds[1:]))
+        }
+        with tqdm(
+            total=len(positions), unit="positions", disable=not show_progressbar
+        ) as progressbar:
+            for future in as_completed(futures):
+                shard = futures[future]
+                results[shard] = future.result()
+                progressbar.update(len(results[shard]))
+    elapsed = time.perf_counter() - start
+
+    report = {
+        "n_jobs": n_jobs,
+        "n_positions": len(positions),
+        "time": elapsed,
+        "positions_per_second": len(positions) / elapsed if elapsed else 0.0,
+    }
+    return [result for shard in results for result in shard], report
+
+
 class VectorIndexationGenerator:
     """Generates an indexer for DiffractionVectors using a number of methods.
 
@@ -426,6 +1448,9 @@ class VectorIndexationGenerator:
     vector_library : DiffractionVectorLibrary
         Library of theoretical diffraction vector magnitudes and inter-vector
         angles for indexation.
+    refinement_report : dict or None
+        Number of processes, number of navigation positions, run time in
+        seconds and throughput of the last refinement run with `n_jobs`.
 
     Parameters
     ----------
@@ -446,6 +1471,7 @@ class VectorIndexationGenerator:
         else:
             self.vectors = vectors
             self.library = vector_library
+            self.refinement_report = None
 
     def index_vectors(
         self,
@@ -454,6 +1480,8 @@ class VectorIndexationGenerator:
         index_error_tol,
         n_peaks_to_index,
         n_best,
+        misorientation_tol=None,
+        n_grains=1,
         *args,
         **kwargs,
     ):
@@ -474,6 +1502,16 @@ class VectorIndexationGenerator:
             The maximum number of peak to index.
         n_best : int
             The maximum number of good solutions to be retained.
+        misorientation_tol : float, optional
+            If given, solutions misoriented by less than this angle in degrees
+            from a better solution, under the rotational symmetry of the phase
+            lattice, are discarded so that the n_best solutions are distinct
+            orientations. If None (default) all solutions are kept.
+        n_grains : int
+            The maximum number of overlapping grains indexed in each pattern.
+            After each grain the peaks indexed by its best solution are removed
+            and the remaining peaks are indexed again. The n_best solutions of
+            each grain follow those of the previous grain. Default is 1.
         *args : arguments
             Arguments passed to the map() function.
         **kwargs : arguments
@@ -496,6 +1534,8 @@ class VectorIndexationGenerator:
             index_error_tol=index_error_tol,
             n_peaks_to_index=n_peaks_to_index,
             n_best=n_best,
+            misorientation_tol=misorientation_tol,
+            n_grains=n_grains,
             inplace=False,
             *args,
             **kwargs,
@@ -525,6 +1565,7 @@ class VectorIndexationGenerator:
         vary_center=False,
         vary_scale=False,
         method="leastsq",
+        n_jobs=None,
     ):
         """Refines the best orientation and assigns hkl indices to diffraction vectors.
 
@@ -539,13 +1580,22 @@ class VectorIndexationGenerator:
             Minimization algorithm to use, choose from:
             'leastsq', 'nelder', 'powell', 'cobyla', 'least-squares'.
             See `lmfit` documentation (https://lmfit.github.io/lmfit-py/fitting.html)
-            for more information.
+            for more information. Alternatively 'batched' refines the
+            solutions of all navigation positions at once, with vectorized
+            Levenberg-Marquardt steps using analytic Jacobians, see
+            :func:`pyxem.utils.indexation_utils.refine_orientations`.
         vary_angles : bool,
             Free the euler angles (rotation matrix) during the refinement.
         vary_center : bool
             Free the center of the diffraction pattern (beam center) during the refinement.
         vary_scale : bool
             Free the scale (i.e. pixel size) of the diffraction vectors during refinement.
+        n_jobs : int, optional
+            If given, the navigation positions are refined in a pool of
+            `n_jobs` processes, or one per CPU if `n_jobs` < 1, with a progress
+            bar. The run time and throughput are stored in
+            `refinement_report`. If None (default) the positions are refined
+            in this process.
 
         Returns
         -------
@@ -567,6 +1617,7 @@ class VectorIndexationGenerator:
             vary_angles=vary_angles,
             vary_center=vary_center,
             vary_scale=vary_scale,
+            n_jobs=n_jobs,
         )
 
     def refine_n_best_orientations(
@@ -581,6 +1632,7 @@ class VectorIndexationGenerator:
         vary_center=False,
         vary_scale=False,
         method="leastsq",
+        n_jobs=None,
     ):
         """Refines the best orientation and assigns hkl indices to diffraction vectors.
 
@@ -604,13 +1656,22 @@ class VectorIndexationGenerator:
             Minimization algorithm to use, choose from:
             'leastsq', 'nelder', 'powell', 'cobyla', 'least-squares'.
             See `lmfit` documentation (https://lmfit.github.io/lmfit-py/fitting.html)
-            for more information.
+            for more information. Alternatively 'batched' refines the
+            solutions of all navigation positions at once, with vectorized
+            Levenberg-Marquardt steps using analytic Jacobians, see
+            :func:`pyxem.utils.indexation_utils.refine_orientations`.
         vary_angles : bool,
             Free the euler angles (rotation matrix) during the refinement.
         vary_center : bool
             Free the center of the diffraction pattern (beam center) during the refinement.
         vary_scale : bool
             Free the scale (i.e. pixel size) of the diffraction vectors during refinement.
+        n_jobs : int, optional
+            If given, the navigation positions are refined in a pool of
+            `n_jobs` processes, or one per CPU if `n_jobs` < 1, with a progress
+            bar. The run time and throughput are stored in
+            `refinement_report`. If None (default) the positions are refined
+            in this process.
 
         Returns
         -------
@@ -621,25 +1682,47 @@ class VectorIndexationGenerator:
         vectors = self.vectors
         library = self.library
 
-        matched = orientations.map(
-            _refine_best_orientations,
-            vectors=vectors,
-            library=library,
+        refinement_kwargs = dict(
             accelarating_voltage=accelarating_voltage,
             camera_length=camera_length,
             n_best=n_best,
             rank=rank,
-            method="leastsq",
-            verbose=False,
+            index_error_tol=index_error_tol,
+            method=method,
             vary_angles=vary_angles,
             vary_center=vary_center,
             vary_scale=vary_scale,
-            inplace=False,
-            parallel=False,
         )
+        if n_jobs is not None:
+            nav_shape, positions = _get_refinement_positions(orientations, vectors)
+            results, self.refinement_report = _refine_positions_parallel(
+                positions, library, n_jobs, show_progressbar=True, **refinement_kwargs
+            )
+            indexation, rhkls = _stack_refinement_results(results, nav_shape)
+        elif method == "batched":
+            nav_shape, positions = _get_refinement_positions(orientations, vectors)
+            results = _refine_positions(positions, library, **refinement_kwargs)
+            indexation, rhkls = _stack_refinement_results(results, nav_shape)
+        else:
+            matched = orientations.map(
+                _refine_best_orientations,
+                vectors=vectors,
+                library=library,
+                accelarating_voltage=accelarating_voltage,
+                camera_length=camera_length,
+                n_best=n_best,
+                rank=rank,
+                method="leastsq",
+                verbose=False,
+                vary_angles=vary_angles,
+                vary_center=vary_center,
+                vary_scale=vary_scale,
+                inplace=False,
+                parallel=False,
+            )
 
-        indexation = matched.isig[0]
-        rhkls = matched.isig[1].data
+            indexation = matched.isig[0]
+            rhkls = matched.isig[1].data
 
         indexation_results = VectorMatchingResults(indexation)
         indexation_results.vectors = vectors
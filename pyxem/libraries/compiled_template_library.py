@@ -0,0 +1,476 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2020 The pyXem developers
+#
+# This file is part of pyXem.
+#
+# pyXem is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyXem is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
+
+import h5py
+import numpy as np
+from scipy import sparse
+
+from pyxem.utils.indexation_utils import (
+    get_template_matrix,
+    get_polar_pixel_coords,
+    get_orientation_hierarchy,
+    get_orientation_neighbours,
+    get_low_rank_templates,
+    get_lsh_projections,
+    build_lsh_index,
+)
+
+# Arrays stored for each phase, all other phase entries are derived on load.
+_PHASE_ARRAYS = (
+    "orientations",
+    "indptr",
+    "indices",
+    "intensities",
+    "pattern_norms",
+    "average_pattern_intensities",
+    "zero_mean_norms",
+)
+# Arrays stored for each phase of a library compressed with build_low_rank.
+_LOW_RANK_ARRAYS = ("low_rank_basis", "low_rank_templates")
+# Arrays stored for each phase of a library indexed with build_ann_index, the
+# hyperplanes are regenerated from the seed on loading.
+_ANN_ARRAYS = ("ann_keys", "ann_order")
+
+
+def _build_template_matrix(phase, image_shape):
+    """Wraps the stored CSR arrays of a phase in a sparse matrix, without
+    copying them."""
+    return sparse.csr_matrix(
+        (phase["intensities"], phase["indices"], phase["indptr"]),
+        shape=(len(phase["indptr"]) - 1, image_shape[0] * image_shape[1]),
+        copy=False,
+    )
+
+
+def _read_dataset(filename, dataset, mmap_mode):
+    """Reads an HDF5 dataset as a numpy.memmap when it is stored contiguously,
+    otherwise reads it into memory."""
+    offset = dataset.id.get_offset()
+    if mmap_mode is None or offset is None:
+        return dataset[()]
+    return np.memmap(
+        filename,
+        mode=mmap_mode,
+        dtype=dataset.dtype,
+        shape=dataset.shape,
+        offset=offset,
+    )
+
+
+def _save_hierarchy(group, phase):
+    """Writes the hierarchy levels and neighbour matrices of a phase."""
+    for level, template_indices in enumerate(phase["hierarchy_levels"]):
+        group.create_dataset("level_{}".format(level), data=template_indices)
+    for level, neighbours in enumerate(phase["hierarchy_neighbours"]):
+        group.create_dataset(
+            "neighbours_{}_indptr".format(level), data=neighbours.indptr
+        )
+        group.create_dataset(
+            "neighbours_{}_indices".format(level), data=neighbours.indices
+        )
+
+
+def _load_hierarchy(group, n_levels):
+    """Reads the hierarchy levels and neighbour matrices of a phase."""
+    levels = [group["level_{}".format(level)][()] for level in range(n_levels)]
+    neighbours = []
+    for level in range(n_levels - 1):
+        indices = group["neighbours_{}_indices".format(level)][()]
+        neighbours.append(
+            sparse.csr_matrix(
+                (
+                    np.ones(len(indices), dtype=bool),
+                    indices,
+                    group["neighbours_{}_indptr".format(level)][()],
+                ),
+                shape=(len(levels[level]), len(levels[level + 1])),
+            )
+        )
+    return levels, neighbours
+
+
+class CompiledTemplateLibrary(dict):
+    """Maps crystal structure (phase) to the templates of a DiffractionLibrary
+    packed as contiguous arrays for a fixed detector shape.
+
+    Each phase entry holds the (n, 3) 'orientations', the templates as the
+    'indptr', 'indices' and 'intensities' arrays of a CSR matrix over the
+    flattened detector, the 'template_matrix' built from them, and the
+    precomputed 'pattern_norms', 'average_pattern_intensities' and
+    'zero_mean_norms' used by the correlation methods.
+
+    Attributes
+    ----------
+    image_shape : tuple
+        Shape (height, width) of the diffraction patterns the library was
+        compiled for, or (nr, ntheta) for a polar library.
+    detector_shape : tuple
+        Shape (height, width) of the cartesian diffraction patterns to be
+        matched. Equal to image_shape unless the library is polar.
+    polar_sampling : tuple
+        Radial and angular spacing (dr, dt) of the polar grid, None for a
+        cartesian library.
+    theta_step : float
+        Angular spacing of the polar grid in radians, None for a cartesian
+        library.
+    hierarchy_resolutions : tuple
+        Angular resolutions (degrees) of the coarse levels built by
+        :meth:`build_hierarchy`, None if no hierarchy was built.
+    neighbour_radius : float
+        Misorientation (degrees) within which templates are linked by
+        :meth:`build_neighbours`, None if no neighbours were built.
+    low_rank : int
+        Number of singular vectors of the compressed templates built by
+        :meth:`build_low_rank`, None if the library was not compressed.
+    ann_parameters : tuple
+        Number of tables, bits per table and random seed of the approximate
+        nearest neighbour index built by :meth:`build_ann_index`, None if no
+        index was built.
+    """
+
+    def __init__(self, image_shape, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.image_shape = tuple(int(i) for i in image_shape)
+        self.detector_shape = self.image_shape
+        self.polar_sampling = None
+        self.theta_step = None
+        self.hierarchy_resolutions = None
+        self.neighbour_radius = None
+        self.low_rank = None
+        self.ann_parameters = None
+
+    @property
+    def is_polar(self):
+        """True if the templates are sampled on a polar grid."""
+        return self.polar_sampling is not None
+
+    @classmethod
+    def from_diffraction_library(cls, library, image_shape):
+        """Compiles a DiffractionLibrary for diffraction patterns of a given
+        shape.
+
+        Parameters
+        ----------
+        library : DiffractionLibrary
+            Library with 'orientations', 'pixel_coords' and 'intensities'
+            entries for each phase. The library is not modified.
+        image_shape : tuple
+            Shape (height, width) of the diffraction patterns to be matched.
+
+        Returns
+        -------
+        compiled_library : CompiledTemplateLibrary
+        """
+        compiled_library = cls(image_shape)
+        for phase_name, library_entry in library.items():
+            compiled_library._add_phase(
+                phase_name,
+                library_entry["orientations"],
+                library_entry["pixel_coords"],
+                library_entry["intensities"],
+            )
+
+        return compiled_library
+
+    @classmethod
+    def from_diffraction_library_polar(cls, library, image_shape, dr=1, dt=None):
+        """Compiles a DiffractionLibrary on the polar grid used by
+        :func:`pyxem.utils.expt_utils.reproject_polar` for diffraction
+        patterns of a given shape.
+
+        Polar libraries are matched with
+        :meth:`IndexationGenerator.correlate_polar`, which searches all
+        in-plane rotations at once, so the library only needs to sample the
+        out-of-plane orientations.
+
+        Parameters
+        ----------
+        library : DiffractionLibrary
+            Library with 'orientations', 'pixel_coords' and 'intensities'
+            entries for each phase. The library is not modified.
+        image_shape : tuple
+            Shape (height, width) of the cartesian diffraction patterns.
+        dr : float
+            Radial coordinate spacing of the polar grid.
+        dt : float
+            Angular coordinate spacing (in radians) of the polar grid. If
+            None, the number of theta values is equal to the largest
+            dimension of the patterns.
+
+        Returns
+        -------
+        compiled_library : CompiledTemplateLibrary
+        """
+        _, polar_shape, theta_step = get_polar_pixel_coords(
+            [], image_shape, dr=dr, dt=dt
+        )
+        compiled_library = cls(polar_shape)
+        compiled_library.detector_shape = tuple(int(i) for i in image_shape)
+        compiled_library.polar_sampling = (dr, dt)
+        compiled_library.theta_step = theta_step
+
+        for phase_name, library_entry in library.items():
+            polar_coords, _, _ = get_polar_pixel_coords(
+                library_entry["pixel_coords"], image_shape, dr=dr, dt=dt
+            )
+            compiled_library._add_phase(
+                phase_name,
+                library_entry["orientations"],
+                polar_coords,
+                library_entry["intensities"],
+            )
+
+        return compiled_library
+
+    def _add_phase(self, phase_name, orientations, pixel_coords, intensities):
+        """Packs the templates of a phase and adds them to the library."""
+        template_matrix, template_statistics = get_template_matrix(
+            pixel_coords, intensities, self.image_shape
+        )
+        index_dtype = (
+            np.int32
+            if max(template_matrix.nnz, template_matrix.shape[1])
+            < np.iinfo(np.int32).max
+            else np.int64
+        )
+        phase = {
+            "orientations": np.array(
+                [np.asarray(o, dtype=np.float64) for o in orientations]
+            ).reshape(-1, 3),
+            "indptr": template_matrix.indptr.astype(index_dtype),
+            "indices": template_matrix.indices.astype(index_dtype),
+            "intensities": template_matrix.data.astype(np.float64),
+        }
+        phase.update(template_statistics)
+        phase["template_matrix"] = _build_template_matrix(phase, self.image_shape)
+        self[phase_name] = phase
+
+    def copy(self):
+        """Copy of the library sharing its arrays, whose phase entries and
+        search structures can be rebuilt without modifying this library.
+
+        Returns
+        -------
+        compiled_library : CompiledTemplateLibrary
+        """
+        compiled_library = type(self)(self.image_shape)
+        compiled_library.__dict__.update(self.__dict__)
+        for phase_name, phase in self.items():
+            compiled_library[phase_name] = dict(phase)
+        return compiled_library
+
+    def build_hierarchy(self, resolutions):
+        """Builds the coarse-to-fine orientation hierarchy used by
+        :meth:`IndexationGenerator.correlate_hierarchical`.
+
+        The 'hierarchy_levels' and 'hierarchy_neighbours' of each phase are
+        set as returned by
+        :func:`pyxem.utils.indexation_utils.get_orientation_hierarchy`.
+
+        Parameters
+        ----------
+        resolutions : list of float
+            Angular resolutions (degrees) of the coarse levels, from which
+            the search is refined down to the full library.
+        """
+        resolutions = tuple(sorted((float(r) for r in resolutions), reverse=True))
+        for phase in self.values():
+            levels, neighbours = get_orientation_hierarchy(
+                phase["orientations"], resolutions
+            )
+            phase["hierarchy_levels"] = levels
+            phase["hierarchy_neighbours"] = neighbours
+        self.hierarchy_resolutions = resolutions
+
+    def build_neighbours(self, radius):
+        """Links each template to the templates of the same phase within a
+        misorientation `radius`, as used by
+        :meth:`IndexationGenerator.correlate_coherent`.
+
+        The 'orientation_neighbours' of each phase are set as returned by
+        :func:`pyxem.utils.indexation_utils.get_orientation_neighbours`. They
+        are not saved with the library.
+
+        Parameters
+        ----------
+        radius : float
+            Largest misorientation (degrees) between neighbouring templates.
+        """
+        for phase in self.values():
+            phase["orientation_neighbours"] = get_orientation_neighbours(
+                phase["orientations"], radius
+            )
+        self.neighbour_radius = float(radius)
+
+    def build_low_rank(self, rank):
+        """Compresses the templates of each phase with a truncated singular
+        value decomposition, as used by
+        :meth:`IndexationGenerator.correlate_low_rank`.
+
+        The 'low_rank_basis' and 'low_rank_templates' of each phase are set
+        as returned by
+        :func:`pyxem.utils.indexation_utils.get_low_rank_templates`, and are
+        saved with the library.
+
+        Parameters
+        ----------
+        rank : int
+            Number of singular vectors retained for each phase.
+        """
+        for phase in self.values():
+            basis, projected_templates = get_low_rank_templates(
+                phase["template_matrix"], rank
+            )
+            phase["low_rank_basis"] = basis
+            phase["low_rank_templates"] = projected_templates
+        self.low_rank = int(rank)
+
+    def build_ann_index(self, n_tables=16, n_bits=8, seed=0):
+        """Builds the locality sensitive hashing index of each phase used
+        by :meth:`IndexationGenerator.correlate_ann`.
+
+        The 'ann_projections', 'ann_keys' and 'ann_order' of each phase are
+        set as described in :func:`pyxem.utils.indexation_utils.build_lsh_index`,
+        and the index is saved with the library.
+
+        Parameters
+        ----------
+        n_tables : int
+            Number of hash tables. More tables increase the recall at the cost
+            of scoring more templates.
+        n_bits : int
+            Number of bits of the hash of each table, at most 62. More bits
+            give smaller buckets, so fewer templates are scored but the
+            recall is lower.
+        seed : int
+            Seed of the random hyperplanes.
+        """
+        n_pixels = int(np.prod(self.image_shape))
+        projections = get_lsh_projections(n_pixels, n_tables, n_bits, seed)
+        for phase in self.values():
+            keys, order = build_lsh_index(phase["template_matrix"], projections, n_bits)
+            phase["ann_projections"] = projections
+            phase["ann_keys"] = keys
+            phase["ann_order"] = order
+        self.ann_parameters = (int(n_tables), int(n_bits), int(seed))
+
+    def save(self, filename):
+        """Saves the compiled library to an HDF5 file with contiguous
+        (unchunked, uncompressed) datasets, so that it can be memory-mapped
+        by :func:`load_CompiledTemplateLibrary`.
+
+        Parameters
+        ----------
+        filename : str
+            Path of the file to write.
+        """
+        with h5py.File(filename, "w") as f:
+            f.attrs["image_shape"] = self.image_shape
+            f.attrs["detector_shape"] = self.detector_shape
+            if self.is_polar:
+                dr, dt = self.polar_sampling
+                f.attrs["dr"] = dr
+                f.attrs["dt"] = np.nan if dt is None else dt
+                f.attrs["theta_step"] = self.theta_step
+            f.attrs["phase_names"] = np.array(list(self.keys()), dtype="S")
+            for phase_index, phase in enumerate(self.values()):
+                group = f.create_group("phase_{}".format(phase_index))
+                for key in _PHASE_ARRAYS:
+                    group.create_dataset(key, data=np.ascontiguousarray(phase[key]))
+                if self.hierarchy_resolutions is not None:
+                    _save_hierarchy(group.create_group("hierarchy"), phase)
+                if self.low_rank is not None:
+                    for key in _LOW_RANK_ARRAYS:
+                        group.create_dataset(key, data=phase[key])
+                if self.ann_parameters is not None:
+                    for key in _ANN_ARRAYS:
+                        group.create_dataset(key, data=phase[key])
+            if self.hierarchy_resolutions is not None:
+                f.attrs["hierarchy_resolutions"] = self.hierarchy_resolutions
+            if self.low_rank is not None:
+                f.attrs["low_rank"] = self.low_rank
+            if self.ann_parameters is not None:
+                f.attrs["ann_parameters"] = self.ann_parameters
+
+
+def load_CompiledTemplateLibrary(filename, mmap_mode="r"):
+    """Loads a CompiledTemplateLibrary saved with
+    :meth:`CompiledTemplateLibrary.save`.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the compiled library file.
+    mmap_mode : str or None
+        Mode used to memory-map the template arrays (see `numpy.memmap`), the
+        default 'r' shares a single read-only copy between processes. If None
+        the arrays are read into memory.
+
+    Returns
+    -------
+    compiled_library : CompiledTemplateLibrary
+    """
+    with h5py.File(filename, "r") as f:
+        compiled_library = CompiledTemplateLibrary(f.attrs["image_shape"])
+        compiled_library.detector_shape = tuple(
+            int(i) for i in f.attrs["detector_shape"]
+        )
+        if "theta_step" in f.attrs:
+            dt = float(f.attrs["dt"])
+            compiled_library.polar_sampling = (
+                float(f.attrs["dr"]),
+                None if np.isnan(dt) else dt,
+            )
+            compiled_library.theta_step = float(f.attrs["theta_step"])
+        if "low_rank" in f.attrs:
+            compiled_library.low_rank = int(f.attrs["low_rank"])
+        if "ann_parameters" in f.attrs:
+            n_tables, n_bits, seed = (int(i) for i in f.attrs["ann_parameters"])
+            compiled_library.ann_parameters = (n_tables, n_bits, seed)
+            projections = get_lsh_projections(
+                int(np.prod(compiled_library.image_shape)), n_tables, n_bits, seed
+            )
+        if "hierarchy_resolutions" in f.attrs:
+            compiled_library.hierarchy_resolutions = tuple(
+                float(r) for r in f.attrs["hierarchy_resolutions"]
+            )
+        phase_names = [name.decode() for name in f.attrs["phase_names"]]
+        for phase_index, phase_name in enumerate(phase_names):
+            group = f["phase_{}".format(phase_index)]
+            phase = {
+                key: _read_dataset(filename, group[key], mmap_mode)
+                for key in _PHASE_ARRAYS
+            }
+            phase["template_matrix"] = _build_template_matrix(
+                phase, compiled_library.image_shape
+            )
+            if compiled_library.low_rank is not None:
+                for key in _LOW_RANK_ARRAYS:
+                    phase[key] = _read_dataset(filename, group[key], mmap_mode)
+            if compiled_library.ann_parameters is not None:
+                for key in _ANN_ARRAYS:
+                    phase[key] = _read_dataset(filename, group[key], mmap_mode)
+                phase["ann_projections"] = projections
+            if compiled_library.hierarchy_resolutions is not None:
+                n_levels = len(compiled_library.hierarchy_resolutions) + 1
+                levels, neighbours = _load_hierarchy(group["hierarchy"], n_levels)
+                phase["hierarchy_levels"] = levels
+                phase["hierarchy_neighbours"] = neighbours
+            compiled_library[phase_name] = phase
+
+    return compiled_library
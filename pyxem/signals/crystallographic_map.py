@@ -16,14 +16,19 @@
 # You should have received a copy of the GNU General Public License
 # along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
 
+import h5py
 import numpy as np
 
-from hyperspy.signals import BaseSignal
-
-from transforms3d.euler import euler2quat, quat2axangle, euler2axangle
-from transforms3d.quaternions import qmult, qinverse
+from hyperspy.signals import BaseSignal, Signal2D
 
 from pyxem.signals import transfer_navigation_axes_to_signal_axes
+from pyxem.utils.orientation_utils import (
+    euler2quaternion,
+    quaternion2euler,
+    misorientation_angle,
+    reduce_to_fundamental_zone,
+    get_modal_orientation,
+)
 
 """
 Signal class for crystallographic phase and orientation maps.
@@ -56,93 +61,187 @@ def load_mtex_map(filename):
     # Add one for zero indexing
     x_max = np.max(load_array[:, 5]).astype(int) + 1
     y_max = np.max(load_array[:, 6]).astype(int) + 1
-    crystal_data = np.empty((y_max, x_max, 3), dtype="object")
-    for y in range(y_max):
-        for x in range(x_max):
-            load_index = y * x_max + x
-            crystal_data[y, x] = [
-                load_array[load_index, 0],
-                load_array[load_index, 1:4],
-                {"correlation": load_array[load_index, 4]},
-            ]
-    return CrystallographicMap(crystal_data)
-
-
-def _euler2axangle_signal(euler):
-    """Converts an Euler triple into the axis-angle representation.
-
-    Parameters
-    ----------
-    euler : np.array()
-        Euler angles for a rotation.
-
-    Returns
-    -------
-    asangle : np.array()
-        Axis-angle representation of the rotation.
-
-    """
-    euler = euler[0]  # TODO: euler is a 1-element ndarray(dtype=object) with a tuple
-    return np.rad2deg(
-        euler2axangle(np.deg2rad(euler[0]), np.deg2rad(euler[1]), np.deg2rad(euler[2]))[
-            1
-        ]
+    shape = (y_max, x_max)
+    return CrystallographicMap.from_arrays(
+        load_array[:, 0].reshape(shape),
+        load_array[:, 1:4].reshape(shape + (3,)),
+        {"correlation": load_array[:, 4].reshape(shape)},
     )
 
 
-def _distance_from_fixed_angle(angle, fixed_angle):
-    """Designed to be mapped, this function finds the smallest rotation between
-    two rotations. It assumes a no-symmettry system.
-
-    The algorithm involves converting angles to quarternions, then finding the
-    appropriate misorientation. It is tested against the slower more complete
-    version finding the joining rotation.
+def load_binary_map(filename):
+    """Loads a crystallographic map saved with
+    :meth:`CrystallographicMap.save_binary_map`.
 
     Parameters
     ----------
-    angle : np.array()
-        Euler angles representing rotation of interest.
-    fixed_angle : np.array()
-        Euler angles representing fixed reference rotation.
+    filename : str
+        Path to the file to be loaded, an .npz file or otherwise HDF5.
 
     Returns
     -------
-    theta : np.array()
-        Rotation angle between angle and fixed_angle.
+    crystallographic_map : CrystallographicMap
+        Crystallographic map loaded from the specified file.
 
     """
-    angle = angle[0]
-    q_data = euler2quat(*np.deg2rad(angle), axes="rzxz")
-    q_fixed = euler2quat(*np.deg2rad(fixed_angle), axes="rzxz")
-    if np.abs(2 * (np.dot(q_data, q_fixed)) ** 2 - 1) < 1:  # arcos will work
-        # https://math.stackexchange.com/questions/90081/quaternion-distance
-        theta = np.arccos(2 * (np.dot(q_data, q_fixed)) ** 2 - 1)
-    else:  # slower, but also good
-        q_from_mode = qmult(qinverse(q_fixed), q_data)
-        axis, theta = quat2axangle(q_from_mode)
-        theta = np.abs(theta)
-
-    return np.rad2deg(theta)
+    if str(filename).endswith(".npz"):
+        with np.load(filename) as f:
+            arrays = {key: f[key] for key in f.files}
+        method = str(arrays.pop("method"))
+    else:
+        with h5py.File(filename, "r") as f:
+            arrays = {key: f[key][()] for key in f.keys()}
+            method = f.attrs["method"]
+            if isinstance(method, bytes):  # pragma: no cover
+                method = method.decode()
+    phase = arrays.pop("phase")
+    euler = arrays.pop("euler")
+    scales = arrays.pop("navigation_scale")
+    offsets = arrays.pop("navigation_offset")
+
+    crystal_map = CrystallographicMap.from_arrays(
+        phase, euler, arrays, method=method if method else None
+    )
+    for ax, scale, offset in zip(
+        crystal_map.axes_manager.navigation_axes, scales, offsets
+    ):
+        ax.scale, ax.offset = scale, offset
+    return crystal_map
+
+
+def _write_rows(file, columns, row_format, chunk_size=2 ** 16):
+    """Writes columns of equal length as lines of text, formatting a chunk of
+    rows at a time with the row format repeated over the chunk."""
+    n_rows = len(columns[0])
+    for start in range(0, n_rows, chunk_size):
+        chunk = np.stack([column[start : start + chunk_size] for column in columns])
+        file.write((row_format * chunk.shape[1]) % tuple(chunk.T.ravel().tolist()))
+
+
+def _phase_descriptions(n_phases, phase_names=None, structures=None):
+    """Name, lattice lengths and lattice angles of each phase, as given by
+    the phase names and diffpy structures, if any."""
+    descriptions = []
+    for i in range(n_phases):
+        name = phase_names[i] if phase_names is not None else "Phase{}".format(i)
+        if structures is not None:
+            lattice = structures[i].lattice
+            lengths = (lattice.a, lattice.b, lattice.c)
+            angles = (lattice.alpha, lattice.beta, lattice.gamma)
+        else:
+            lengths, angles = (1.0, 1.0, 1.0), (90.0, 90.0, 90.0)
+        descriptions.append((name, lengths, angles))
+    return descriptions
 
 
-def _metric_from_dict(metric_dict, metric):
-    """ Utility function for retrieving an entry in a dictionary. Used to map
-    over dicts in signal space.
+def _rotation_angle(euler):
+    """Rotation angles of Euler triples.
 
     Parameters
     ----------
-    metric_dict : dict
-        Dictionary to retrieve entry from
-    metrics : str
-        Name of the entry
+    euler : np.array()
+        Array of shape (..., 3) of Euler angles in degrees, interpreted in the
+        default (sxyz) convention of transforms3d.euler.euler2axangle.
 
     Returns
     -------
-    entry
-        Dictionary entry specified by metric.
+    angle : np.array()
+        Array of shape (...) of the rotation angles in degrees.
 
     """
-    return metric_dict[0][metric]
+    half = np.deg2rad(np.asarray(euler, dtype=np.float64)) / 2
+    c, s = np.cos(half), np.sin(half)
+    # Real part and squared norm of the vector part of the quaternion of
+    # the rotation Rz(ak) Ry(aj) Rx(ai) (transforms3d's default sxyz axes)
+    w = c[..., 0] * c[..., 1] * c[..., 2] + s[..., 0] * s[..., 1] * s[..., 2]
+    vector = np.stack(
+        (
+            s[..., 0] * c[..., 1] * c[..., 2] - c[..., 0] * s[..., 1] * s[..., 2],
+            c[..., 0] * s[..., 1] * c[..., 2] + s[..., 0] * c[..., 1] * s[..., 2],
+            c[..., 0] * c[..., 1] * s[..., 2] - s[..., 0] * s[..., 1] * c[..., 2],
+        ),
+        axis=-1,
+    )
+    identity = np.sum(vector ** 2, axis=-1) < (3 * np.finfo(float).eps) ** 2
+    theta = 2 * np.arccos(np.clip(w, -1, 1))
+    return np.rad2deg(np.where(identity, 0.0, theta))
+
+
+def _chunked_misorientation_angle(q1, q2, symmetry, chunk_size=2 ** 16):
+    """:func:`misorientation_angle` of arrays of quaternions of broadcastable
+    shapes (..., 4), computed in chunks to bound the memory used by the
+    symmetry search."""
+    q1, q2 = np.broadcast_arrays(q1, q2)
+    shape = q1.shape[:-1]
+    q1, q2 = q1.reshape(-1, 4), q2.reshape(-1, 4)
+    angles = np.empty(len(q1))
+    for start in range(0, len(q1), chunk_size):
+        stop = start + chunk_size
+        angles[start:stop] = misorientation_angle(
+            q1[start:stop], q2[start:stop], symmetry
+        )
+    return angles.reshape(shape)
+
+
+def _neighbour_misorientations(q, symmetry):
+    """Misorientation angles between each position of an array of shape
+    (..., 4) of quaternions and its previous and next neighbour along each
+    axis, as an array of shape (..., 2 * (q.ndim - 1)), nan at the edges."""
+    ndim = q.ndim - 1
+    angles = np.full(q.shape[:-1] + (2 * ndim,), np.nan)
+    for axis in range(ndim):
+        lower = [slice(None)] * ndim
+        upper = [slice(None)] * ndim
+        lower[axis] = slice(None, -1)
+        upper[axis] = slice(1, None)
+        lower, upper = tuple(lower), tuple(upper)
+        step = _chunked_misorientation_angle(q[lower], q[upper], symmetry)
+        # The next neighbour of the lower and the previous of the upper ones
+        angles[lower + (2 * axis,)] = step
+        angles[upper + (2 * axis + 1,)] = step
+    return angles
+
+
+def _crystal_map_data(phase, euler, metrics):
+    """Object array of shape (..., 3) with entries
+    [phase, np.array((z, x, z)), dict(metrics)] from arrays of shape (...) of
+    the phase and the metrics and an array of shape (..., 3) of Euler angles.
+    The phase reliability is left out of the metrics where it is nan, i.e.
+    at positions matched against a single phase."""
+    phase = np.asarray(phase)
+    flat_euler = np.reshape(euler, (-1, 3))
+    flat_metrics = {key: np.ravel(value).tolist() for key, value in metrics.items()}
+    phase_reliability = flat_metrics.pop("phase_reliability", None)
+
+    data = np.empty((phase.size, 3), dtype="object")
+    for i, position_phase in enumerate(phase.ravel().tolist()):
+        position_metrics = {key: value[i] for key, value in flat_metrics.items()}
+        if phase_reliability is not None and not np.isnan(phase_reliability[i]):
+            position_metrics["phase_reliability"] = phase_reliability[i]
+        data[i] = (position_phase, flat_euler[i].copy(), position_metrics)
+    return data.reshape(phase.shape + (3,))
+
+
+def _crystal_map_column(data, name):
+    """Typed array of the phase ('phase'), Euler angles ('euler') or a metric
+    at each position of an object array of shape (..., 3) with entries
+    [phase, np.array((z, x, z)), dict(metrics)], nan where a metric is
+    missing."""
+    flat = data.reshape(-1, data.shape[-1])
+    if name == "phase":
+        column = np.array(flat[:, 0].tolist())
+    elif name == "euler":
+        column = np.array(flat[:, 1].tolist(), dtype=np.float64)
+        column = column.reshape(-1, 3)
+    else:
+        values = [metrics.get(name, np.nan) for metrics in flat[:, 2]]
+        if name == "ehkls":
+            column = np.empty(len(values), dtype="object")
+            for i, value in enumerate(values):
+                column[i] = value
+        else:
+            column = np.array(values, dtype=np.float64)
+    return column.reshape(data.shape[:-1] + column.shape[1:])
 
 
 class CrystallographicMap(BaseSignal):
@@ -174,17 +273,105 @@ class CrystallographicMap(BaseSignal):
 
     _signal_dimension = 1
     _signal_type = "crystallographic_map"
+    # Names of the metric columns the data is built from when it is first
+    # read, for maps created by from_arrays.
+    _pending_metrics = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.axes_manager.set_signal_dimension(1)
         self.method = None
+        # Typed arrays of the phase, orientation and metrics at each
+        # navigation position of a map created by from_arrays, used until
+        # its data is first read.
+        self._columns = {}
+
+    # BaseSignal keeps its array in `_data` behind the `data` property, whose
+    # setter normalises the value. The property is overridden to build the
+    # object data of maps created by from_arrays on first read, and the
+    # setter is delegated to BaseSignal.
+    @property
+    def data(self):
+        """The [phase, np.array((z,x,z)), dict(metrics)] object array of the
+        map. For maps created by :meth:`from_arrays` it is only built when
+        first read, and from then on the maps are extracted from it, so that
+        it may be edited in place."""
+        if self._pending_metrics is not None:
+            metrics = {name: self._columns[name] for name in self._pending_metrics}
+            self._data = _crystal_map_data(
+                self._columns["phase"], self._columns["euler"], metrics
+            )
+            self._pending_metrics = None
+            self._columns = {}
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        BaseSignal.data.fset(self, value)
+        self._pending_metrics = None
+        self._columns = {}
+
+    @classmethod
+    def from_arrays(cls, phase, euler, metrics, method=None):
+        """Creates a crystallographic map from typed arrays.
+
+        The phase, orientation and metric maps are taken from these arrays
+        until the data is first read.
+
+        Parameters
+        ----------
+        phase : numpy.array
+            Integer array of shape (...) of the phase at each navigation
+            position.
+        euler : numpy.array
+            Float array of shape (..., 3) of the orientation at each
+            navigation position as Euler angles in the zxz convention.
+        metrics : dict
+            Arrays of shape (...) of the metrics at each navigation position.
+            The phase reliability may be nan where only one phase was
+            matched.
+        method : str, optional
+            Method used to obtain the crystallographic mapping results.
+
+        Returns
+        -------
+        cryst_map : CrystallographicMap
+        """
+        phase = np.asarray(phase)
+        # The object data is built from the columns when first read
+        cryst_map = cls(np.empty(phase.shape + (3,), dtype="object"))
+        cryst_map.method = method
+        cryst_map._columns = dict(metrics)
+        cryst_map._columns["phase"] = phase
+        cryst_map._columns["euler"] = np.asarray(euler, dtype=np.float64)
+        cryst_map._pending_metrics = list(metrics)
+        return cryst_map
+
+    def _get_column(self, name):
+        """Typed array of the phase ('phase'), orientation ('euler' or
+        'quaternion') or a metric at each navigation position, taken from
+        the columns of a map created by from_arrays or extracted from the
+        data."""
+        if name in self._columns:
+            return self._columns[name]
+        if name == "quaternion":
+            quaternions = euler2quaternion(self._get_column("euler"))
+            if self._pending_metrics is not None:
+                self._columns[name] = quaternions
+            return quaternions
+
+        return _crystal_map_column(self.data, name)
+
+    def _get_column_map(self, name):
+        """A map of a column as a Signal2D with the navigation axes of the
+        crystallographic map as signal axes."""
+        column_map = Signal2D(self._get_column(name))
+        return transfer_navigation_axes_to_signal_axes(column_map, self)
 
     def get_phase_map(self):
         """Obtain a map of the best matching phase at each navigation position.
         """
-        phase_map = self.isig[0].as_signal2D((0, 1))
-        phase_map = transfer_navigation_axes_to_signal_axes(phase_map, self)
+        phase_map = self._get_column_map("phase")
         phase_map.change_dtype(np.int)
 
         return phase_map
@@ -200,15 +387,8 @@ class CrystallographicMap(BaseSignal):
             navigation position.
 
         """
-        eulers = self.isig[1]
-        eulers.map(_euler2axangle_signal, inplace=True)
-        orientation_map = eulers.as_signal2D((0, 1))
-        orientation_map = transfer_navigation_axes_to_signal_axes(orientation_map, self)
-        # Since vector matching results returns in object form, eulers inherits
-        # it.
-        orientation_map.change_dtype("float")
-
-        return orientation_map
+        orientation_map = Signal2D(_rotation_angle(self._get_column("euler")))
+        return transfer_navigation_axes_to_signal_axes(orientation_map, self)
 
     def get_metric_map(self, metric):
         """Obtain a map of an indexation / matching metric at each navigation
@@ -226,7 +406,9 @@ class CrystallographicMap(BaseSignal):
         Returns
         -------
         metric_map : Signal2D
-            A map of the specified metric at each navigation position.
+            A map of the specified metric at each navigation position. The
+            phase reliability is nan at positions matched against a single
+            phase.
 
         Notes
         -----
@@ -247,14 +429,7 @@ class CrystallographicMap(BaseSignal):
                 "orientation_reliability",
                 "phase_reliability",
             ]
-            if metric in template_metrics:
-                metric_map = (
-                    self.isig[2]
-                    .map(_metric_from_dict, metric=metric, inplace=False)
-                    .as_signal2D((0, 1))
-                )
-
-            else:
+            if metric not in template_metrics:
                 raise ValueError(
                     "The metric `{}` is not valid for template "
                     "matching results.".format(metric)
@@ -268,14 +443,7 @@ class CrystallographicMap(BaseSignal):
                 "orientation_reliability",
                 "phase_reliability",
             ]
-            if metric in vector_metrics:
-                metric_map = (
-                    self.isig[2]
-                    .map(_metric_from_dict, metric=metric, inplace=False)
-                    .as_signal2D((0, 1))
-                )
-
-            else:
+            if metric not in vector_metrics:
                 raise ValueError(
                     "The metric `{}` is not valid for vector "
                     "matching results.".format(metric)
@@ -288,36 +456,103 @@ class CrystallographicMap(BaseSignal):
                 "template_matching or vector_matching."
             )
 
-        metric_map = transfer_navigation_axes_to_signal_axes(metric_map, self)
+        return self._get_column_map(metric)
 
-        return metric_map
+    def get_quaternions(self, symmetry=None):
+        """Obtain the best matching orientation at each navigation position
+        as a unit quaternion.
 
-    def get_modal_angles(self):
+        Parameters
+        ----------
+        symmetry : numpy.array, optional
+            Array of shape (n, 4) of the quaternions of the crystal symmetry
+            rotations, e.g. from
+            :func:`pyxem.utils.orientation_utils.get_lattice_rotations`. If
+            given, the orientations are reduced to the fundamental zone.
+
+        Returns
+        -------
+        quaternions : numpy.array
+            Array of shape (..., 4) of unit quaternions in (w, x, y, z)
+            order, nan at positions without an orientation.
+        """
+        quaternions = self._get_column("quaternion")
+        if symmetry is not None:
+            quaternions = reduce_to_fundamental_zone(quaternions, symmetry)
+        return quaternions
+
+    def get_modal_angles(self, tolerance=None, symmetry=None):
         """Obtain the modal angles (and their fractional occurances).
 
+        Parameters
+        ----------
+        tolerance : float, optional
+            Misorientation in degrees within which orientations are counted
+            as the same. If None (default) only identical Euler angles are.
+        symmetry : numpy.array, optional
+            Array of shape (n, 4) of the quaternions of the crystal symmetry
+            rotations, only used with `tolerance`. See :meth:`get_quaternions`.
+
         Returns
         -------
         modal_angles : list
             [modal_angles, fractional_occurance]
         """
-        # Extract the euler arrays by flattening, creating a continuous list
-        # and converting it to an array again
-        euler_array = np.array(self.isig[1].data.ravel().tolist())
+        if tolerance is not None:
+            mode, fraction = get_modal_orientation(
+                self.get_quaternions(), tolerance, symmetry
+            )
+            return [quaternion2euler(mode), fraction]
+
+        euler_array = self._get_column("euler").reshape(-1, 3)
 
         pairs, counts = np.unique(euler_array, axis=0, return_counts=True)
 
         return [pairs[counts.argmax()], counts[counts.argmax()] / np.sum(counts)]
 
-    def get_distance_from_modal_angle(self):
+    def get_misorientation_map(self, reference, symmetry=None):
+        """Obtain a map of the misorientation with respect to a reference
+        orientation at each navigation position.
+
+        Parameters
+        ----------
+        reference : numpy.array
+            Euler angles in the zxz convention (degrees) of the reference
+            orientation.
+        symmetry : numpy.array, optional
+            Array of shape (n, 4) of the quaternions of the crystal symmetry
+            rotations. See :meth:`get_quaternions`.
+
+        Returns
+        -------
+        misorientation_map : Signal2D
+            The misorientation angle in degrees at each navigation position.
+        """
+        misorientation = _chunked_misorientation_angle(
+            self.get_quaternions(), euler2quaternion(reference), symmetry
+        )
+        misorientation_map = Signal2D(misorientation)
+        return transfer_navigation_axes_to_signal_axes(misorientation_map, self)
+
+    def get_distance_from_modal_angle(self, tolerance=None, symmetry=None):
         """Obtain the misorinetation with respect to the modal angle for the
         scan region, at each navigation position.
 
         NB: This view of the data is typically only useful when the orientation
         spread across the navigation axes is small.
 
+        Parameters
+        ----------
+        tolerance : float, optional
+            Tolerance in degrees used to find the modal angle, see
+            :meth:`get_modal_angles`.
+        symmetry : numpy.array, optional
+            Array of shape (n, 4) of the quaternions of the crystal symmetry
+            rotations. See :meth:`get_quaternions`.
+
         Returns
         -------
-        mode_distance_map : list
+        mode_distance_map : Signal2D
             Misorientation with respect to the modal angle at each navigtion
             position.
 
@@ -325,10 +560,86 @@ class CrystallographicMap(BaseSignal):
         --------
             method: save_mtex_map
         """
-        modal_angle = self.get_modal_angles()[0]
-        return self.isig[1].map(
-            _distance_from_fixed_angle, fixed_angle=modal_angle, inplace=False
+        modal_angle = self.get_modal_angles(tolerance, symmetry)[0]
+        return self.get_misorientation_map(modal_angle, symmetry)
+
+    def get_neighbour_misorientation_map(self, symmetry=None):
+        """Obtain a map of the largest misorientation between each navigation
+        position and its nearest neighbours, highlighting grain boundaries.
+
+        Parameters
+        ----------
+        symmetry : numpy.array, optional
+            Array of shape (n, 4) of the quaternions of the crystal symmetry
+            rotations. See :meth:`get_quaternions`.
+
+        Returns
+        -------
+        neighbour_misorientation_map : Signal2D
+            The largest misorientation angle in degrees to a neighbour at each
+            navigation position.
+        """
+        angles = _neighbour_misorientations(self.get_quaternions(), symmetry)
+        misorientation_map = Signal2D(np.fmax.reduce(angles, axis=-1))
+        return transfer_navigation_axes_to_signal_axes(misorientation_map, self)
+
+    def get_kernel_average_misorientation_map(self, threshold=5.0, symmetry=None):
+        """Obtain a map of the kernel average misorientation (KAM), the mean
+        misorientation between each navigation position and its nearest
+        neighbours.
+
+        Parameters
+        ----------
+        threshold : float
+            Neighbours misoriented by more than this angle in degrees, e.g.
+            across a grain boundary, are left out of the average.
+        symmetry : numpy.array, optional
+            Array of shape (n, 4) of the quaternions of the crystal symmetry
+            rotations. See :meth:`get_quaternions`.
+
+        Returns
+        -------
+        kam_map : Signal2D
+            The kernel average misorientation in degrees at each navigation
+            position, nan where no neighbour is within `threshold`.
+        """
+        angles = _neighbour_misorientations(self.get_quaternions(), symmetry)
+        within = angles <= threshold
+        with np.errstate(invalid="ignore"):
+            kam = np.where(within, angles, 0).sum(axis=-1) / within.sum(axis=-1)
+        kam_map = Signal2D(kam)
+        return transfer_navigation_axes_to_signal_axes(kam_map, self)
+
+    def _get_metric_names(self):
+        """Names of the scalar metrics of the map."""
+        if self.method == "template_matching":
+            return ["correlation", "orientation_reliability", "phase_reliability"]
+        elif self.method == "vector_matching":
+            return [
+                "match_rate",
+                "total_error",
+                "orientation_reliability",
+                "phase_reliability",
+            ]
+        if self._pending_metrics is not None:
+            return sorted(set(self._pending_metrics) - {"ehkls"})
+        names = set().union(*self.data.reshape(-1, self.data.shape[-1])[:, 2])
+        return sorted(names - {"ehkls"})
+
+    def _get_score(self):
+        """The matching score at each navigation position."""
+        score_metric = (
+            "correlation" if self.method == "template_matching" else "match_rate"
         )
+        return self._get_column(score_metric)
+
+    def _get_positions(self):
+        """Calibrated x and y coordinates of each navigation position of a two
+        dimensional map, in the order of the data."""
+        x_axis, y_axis = self.axes_manager.navigation_axes
+        x = x_axis.offset + x_axis.scale * np.arange(x_axis.size)
+        y = y_axis.offset + y_axis.scale * np.arange(y_axis.size)
+        return np.tile(x, y_axis.size), np.repeat(y, x_axis.size)
 
     def save_mtex_map(self, filename):
         """Save map in a format such that it can be imported into MTEX
@@ -346,18 +657,255 @@ class CrystallographicMap(BaseSignal):
         filename : str
             Name of file to save the crystal map to
         """
-        x_size_nav = self.data.shape[1]
-        y_size_nav = self.data.shape[0]
-        results_array = np.zeros((x_size_nav * y_size_nav, 7))
-        results_array[:, 0] = self.isig[0].data.ravel()
-        results_array[:, 1:4] = np.array(self.isig[1].data.tolist()).reshape(-1, 3)
-        score_metric = (
-            "correlation" if self.method == "template_matching" else "match_rate"
-        )
-        results_array[:, 4] = self.get_metric_map(score_metric).data.ravel()
-        x_indices = np.arange(x_size_nav)
-        y_indices = np.arange(y_size_nav)
-        results_array[:, 5:7] = np.array(np.meshgrid(x_indices, y_indices)).T.reshape(
-            -1, 2
+        x_size_nav = self._data.shape[1]
+        y_size_nav = self._data.shape[0]
+        euler = self._get_column("euler").reshape(-1, 3)
+        # Same coordinates as np.meshgrid(x_indices, y_indices).T.reshape(-1, 2)
+        indices = np.arange(x_size_nav * y_size_nav)
+        columns = [
+            self._get_column("phase").ravel(),
+            euler[:, 0],
+            euler[:, 1],
+            euler[:, 2],
+            self._get_score().ravel(),
+            indices // y_size_nav,
+            indices % y_size_nav,
+        ]
+        with open(filename, "w", newline="") as f:
+            _write_rows(f, columns, "\t".join(["%.18e"] * 7) + "\r\n")
+
+    def _write_column_dataset(self, f, name, chunk_size=2 ** 16):
+        """Writes a column to a chunked HDF5 dataset of the same name, taking
+        about chunk_size positions at a time along the first navigation
+        axis."""
+        shape = self._data.shape[:-1]
+        step = max(1, chunk_size // int(np.prod(shape[1:])))
+        dataset = None
+        for start in range(0, shape[0], step):
+            if name in self._columns:
+                chunk = self._columns[name][start : start + step]
+            else:
+                chunk = _crystal_map_column(self.data[start : start + step], name)
+            if dataset is None:
+                dataset = f.create_dataset(
+                    name,
+                    shape=shape + chunk.shape[len(shape) :],
+                    dtype=chunk.dtype,
+                    chunks=True,
+                )
+            dataset[start : start + step] = chunk
+
+    def save_binary_map(self, filename):
+        """Save the phase, orientation and scalar metrics of the map as
+        arrays, to be loaded with :func:`load_binary_map`.
+
+        Parameters
+        ----------
+        filename : str
+            Name of file to save the crystal map to, written as NumPy .npz
+            if it ends with .npz and as HDF5 otherwise. HDF5 files are
+            written a chunk of rows of the map at a time, whereas .npz files
+            are written in one piece, holding every array in memory.
+        """
+        names = ["phase", "euler"] + self._get_metric_names()
+        navigation_scale = [ax.scale for ax in self.axes_manager.navigation_axes]
+        navigation_offset = [ax.offset for ax in self.axes_manager.navigation_axes]
+        method = self.method if self.method is not None else ""
+
+        if str(filename).endswith(".npz"):
+            arrays = {name: self._get_column(name) for name in names}
+            np.savez(
+                filename,
+                method=method,
+                navigation_scale=navigation_scale,
+                navigation_offset=navigation_offset,
+                **arrays
+            )
+        else:
+            with h5py.File(filename, "w") as f:
+                f.attrs["method"] = method
+                f.create_dataset("navigation_scale", data=navigation_scale)
+                f.create_dataset("navigation_offset", data=navigation_offset)
+                for name in names:
+                    self._write_column_dataset(f, name)
+
+    def save_ang_map(self, filename, phase_names=None, structures=None):
+        """Save map in the EDAX TSL .ang format for EBSD software.
+
+        Columns:
+        1-3 = Euler angles in the zxz convention (radians),
+        4 = x co-ord in calibrated units,
+        5 = y co-ord in calibrated units,
+        6 = image quality, the correlation or match rate,
+        7 = confidence index, the orientation reliability / 100,
+        8 = phase id, counted from 1, 0 where unindexed,
+        9 = detector signal, 0,
+        10 = fit, the total error of vector matching or 0.
+
+        Parameters
+        ----------
+        filename : str
+            Name of file to save the crystal map to.
+        phase_names : list of str, optional
+            Name of each phase.
+        structures : list of diffpy.structure.Structure, optional
+            Structure of each phase, e.g. the structures of the library used
+            for matching, to record the lattice parameters.
+        """
+        phase = self._get_column("phase").ravel()
+        euler = np.deg2rad(self._get_column("euler").reshape(-1, 3))
+        indexed = phase >= 0
+        # Unindexed orientations are conventionally written as 4 pi
+        euler[~indexed] = 4 * np.pi
+        x, y = self._get_positions()
+        x_axis, y_axis = self.axes_manager.navigation_axes
+        if self.method == "vector_matching":
+            fit = self._get_column("total_error").ravel()
+        else:
+            fit = np.zeros(len(phase))
+
+        header = [
+            "TEM_PIXperUM          1.000000",
+            "x-star                0.000000",
+            "y-star                0.000000",
+            "z-star                0.000000",
+            "WorkingDistance       0.000000",
+            "",
+        ]
+        n_phases = int(phase.max(initial=-1)) + 1
+        for i, (name, lengths, angles) in enumerate(
+            _phase_descriptions(n_phases, phase_names, structures)
+        ):
+            header += [
+                "Phase {}".format(i + 1),
+                "MaterialName  \t{}".format(name),
+                "Formula       \t",
+                "Symmetry              0",
+                "LatticeConstants      "
+                + " ".join("{:.3f}".format(v) for v in lengths + angles),
+                "",
+            ]
+        header += [
+            "GRID: SqrGrid",
+            "XSTEP: {:.6f}".format(x_axis.scale),
+            "YSTEP: {:.6f}".format(y_axis.scale),
+            "NCOLS_ODD: {}".format(x_axis.size),
+            "NCOLS_EVEN: {}".format(x_axis.size),
+            "NROWS: {}".format(y_axis.size),
+            "",
+        ]
+
+        columns = [
+            euler[:, 0],
+            euler[:, 1],
+            euler[:, 2],
+            x,
+            y,
+            np.nan_to_num(self._get_score().ravel()),
+            np.nan_to_num(self._get_column("orientation_reliability").ravel() / 100),
+            np.where(indexed, phase + 1, 0),
+            np.zeros(len(phase)),
+            np.nan_to_num(fit),
+        ]
+        row_format = "%9.5f %9.5f %9.5f %12.5f %12.5f %.3f %6.3f %2d %6d %6.3f\n"
+        with open(filename, "w", newline="") as f:
+            f.write("".join("# {}".format(line).rstrip() + "\n" for line in header))
+            _write_rows(f, columns, row_format)
+
+    def save_ctf_map(self, filename, phase_names=None, structures=None):
+        """Save map in the Oxford Instruments HKL .ctf format for EBSD
+        software.
+
+        Columns:
+        1 = phase id, counted from 1, 0 where unindexed,
+        2 = x co-ord in calibrated units,
+        3 = y co-ord in calibrated units,
+        4 = bands, 0,
+        5 = error, 0 where indexed and 3 where unindexed,
+        6-8 = Euler angles in the zxz convention (degrees),
+        9 = mean angular deviation, the total error of vector matching or 0,
+        10 = band contrast, 0,
+        11 = band slope, 0.
+
+        Parameters
+        ----------
+        filename : str
+            Name of file to save the crystal map to.
+        phase_names : list of str, optional
+            Name of each phase.
+        structures : list of diffpy.structure.Structure, optional
+            Structure of each phase, e.g. the structures of the library used
+            for matching, to record the lattice parameters.
+        """
+        phase = self._get_column("phase").ravel()
+        euler = self._get_column("euler").reshape(-1, 3)
+        indexed = phase >= 0
+        euler = np.where(indexed[:, np.newaxis], np.nan_to_num(euler), 0)
+        x, y = self._get_positions()
+        x_axis, y_axis = self.axes_manager.navigation_axes
+        if self.method == "vector_matching":
+            mad = self._get_column("total_error").ravel()
+        else:
+            mad = np.zeros(len(phase))
+
+        n_phases = int(phase.max(initial=-1)) + 1
+        header = [
+            "Channel Text File",
+            "Prj\tpyxem",
+            "Author\t[Unknown]",
+            "JobMode\tGrid",
+            "XCells\t{}".format(x_axis.size),
+            "YCells\t{}".format(y_axis.size),
+            "XStep\t{:.4f}".format(x_axis.scale),
+            "YStep\t{:.4f}".format(y_axis.scale),
+            "AcqE1\t0",
+            "AcqE2\t0",
+            "AcqE3\t0",
+            "Euler angles refer to Sample Coordinate system (CS0)!\tMag\t0\t"
+            "Coverage\t100\tDevice\t0\tKV\t0\tTiltAngle\t0\tTiltAxis\t0",
+            "Phases\t{}".format(n_phases),
+        ]
+        for name, lengths, angles in _phase_descriptions(
+            n_phases, phase_names, structures
+        ):
+            header.append(
+                "{:.3f};{:.3f};{:.3f}\t{:.3f};{:.3f};{:.3f}\t{}\t0\t0".format(
+                    *lengths, *angles, name
+                )
+            )
+        header.append(
+            "\t".join(
+                [
+                    "Phase",
+                    "X",
+                    "Y",
+                    "Bands",
+                    "Error",
+                    "Euler1",
+                    "Euler2",
+                    "Euler3",
+                    "MAD",
+                    "BC",
+                    "BS",
+                ]
+            )
         )
-        np.savetxt(filename, results_array, delimiter="\t", newline="\r\n")
+
+        columns = [
+            np.where(indexed, phase + 1, 0),
+            x,
+            y,
+            np.zeros(len(phase)),
+            np.where(indexed, 0, 3),
+            euler[:, 0],
+            euler[:, 1],
+            euler[:, 2],
+            np.nan_to_num(mad),
+            np.zeros(len(phase)),
+            np.zeros(len(phase)),
+        ]
+        row_format = "\t".join(["%d"] + ["%.4f"] * 2 + ["%d"] * 2 + ["%.4f"] * 4)
+        row_format += "\t%d\t%d"
+        with open(filename, "w", newline="") as f:
+            f.write("".join(line + "\n" for line in header))
+            _write_rows(f, columns, row_format + "\n")
@@ -29,7 +29,11 @@ from hyperspy._signals.lazy import LazySignal
 from pyxem.signals.diffraction1d import Diffraction1D
 from pyxem.signals.electron_diffraction1d import ElectronDiffraction1D
 from pyxem.signals.polar_diffraction2d import PolarDiffraction2D
-from pyxem.signals import transfer_navigation_axes, select_method_from_method_dict
+from pyxem.signals import (
+    transfer_navigation_axes,
+    transfer_navigation_axes_to_signal_axes,
+    select_method_from_method_dict,
+)
 from pyxem.signals.common_diffraction import CommonDiffraction
 
 from pyxem.utils.expt_utils import (
@@ -91,6 +95,62 @@ class Diffraction2D(Signal2D, CommonDiffraction):
 
         return signal_mask
 
+    def get_navigation_mask(
+        self, method="total_intensity", threshold=None, radius=None
+    ):
+        """Generate a navigation mask of the probe positions worth indexing,
+        excluding vacuum and weakly diffracting (e.g. amorphous) regions.
+
+        Parameters
+        ----------
+        method : str
+            'total_intensity' thresholds the summed intensity of each pattern.
+            'diffracted_fraction' thresholds the fraction of the intensity of
+            each pattern lying outside the direct beam.
+        threshold : float
+            Positions with a value above threshold are kept. If None, the
+            threshold is found automatically with Otsu's method.
+        radius : float
+            Radius of the direct beam in pixel units, required by the
+            'diffracted_fraction' method.
+
+        Returns
+        -------
+        navigation_mask : Signal2D
+            Boolean map over the navigation axes, True at the positions to be
+            indexed, that can be passed as the mask of
+            :meth:`IndexationGenerator.correlate`.
+        """
+        total_intensity = self.data.sum(axis=(-2, -1))
+        if method == "total_intensity":
+            metric = np.asarray(total_intensity, dtype=np.float64)
+        elif method == "diffracted_fraction":
+            if radius is None:
+                raise ValueError(
+                    "The radius of the direct beam is required by the "
+                    "'diffracted_fraction' method."
+                )
+            beam_mask = self.get_direct_beam_mask(radius).data
+            direct_intensity = np.tensordot(
+                self.data, beam_mask.astype(self.data.dtype), axes=2
+            )
+            total_intensity = np.asarray(total_intensity, dtype=np.float64)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                metric = 1 - np.asarray(direct_intensity) / total_intensity
+            metric[total_intensity == 0] = 0
+        else:
+            raise NotImplementedError(
+                "The method `{}` is not implemented, use 'total_intensity' or "
+                "'diffracted_fraction'.".format(method)
+            )
+
+        if threshold is None:
+            threshold = filters.threshold_otsu(metric)
+        navigation_mask = Signal2D(metric > threshold)
+        navigation_mask = transfer_navigation_axes_to_signal_axes(navigation_mask, self)
+
+        return navigation_mask
+
     def apply_affine_transformation(
         self, D, order=3, keep_dtype=False, inplace=True, *args, **kwargs
     ):
@@ -16,8 +16,10 @@
 # You should have received a copy of the GNU General Public License
 # along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
 
+import h5py
 import numpy as np
 import hyperspy.api as hs
+import traits.api as t
 from hyperspy.signal import BaseSignal
 from hyperspy.signals import Signal2D
 from warnings import warn
@@ -25,13 +27,30 @@ from warnings import warn
 from pyxem.signals import transfer_navigation_axes
 from pyxem.utils.indexation_utils import peaks_from_best_template
 from pyxem.utils.indexation_utils import peaks_from_best_vector_match
-from pyxem.utils.indexation_utils import crystal_from_template_matching
-from pyxem.utils.indexation_utils import crystal_from_vector_matching
+from pyxem.utils.indexation_utils import (
+    matches_to_arrays,
+    arrays_to_matches,
+    crystal_arrays_from_template_matching,
+    vector_matches_to_arrays,
+    crystal_arrays_from_vector_matching,
+)
 from pyxem.utils.plot import generate_marker_inputs_from_peaks
 
 from pyxem import CrystallographicMap
 
 
+def _warn_unused_map_arguments(args, kwargs):
+    """Warns that arguments formerly passed to map() by
+    get_crystallographic_map are ignored."""
+    if args or kwargs:
+        warn(
+            "get_crystallographic_map() computes all positions at once and no "
+            "longer uses map(), the arguments {} and {} are ignored.".format(
+                args, kwargs
+            )
+        )
+
+
 class TemplateMatchingResults(Signal2D):
     """Template matching results containing the top n best matching crystal
     phase and orientation at each navigation position with associated metrics.
@@ -87,18 +106,204 @@ class TemplateMatchingResults(Signal2D):
                 'orientation_reliability'
                 'phase_reliability'
 
+            The metrics are computed for all positions at once, `*args` and
+            `**kwargs`, formerly passed to map(), are ignored with a warning.
+
         """
+        _warn_unused_map_arguments(args, kwargs)
         # TODO: Add alternative methods beyond highest correlation score.
-        crystal_map = self.map(
-            crystal_from_template_matching, inplace=False, *args, **kwargs
+        return self.to_compact().get_crystallographic_map()
+
+    def to_compact(self):
+        """Converts the results to contiguous typed arrays.
+
+        Returns
+        -------
+        compact_results : CompactTemplateMatchingResults
+        """
+        return CompactTemplateMatchingResults.from_template_matching_results(self)
+
+
+class CompactTemplateMatchingResults:
+    """Template matching results stored as contiguous typed arrays, holding
+    the top m matches at each navigation position.
+
+    Unlike :class:`TemplateMatchingResults`, which stores a Python object for
+    each match, the results take a few bytes per match, can be written to and
+    read from disk in a single operation and are processed without map().
+
+    Parameters
+    ----------
+    phase_index : numpy.array
+        Integer array of shape (<navigation shape>, m) of the phase index of
+        each match, -1 for missing matches (e.g. masked positions).
+    euler : numpy.array
+        Float array of shape (<navigation shape>, m, 3) of the Euler angles
+        (rzxz, degrees) of each match.
+    correlation : numpy.array
+        Float array of shape (<navigation shape>, m) of the correlation of
+        each match.
+    navigation_axes : list of dict
+        Optional 'name', 'scale', 'offset' and 'units' of each navigation
+        axis, in the order of the hyperspy axes manager.
+    """
+
+    def __init__(self, phase_index, euler, correlation, navigation_axes=None):
+        self.phase_index = np.ascontiguousarray(phase_index, dtype=np.int32)
+        self.euler = np.ascontiguousarray(euler, dtype=np.float64)
+        self.correlation = np.ascontiguousarray(correlation, dtype=np.float64)
+        if (
+            self.euler.shape != self.phase_index.shape + (3,)
+            or self.correlation.shape != self.phase_index.shape
+        ):
+            raise ValueError(
+                "The phase_index, euler and correlation arrays must have shapes "
+                "(..., m), (..., m, 3) and (..., m)."
+            )
+        self.navigation_axes = navigation_axes
+
+    @property
+    def navigation_shape(self):
+        """Navigation shape of the results, in array order."""
+        return self.phase_index.shape[:-1]
+
+    @classmethod
+    def from_arrays(cls, phase_index, euler, correlation, signal=None):
+        """Creates results from typed arrays, taking the navigation axes
+        calibration from a signal.
+
+        Parameters
+        ----------
+        phase_index, euler, correlation : numpy.array
+            See :class:`CompactTemplateMatchingResults`.
+        signal : Signal
+            Signal whose navigation axes calibration is copied, e.g. the
+            indexed diffraction patterns. If None no calibration is stored.
+
+        Returns
+        -------
+        compact_results : CompactTemplateMatchingResults
+        """
+        navigation_axes = None
+        if signal is not None:
+            navigation_axes = [
+                {
+                    key: getattr(ax, key)
+                    for key in ("name", "scale", "offset", "units")
+                    if getattr(ax, key) is not t.Undefined
+                }
+                for ax in signal.axes_manager.navigation_axes
+            ]
+        return cls(phase_index, euler, correlation, navigation_axes)
+
+    @classmethod
+    def from_template_matching_results(cls, results):
+        """Converts a TemplateMatchingResults signal.
+
+        Parameters
+        ----------
+        results : TemplateMatchingResults
+            Results with data of shape (<navigation shape>, m, 3).
+
+        Returns
+        -------
+        compact_results : CompactTemplateMatchingResults
+        """
+        return cls.from_arrays(*matches_to_arrays(results.data), signal=results)
+
+    def to_template_matching_results(self):
+        """Converts the results to a TemplateMatchingResults signal.
+
+        Returns
+        -------
+        results : TemplateMatchingResults
+        """
+        results = TemplateMatchingResults(
+            arrays_to_matches(self.phase_index, self.euler, self.correlation)
         )
+        results.axes_manager.set_signal_dimension(2)
+        self._set_navigation_axes(results)
+        return results
+
+    def _set_navigation_axes(self, signal):
+        """Sets the stored calibration of the navigation axes of a signal."""
+        if self.navigation_axes is None:
+            return
+        for ax, ax_dict in zip(
+            signal.axes_manager.navigation_axes, self.navigation_axes
+        ):
+            for key, value in ax_dict.items():
+                setattr(ax, key, value)
+
+    def get_crystallographic_map(self):
+        """Obtain a crystallographic map specifying the best matching phase and
+        orientation at each probe position with corresponding metrics, see
+        :meth:`TemplateMatchingResults.get_crystallographic_map`.
 
-        cryst_map = CrystallographicMap(crystal_map)
-        cryst_map = transfer_navigation_axes(cryst_map, self)
-        cryst_map.method = "template_matching"
+        The metrics are computed for all positions at once. Positions without
+        matches have phase -1 and nan orientation and metrics.
+
+        Returns
+        -------
+        cryst_map : CrystallographicMap
+        """
+        best_phase, best_euler, metrics = crystal_arrays_from_template_matching(
+            self.phase_index, self.euler, self.correlation
+        )
+        cryst_map = CrystallographicMap.from_arrays(
+            best_phase, best_euler, metrics, method="template_matching"
+        )
+        self._set_navigation_axes(cryst_map)
 
         return cryst_map
 
+    def save(self, filename):
+        """Saves the results to an HDF5 file.
+
+        Parameters
+        ----------
+        filename : str
+            Path of the file to write.
+        """
+        with h5py.File(filename, "w") as f:
+            f.create_dataset("phase_index", data=self.phase_index)
+            f.create_dataset("euler", data=self.euler)
+            f.create_dataset("correlation", data=self.correlation)
+            if self.navigation_axes is not None:
+                for i, ax_dict in enumerate(self.navigation_axes):
+                    group = f.create_group("navigation_axis_{}".format(i))
+                    group.attrs.update(ax_dict)
+
+
+def load_CompactTemplateMatchingResults(filename):
+    """Loads results saved with :meth:`CompactTemplateMatchingResults.save`.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the results file.
+
+    Returns
+    -------
+    compact_results : CompactTemplateMatchingResults
+    """
+    with h5py.File(filename, "r") as f:
+        navigation_axes = []
+        while "navigation_axis_{}".format(len(navigation_axes)) in f:
+            group = f["navigation_axis_{}".format(len(navigation_axes))]
+            navigation_axes.append(
+                {
+                    key: value if isinstance(value, str) else float(value)
+                    for key, value in group.attrs.items()
+                }
+            )
+        return CompactTemplateMatchingResults(
+            f["phase_index"][()],
+            f["euler"][()],
+            f["correlation"][()],
+            navigation_axes if navigation_axes else None,
+        )
+
 
 class VectorMatchingResults(BaseSignal):
     """Vector matching results containing the top n best matching crystal
@@ -138,19 +343,35 @@ class VectorMatchingResults(BaseSignal):
             which defines the phase, orientation as Euler angles in the zxz
             convention and metrics associated with the matching.
 
-            Metrics for template matching results are
+            Metrics for vector matching results are
                 'match_rate'
+                'ehkls'
                 'total_error'
                 'orientation_reliability'
                 'phase_reliability'
+
+            The metrics are computed for all positions at once, `*args` and
+            `**kwargs`, formerly passed to map(), are ignored with a warning.
         """
-        crystal_map = self.map(
-            crystal_from_vector_matching, inplace=False, *args, **kwargs
+        _warn_unused_map_arguments(args, kwargs)
+        (
+            phase_index,
+            rotation_matrix,
+            match_rate,
+            total_error,
+            error_hkls,
+        ) = vector_matches_to_arrays(self.data)
+        best, best_phase, best_euler, metrics = crystal_arrays_from_vector_matching(
+            phase_index, rotation_matrix, total_error
         )
+        best = best[..., np.newaxis]
+        metrics["match_rate"] = np.take_along_axis(match_rate, best, axis=-1)[..., 0]
+        metrics["ehkls"] = np.take_along_axis(error_hkls, best, axis=-1)[..., 0]
 
-        cryst_map = CrystallographicMap(crystal_map)
+        cryst_map = CrystallographicMap.from_arrays(
+            best_phase, best_euler, metrics, method="vector_matching"
+        )
         cryst_map = transfer_navigation_axes(cryst_map, self)
-        cryst_map.method = "vector_matching"
 
         return cryst_map
 
@@ -28,8 +28,10 @@ from transforms3d.euler import euler2mat
 
 from pyxem.signals.diffraction2d import Diffraction2D
 from pyxem.signals.electron_diffraction2d import ElectronDiffraction2D
+from diffsims.libraries.diffraction_library import DiffractionLibrary
 from diffsims.libraries.vector_library import DiffractionVectorLibrary
 
+from pyxem.libraries.compiled_template_library import CompiledTemplateLibrary
 from pyxem.utils.indexation_utils import OrientationResult
 
 
@@ -215,6 +217,36 @@ def vector_library():
     return library
 
 
+@pytest.fixture
+def random_template_library():
+    """Twenty random templates and three random 16x16 patterns"""
+    rng = np.random.RandomState(0)
+    n_templates = 20
+    pixel_coords = np.empty(n_templates, dtype="object")
+    intensities = np.empty(n_templates, dtype="object")
+    orientations = np.empty(n_templates, dtype="object")
+    for i in range(n_templates):
+        pixel_coords[i] = rng.randint(0, 16, size=(6, 2))
+        intensities[i] = rng.rand(6)
+        orientations[i] = (i, 2 * i, 3 * i)
+    library = DiffractionLibrary()
+    library["A"] = {
+        "orientations": orientations,
+        "pixel_coords": pixel_coords,
+        "intensities": intensities,
+        "pattern_norms": np.array([np.linalg.norm(i) for i in intensities]),
+    }
+    images = rng.rand(3, 16, 16)
+    return images, library
+
+
+@pytest.fixture
+def compiled_library(random_template_library):
+    """The random template library compiled for its 16x16 patterns"""
+    _, library = random_template_library
+    return CompiledTemplateLibrary.from_diffraction_library(library, (16, 16))
+
+
 @pytest.fixture
 def sp_template_match_result():
     row_1 = np.array([0, np.array([2, 3, 4]), 0.7], dtype="object")
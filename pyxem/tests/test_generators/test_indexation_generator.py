@@ -18,6 +18,7 @@
 
 import pytest
 import numpy as np
+from hyperspy.signals import BaseSignal
 
 from pyxem.generators.indexation_generator import ProfileIndexationGenerator
 from pyxem.generators.indexation_generator import VectorIndexationGenerator
@@ -122,6 +123,18 @@ def test_profile_indexation_generator_single_indexation(profile_simulation):
     np.testing.assert_almost_equal(indexation[0][0], 0.3189193164369)
 
 
+def test_profile_indexation_generator_map(profile_simulation):
+    magnitudes = np.empty((2, 3), dtype="object")
+    for i, index in enumerate(np.ndindex(2, 3)):
+        magnitudes[index] = np.array(profile_simulation.magnitudes[i : i + 4])
+    magnitudes = BaseSignal(magnitudes).T
+    pig = ProfileIndexationGenerator(magnitudes, profile_simulation)
+    indexation = pig.index_peaks(tolerance=0.02)
+    assert indexation.axes_manager.navigation_shape == (3, 2)
+    np.testing.assert_almost_equal(indexation.data[1, 0][0][0], 0.7365126127784)
+    assert indexation.data[1, 0][0][1][0][0] == {(4, 0, 0): 6}
+
+
 def test_vector_indexation_generator_init():
     vectors = DiffractionVectors([[1], [2]])
     vectors.cartesian = [[1], [2]]
@@ -182,3 +195,55 @@ def test_vector_indexation_generator_index_vectors(vector_match_peaks, vector_li
         np.diag(indexation.data[0].rotation_matrix),
         1,
     )
+
+
+def test_vector_indexation_generator_refine_batched(vector_match_peaks, vector_library):
+    vectors = DiffractionVectors(np.array(vector_match_peaks[:, :2]))
+    vectors.cartesian = DiffractionVectors(np.array(vector_match_peaks))
+    gen = VectorIndexationGenerator(vectors, vector_library)
+    indexation = gen.index_vectors(
+        mag_tol=0.1, angle_tol=6, index_error_tol=0.3, n_peaks_to_index=2, n_best=5
+    )
+    refined = gen.refine_n_best_orientations(
+        indexation, 1.0, 1.0, n_best=0, method="batched"
+    )
+
+    assert isinstance(refined.vectors, DiffractionVectors)
+    np.testing.assert_equal(refined.data.shape, (5,))
+    assert isinstance(refined.data[0], OrientationResult)
+    np.testing.assert_almost_equal(
+        np.diag(refined.data[0].rotation_matrix),
+        np.diag(indexation.data[0].rotation_matrix),
+        1,
+    )
+
+    refined_best = gen.refine_best_orientation(indexation, 1.0, 1.0, method="batched")
+    np.testing.assert_equal(refined_best.data.shape, (1,))
+    assert refined_best.data[0].phase_index == indexation.data[0].phase_index
+
+
+@pytest.mark.parametrize("method", ["leastsq", "batched"])
+def test_vector_indexation_generator_refine_parallel(
+    vector_match_peaks, vector_library, method
+):
+    vectors = DiffractionVectors(np.array(vector_match_peaks[:, :2]))
+    vectors.cartesian = DiffractionVectors(np.array(vector_match_peaks))
+    gen = VectorIndexationGenerator(vectors, vector_library)
+    indexation = gen.index_vectors(
+        mag_tol=0.1, angle_tol=6, index_error_tol=0.3, n_peaks_to_index=2, n_best=5
+    )
+    refined = gen.refine_n_best_orientations(
+        indexation, 1.0, 1.0, n_best=0, method=method, n_jobs=2
+    )
+    assert gen.refinement_report["n_jobs"] == 2
+    assert gen.refinement_report["n_positions"] == 1
+    serial = gen.refine_n_best_orientations(
+        indexation, 1.0, 1.0, n_best=0, method=method
+    )
+
+    np.testing.assert_equal(refined.data.shape, serial.data.shape)
+    for parallel_result, serial_result in zip(refined.data, serial.data):
+        np.testing.assert_allclose(
+            parallel_result.rotation_matrix, serial_result.rotation_matrix
+        )
+        assert parallel_result.match_rate == serial_result.match_rate
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2020 The pyXem developers
+#
+# This file is part of pyXem.
+#
+# pyXem is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyXem is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+import numpy as np
+
+from pyxem.libraries.compiled_template_library import (
+    CompiledTemplateLibrary,
+    load_CompiledTemplateLibrary,
+)
+from pyxem.generators.indexation_generator import IndexationGenerator
+from pyxem.signals.electron_diffraction2d import ElectronDiffraction2D
+from pyxem.utils.indexation_utils import correlate_library_sparse
+from pyxem.tests.test_utils.test_indexation_utils import two_phase_library
+
+
+def test_compile_does_not_modify_library(random_template_library):
+    images, library = random_template_library
+    keys = set(library["A"].keys())
+    CompiledTemplateLibrary.from_diffraction_library(library, (16, 16))
+    assert set(library["A"].keys()) == keys
+
+
+def test_compiled_library_arrays(random_template_library, compiled_library):
+    images, library = random_template_library
+    phase = compiled_library["A"]
+    assert compiled_library.image_shape == (16, 16)
+    assert phase["orientations"].shape == (20, 3)
+    assert phase["template_matrix"].shape == (20, 256)
+    np.testing.assert_allclose(
+        phase["pattern_norms"], [np.linalg.norm(i) for i in library["A"]["intensities"]]
+    )
+
+
+@pytest.mark.parametrize("mmap_mode", ["r", None])
+def test_save_load_round_trip(
+    tmp_path, random_template_library, compiled_library, mmap_mode
+):
+    images, library = random_template_library
+    filename = str(tmp_path / "library.hdf5")
+    compiled_library.save(filename)
+    loaded = load_CompiledTemplateLibrary(filename, mmap_mode=mmap_mode)
+
+    assert list(loaded.keys()) == ["A"]
+    assert loaded.image_shape == (16, 16)
+    if mmap_mode is not None:
+        assert isinstance(loaded["A"]["intensities"], np.memmap)
+    for key in ("orientations", "pattern_norms", "zero_mean_norms"):
+        np.testing.assert_allclose(loaded["A"][key], compiled_library["A"][key])
+
+    for method in ["fast_correlation", "zero_mean_normalized_correlation"]:
+        expected = correlate_library_sparse(images, compiled_library, 3, method)
+        result = correlate_library_sparse(images, loaded, 3, method)
+        np.testing.assert_allclose(
+            result[..., 2].astype(float), expected[..., 2].astype(float)
+        )
+
+
+def test_correlate_with_compiled_library(random_template_library, compiled_library):
+    images, library = random_template_library
+    dp = ElectronDiffraction2D(images)
+    loop_results = IndexationGenerator(dp, library).correlate(n_largest=3)
+    compiled_results = IndexationGenerator(dp, compiled_library).correlate(n_largest=3)
+    np.testing.assert_allclose(
+        compiled_results.data[..., 2].astype(float),
+        loop_results.data[..., 2].astype(float),
+    )
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_correlate_with_compiled_library_wrong_shape(compiled_library):
+    dp = ElectronDiffraction2D(np.zeros((2, 8, 8)))
+    IndexationGenerator(dp, compiled_library).correlate()
+
+
+@pytest.fixture
+def polar_library(random_template_library):
+    images, library = random_template_library
+    return CompiledTemplateLibrary.from_diffraction_library_polar(
+        library, (16, 16), dt=np.deg2rad(4)
+    )
+
+
+def test_polar_library(polar_library):
+    assert polar_library.is_polar
+    assert polar_library.detector_shape == (16, 16)
+    assert polar_library.image_shape[1] == 90
+    np.testing.assert_allclose(polar_library.theta_step, np.deg2rad(4))
+
+
+def test_polar_library_save_load(tmp_path, polar_library):
+    filename = str(tmp_path / "polar_library.hdf5")
+    polar_library.save(filename)
+    loaded = load_CompiledTemplateLibrary(filename)
+    assert loaded.is_polar
+    assert loaded.polar_sampling == polar_library.polar_sampling
+    assert loaded.detector_shape == (16, 16)
+    assert loaded.image_shape == polar_library.image_shape
+    np.testing.assert_allclose(loaded.theta_step, polar_library.theta_step)
+
+
+def test_correlate_polar(random_template_library, polar_library):
+    images, library = random_template_library
+    dp = ElectronDiffraction2D(images)
+    results = IndexationGenerator(dp, library).correlate_polar(
+        n_largest=3, dt=np.deg2rad(4)
+    )
+    compiled_results = IndexationGenerator(dp, polar_library).correlate_polar(
+        n_largest=3
+    )
+    assert results.data.shape == (3, 3, 3)
+    np.testing.assert_allclose(
+        compiled_results.data[..., 2].astype(float), results.data[..., 2].astype(float)
+    )
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_correlate_with_polar_library(polar_library):
+    dp = ElectronDiffraction2D(np.zeros((2, 16, 16)))
+    IndexationGenerator(dp, polar_library).correlate()
+
+
+def test_build_hierarchy(compiled_library):
+    compiled_library.build_hierarchy([20, 60])
+    assert compiled_library.hierarchy_resolutions == (60, 20)
+    levels = compiled_library["A"]["hierarchy_levels"]
+    assert len(levels) == 3
+    assert len(levels[0]) <= len(levels[1]) <= len(levels[2]) == 20
+
+
+def test_hierarchy_save_load(tmp_path, compiled_library):
+    compiled_library.build_hierarchy([20, 60])
+    filename = str(tmp_path / "hierarchical_library.hdf5")
+    compiled_library.save(filename)
+    loaded = load_CompiledTemplateLibrary(filename)
+    assert loaded.hierarchy_resolutions == (60, 20)
+    for level, loaded_level in zip(
+        compiled_library["A"]["hierarchy_levels"], loaded["A"]["hierarchy_levels"]
+    ):
+        np.testing.assert_equal(loaded_level, level)
+    for neighbours, loaded_neighbours in zip(
+        compiled_library["A"]["hierarchy_neighbours"],
+        loaded["A"]["hierarchy_neighbours"],
+    ):
+        np.testing.assert_equal(loaded_neighbours.toarray(), neighbours.toarray())
+
+
+@pytest.mark.parametrize(
+    "method", ["fast_correlation", "zero_mean_normalized_correlation"]
+)
+def test_correlate_hierarchical(random_template_library, method):
+    # a coarse level covering all orientations gives an exhaustive search
+    images, library = random_template_library
+    dp = ElectronDiffraction2D(images)
+    indexer = IndexationGenerator(dp, library)
+    results = indexer.correlate_hierarchical(
+        n_largest=3, method=method, resolutions=[360], n_candidates=1
+    )
+    expected = indexer.correlate(n_largest=3, method=method, engine="sparse")
+    assert results.data.shape == (3, 3, 3)
+    np.testing.assert_allclose(
+        results.data[..., 2].astype(float), expected.data[..., 2].astype(float)
+    )
+
+
+def test_copy(compiled_library):
+    compiled_library.build_low_rank(3)
+    copied = compiled_library.copy()
+    assert isinstance(copied, CompiledTemplateLibrary)
+    assert copied.low_rank == 3 and copied.image_shape == (16, 16)
+    assert copied["A"]["template_matrix"] is compiled_library["A"]["template_matrix"]
+    copied.build_low_rank(5)
+    assert compiled_library.low_rank == 3
+    assert compiled_library["A"]["low_rank_basis"].shape == (3, 256)
+
+
+def test_correlate_hierarchical_library_not_modified(random_template_library):
+    images, library = random_template_library
+    compiled_library = CompiledTemplateLibrary.from_diffraction_library(
+        library, (16, 16)
+    )
+    compiled_library.build_hierarchy([90])
+    levels = compiled_library["A"]["hierarchy_levels"]
+    indexer = IndexationGenerator(ElectronDiffraction2D(images), compiled_library)
+    # other resolutions are honoured without modifying the library
+    results = indexer.correlate_hierarchical(
+        n_largest=3, resolutions=[360], n_candidates=1
+    )
+    expected = indexer.correlate(n_largest=3, engine="sparse")
+    np.testing.assert_allclose(
+        results.data[..., 2].astype(float), expected.data[..., 2].astype(float)
+    )
+    assert compiled_library.hierarchy_resolutions == (90,)
+    assert compiled_library["A"]["hierarchy_levels"] is levels
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_correlate_hierarchical_polar_library(polar_library):
+    dp = ElectronDiffraction2D(np.zeros((2, 16, 16)))
+    IndexationGenerator(dp, polar_library).correlate_hierarchical()
+
+
+def test_build_neighbours(compiled_library):
+    compiled_library.build_neighbours(30)
+    assert compiled_library.neighbour_radius == 30
+    neighbours = compiled_library["A"]["orientation_neighbours"]
+    assert neighbours.shape == (20, 20)
+    assert np.all(neighbours.diagonal())
+
+
+@pytest.mark.parametrize(
+    "method", ["fast_correlation", "zero_mean_normalized_correlation"]
+)
+def test_correlate_coherent(random_template_library, method):
+    # a threshold above one always falls back to the full library
+    images, library = random_template_library
+    dp = ElectronDiffraction2D(np.stack((images, images[::-1])))
+    indexer = IndexationGenerator(dp, library)
+    results = indexer.correlate_coherent(n_largest=3, method=method, threshold=2)
+    expected = indexer.correlate(n_largest=3, method=method, engine="sparse")
+    assert results.data.shape == (2, 3, 3, 3)
+    np.testing.assert_allclose(
+        results.data[..., 2].astype(float), expected.data[..., 2].astype(float)
+    )
+
+
+def test_correlate_coherent_library_not_modified(
+    random_template_library, compiled_library
+):
+    images, _ = random_template_library
+    dp = ElectronDiffraction2D(np.stack((images, images[::-1])))
+    indexer = IndexationGenerator(dp, compiled_library)
+    indexer.correlate_coherent(n_largest=3)
+    assert compiled_library.neighbour_radius is None
+    assert "orientation_neighbours" not in compiled_library["A"]
+    compiled_library.build_neighbours(30)
+    neighbours = compiled_library["A"]["orientation_neighbours"]
+    indexer.correlate_coherent(n_largest=3, radius=10)
+    assert compiled_library.neighbour_radius == 30
+    assert compiled_library["A"]["orientation_neighbours"] is neighbours
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_correlate_coherent_no_navigation(random_template_library):
+    images, library = random_template_library
+    IndexationGenerator(ElectronDiffraction2D(images[0]), library).correlate_coherent()
+
+
+def test_low_rank_save_load(tmp_path, compiled_library):
+    compiled_library.build_low_rank(5)
+    assert compiled_library.low_rank == 5
+    filename = str(tmp_path / "low_rank_library.hdf5")
+    compiled_library.save(filename)
+    loaded = load_CompiledTemplateLibrary(filename)
+    assert loaded.low_rank == 5
+    for key in ["low_rank_basis", "low_rank_templates"]:
+        np.testing.assert_allclose(loaded["A"][key], compiled_library["A"][key])
+
+
+@pytest.mark.parametrize(
+    "method", ["fast_correlation", "zero_mean_normalized_correlation"]
+)
+def test_correlate_low_rank(random_template_library, method):
+    images, library = random_template_library
+    dp = ElectronDiffraction2D(images)
+    indexer = IndexationGenerator(dp, library)
+    results = indexer.correlate_low_rank(
+        n_largest=3, method=method, rank=5, n_candidates=20
+    )
+    expected = indexer.correlate(n_largest=3, method=method, engine="sparse")
+    assert results.data.shape == (3, 3, 3)
+    np.testing.assert_allclose(
+        results.data[..., 2].astype(float), expected.data[..., 2].astype(float)
+    )
+
+
+def test_correlate_low_rank_library_not_modified(
+    random_template_library, compiled_library
+):
+    images, _ = random_template_library
+    compiled_library.build_low_rank(3)
+    basis = compiled_library["A"]["low_rank_basis"]
+    indexer = IndexationGenerator(ElectronDiffraction2D(images), compiled_library)
+    results = indexer.correlate_low_rank(n_largest=3, rank=19, n_candidates=10)
+    expected = indexer.correlate(n_largest=3, engine="sparse")
+    np.testing.assert_allclose(
+        results.data[..., 2].astype(float), expected.data[..., 2].astype(float)
+    )
+    assert compiled_library.low_rank == 3
+    assert compiled_library["A"]["low_rank_basis"] is basis
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_correlate_low_rank_polar_library(polar_library):
+    dp = ElectronDiffraction2D(np.zeros((2, 16, 16)))
+    IndexationGenerator(dp, polar_library).correlate_low_rank()
+
+
+def test_ann_index_save_load(tmp_path, compiled_library):
+    compiled_library.build_ann_index(n_tables=3, n_bits=5, seed=2)
+    filename = str(tmp_path / "ann_library.hdf5")
+    compiled_library.save(filename)
+    loaded = load_CompiledTemplateLibrary(filename)
+    assert loaded.ann_parameters == (3, 5, 2)
+    for key in ["ann_projections", "ann_keys", "ann_order"]:
+        np.testing.assert_equal(loaded["A"][key], compiled_library["A"][key])
+
+
+def test_correlate_ann(random_template_library):
+    images, library = random_template_library
+    dp = ElectronDiffraction2D(images)
+    indexer = IndexationGenerator(dp, library)
+    results = indexer.correlate_ann(n_largest=3, n_tables=1, n_bits=1, n_probes=1)
+    expected = indexer.correlate(n_largest=3, engine="sparse")
+    assert results.data.shape == (3, 3, 3)
+    np.testing.assert_allclose(
+        results.data[..., 2].astype(float), expected.data[..., 2].astype(float)
+    )
+
+
+def test_correlate_ann_library_not_modified(random_template_library, compiled_library):
+    images, _ = random_template_library
+    compiled_library.build_ann_index(n_tables=2, n_bits=6, seed=3)
+    keys = compiled_library["A"]["ann_keys"]
+    indexer = IndexationGenerator(ElectronDiffraction2D(images), compiled_library)
+    results = indexer.correlate_ann(n_largest=3, n_tables=1, n_bits=1, n_probes=1)
+    expected = indexer.correlate(n_largest=3, engine="sparse")
+    np.testing.assert_allclose(
+        results.data[..., 2].astype(float), expected.data[..., 2].astype(float)
+    )
+    assert compiled_library.ann_parameters == (2, 6, 3)
+    assert compiled_library["A"]["ann_keys"] is keys
+
+
+def test_correlate_phase_prescreen():
+    library = two_phase_library()
+    images = np.zeros((2, 32, 32))
+    for image, phase_name in zip(images, ["A", "B"]):
+        pixel_coords = library[phase_name]["pixel_coords"][2]
+        image[pixel_coords[:, 1], pixel_coords[:, 0]] = 1
+    dp = ElectronDiffraction2D(images)
+    indexer = IndexationGenerator(dp, library)
+    results = indexer.correlate(n_largest=2, engine="sparse", phase_prescreen=0.5)
+    # each pattern is only correlated with the 4 templates of its phase
+    assert indexer.pruning_counts == {
+        "phase_correlations": 2,
+        "template_correlations": 8,
+    }
+    np.testing.assert_allclose(results.data[0, 0, 1], [14, 0, 0])
+    np.testing.assert_allclose(results.data[1, 2, 1], [14, 0, 0])
+
+    indexer.correlate(n_largest=2, engine="sparse")
+    assert indexer.pruning_counts is None
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_correlate_phase_prescreen_loop_engine(random_template_library):
+    images, library = random_template_library
+    dp = ElectronDiffraction2D(images)
+    IndexationGenerator(dp, library).correlate(engine="loop", phase_prescreen=0.5)
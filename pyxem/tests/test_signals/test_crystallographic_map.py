@@ -16,11 +16,17 @@
 # You should have received a copy of the GNU General Public License
 # along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
 
+import h5py
 import numpy as np
 import pytest
 from pyxem.signals.crystallographic_map import CrystallographicMap
 from pyxem.signals.crystallographic_map import load_mtex_map
-from pyxem.signals.crystallographic_map import _distance_from_fixed_angle
+from pyxem.signals.crystallographic_map import load_binary_map
+from pyxem.utils.orientation_utils import (
+    euler2quaternion,
+    get_lattice_rotations,
+    misorientation_angle,
+)
 from transforms3d.euler import euler2quat, quat2axangle
 from transforms3d.quaternions import qmult, qinverse
 import os
@@ -270,6 +276,67 @@ class TestMapCreation:
         metric_map = crystal_map.get_metric_map("no metric")
 
 
+class TestFromArrays:
+    def test_from_arrays(self):
+        phase = np.array([[0, 1], [1, 1]])
+        euler = np.arange(12, dtype=float).reshape(2, 2, 3)
+        metrics = {
+            "correlation": np.array([[0.5, 0.4], [0.3, 0.2]]),
+            "orientation_reliability": np.array([[10.0, 20.0], [30.0, 40.0]]),
+            "phase_reliability": np.array([[np.nan, 5.0], [6.0, 7.0]]),
+        }
+        crystal_map = CrystallographicMap.from_arrays(
+            phase, euler, metrics, method="template_matching"
+        )
+        assert crystal_map.axes_manager.navigation_shape == (2, 2)
+        np.testing.assert_equal(crystal_map.get_phase_map().data, phase)
+        # the object data is only built when read
+        assert crystal_map._data[0, 1, 0] is None
+        assert crystal_map.data[0, 1, 0] == 1
+        np.testing.assert_allclose(crystal_map.data[1, 0, 1], [6, 7, 8])
+        assert "phase_reliability" not in crystal_map.data[0, 0, 2]
+        assert crystal_map.data[0, 1, 2]["phase_reliability"] == 5.0
+        np.testing.assert_allclose(
+            crystal_map.get_metric_map("correlation").data, metrics["correlation"]
+        )
+        np.testing.assert_allclose(
+            crystal_map.get_metric_map("phase_reliability").data,
+            metrics["phase_reliability"],
+        )
+        np.testing.assert_equal(crystal_map.get_phase_map().data, phase)
+
+    def test_maps_follow_in_place_edits(self, sp_cryst_map):
+        sp_cryst_map.get_phase_map()
+        sp_cryst_map.data[0, 0, 0] = 5
+        sp_cryst_map.data[0, 0, 2]["correlation"] = 9
+        assert sp_cryst_map.get_phase_map().data[0, 0] == 5
+        assert sp_cryst_map.get_metric_map("correlation").data[0, 0] == 9
+
+    def test_from_arrays_maps_follow_in_place_edits(self):
+        crystal_map = CrystallographicMap.from_arrays(
+            np.zeros((2, 2), dtype=int),
+            np.zeros((2, 2, 3)),
+            {"correlation": np.ones((2, 2))},
+            method="template_matching",
+        )
+        crystal_map.get_quaternions()
+        crystal_map.data[0, 0, 0] = 5
+        crystal_map.data[0, 0, 1][:] = [90, 0, 0]
+        crystal_map.data[0, 0, 2]["correlation"] = 9
+        assert crystal_map.get_phase_map().data[0, 0] == 5
+        assert crystal_map.get_metric_map("correlation").data[0, 0] == 9
+        np.testing.assert_allclose(
+            crystal_map.get_quaternions()[0, 0], euler2quaternion([90, 0, 0])
+        )
+
+    def test_columns_follow_data(self, sp_cryst_map):
+        metric_map = sp_cryst_map.get_metric_map("correlation")
+        assert metric_map.data[0, 0] == 3e-17
+        sp_cryst_map.data = sp_cryst_map.data[::-1].copy()
+        metric_map = sp_cryst_map.get_metric_map("correlation")
+        assert metric_map.data[0, 0] == 4e-17
+
+
 class TestMTEXIO:
     def test_Crystallographic_Map_io_sp(self, sp_cryst_map):
         saved, loaded = worker_for_test_CrystallographicMap_io(sp_cryst_map)
@@ -304,11 +371,122 @@ class TestMTEXIO:
         )
 
 
+class TestExport:
+    @pytest.mark.parametrize("extension", ["hdf5", "npz"])
+    def test_binary_map_io(self, dp_cryst_map, tmp_path, extension):
+        dp_cryst_map.axes_manager.navigation_axes[0].scale = 0.5
+        filename = str(tmp_path / "map.{}".format(extension))
+        dp_cryst_map.save_binary_map(filename)
+        loaded = load_binary_map(filename)
+        assert loaded.method == "template_matching"
+        assert loaded.axes_manager.navigation_axes[0].scale == 0.5
+        np.testing.assert_equal(
+            loaded.get_phase_map().data, dp_cryst_map.get_phase_map().data
+        )
+        np.testing.assert_allclose(
+            np.array(loaded.isig[1].data.tolist()),
+            np.array(dp_cryst_map.isig[1].data.tolist()),
+        )
+        for metric in ["correlation", "orientation_reliability", "phase_reliability"]:
+            np.testing.assert_allclose(
+                loaded.get_metric_map(metric).data,
+                dp_cryst_map.get_metric_map(metric).data,
+            )
+
+    @pytest.mark.parametrize("from_arrays", [False, True])
+    def test_write_column_dataset_chunks(self, dp_cryst_map, tmp_path, from_arrays):
+        crystal_map = dp_cryst_map
+        if from_arrays:
+            crystal_map = CrystallographicMap.from_arrays(
+                dp_cryst_map._get_column("phase"),
+                dp_cryst_map._get_column("euler"),
+                {"correlation": dp_cryst_map._get_column("correlation")},
+            )
+        with h5py.File(str(tmp_path / "map.hdf5"), "w") as f:
+            for name in ["phase", "euler", "correlation"]:
+                crystal_map._write_column_dataset(f, name, chunk_size=1)
+                assert f[name].chunks is not None
+                np.testing.assert_allclose(
+                    f[name][()], dp_cryst_map._get_column(name).astype(float)
+                )
+
+    def test_save_ang_map(self, dp_cryst_map, tmp_path):
+        dp_cryst_map.axes_manager.navigation_axes[0].scale = 0.5
+        filename = str(tmp_path / "map.ang")
+        dp_cryst_map.save_ang_map(filename, phase_names=["A", "B"])
+        with open(filename) as f:
+            header = [line for line in f if line.startswith("#")]
+        assert "# MaterialName  \tB\n" in header
+        assert "# NCOLS_ODD: 2\n" in header
+        loaded = np.loadtxt(filename)
+        np.testing.assert_allclose(
+            np.rad2deg(loaded[:, :3]),
+            np.array(dp_cryst_map.isig[1].data.tolist()).reshape(-1, 3),
+            atol=1e-3,
+        )
+        np.testing.assert_allclose(loaded[:, 3], [0, 0.5, 0, 0.5])
+        np.testing.assert_allclose(loaded[:, 4], [0, 0, 1, 1])
+        np.testing.assert_allclose(loaded[:, 6], [0.005, 0.004, 0.003, 0.002])
+        np.testing.assert_equal(loaded[:, 7], [1, 2, 1, 1])
+
+    def test_save_ctf_map(self, dp_cryst_map, tmp_path):
+        filename = str(tmp_path / "map.ctf")
+        dp_cryst_map.save_ctf_map(filename)
+        loaded = np.loadtxt(filename, skiprows=16)
+        np.testing.assert_equal(loaded[:, 0], [1, 2, 1, 1])
+        np.testing.assert_allclose(
+            loaded[:, 5:8],
+            np.array(dp_cryst_map.isig[1].data.tolist()).reshape(-1, 3),
+            atol=1e-3,
+        )
+
+
 class TestModalAngularFunctionality:
     def test_get_distance_from_modal(self, mod_cryst_map):
-        # function runs without error
-        formal = mod_cryst_map.get_distance_from_modal_angle()
-        assert True
+        distance = mod_cryst_map.get_distance_from_modal_angle()
+        expected = misorientation_angle(
+            euler2quaternion(np.array(mod_cryst_map.isig[1].data.ravel().tolist())),
+            euler2quaternion([5, 17, 6]),
+        )
+        np.testing.assert_allclose(distance.data.ravel(), expected, atol=1e-6)
+
+    def test_get_modal_angles_tolerance(self):
+        euler = np.array(
+            [
+                [5, 17, 6],
+                [5, 17, 6],
+                [40.2, 30, 20],
+                [39.8, 30, 20],
+                [40, 30.2, 20],
+                [40, 30, 19.8],
+            ]
+        )
+        crystal_map = CrystallographicMap.from_arrays(
+            np.zeros((3, 2), dtype=int),
+            euler.reshape(3, 2, 3),
+            {"correlation": np.ones((3, 2))},
+        )
+        assert np.allclose(crystal_map.get_modal_angles()[1], 2 / 6)
+        out = crystal_map.get_modal_angles(tolerance=2)
+        assert np.allclose(out[0], [40, 30, 20], atol=0.2)
+        assert np.allclose(out[1], 4 / 6)
+
+    def test_get_misorientation_map_symmetry(self, mod_cryst_map):
+        symmetry = get_lattice_rotations(np.identity(3))
+        misorientation = mod_cryst_map.get_misorientation_map([95, 17, 6], symmetry)
+        assert misorientation.data[0, 0] < 1e-5
+        assert misorientation.data[1, 0] > 1
+
+    def test_get_kernel_average_misorientation_map(self):
+        euler = np.zeros((3, 4, 3))
+        euler[:, :, 2] = [[0, 1, 30, 31], [0, 1, 30, 31], [0, 1, 30, 31]]
+        crystal_map = CrystallographicMap.from_arrays(
+            np.zeros((3, 4), dtype=int), euler, {"correlation": np.ones((3, 4))}
+        )
+        kam = crystal_map.get_kernel_average_misorientation_map(threshold=5)
+        np.testing.assert_allclose(kam.data[1], [1 / 3] * 4, atol=1e-6)
+        neighbour = crystal_map.get_neighbour_misorientation_map()
+        np.testing.assert_allclose(neighbour.data[1], [1, 29, 29, 1], atol=1e-6)
 
     def test_get_modal_angles(self, mod_cryst_map):
         # modal angle is found correctly
@@ -316,11 +494,13 @@ class TestModalAngularFunctionality:
         assert np.allclose(out[0], [5, 17, 6])
         assert np.allclose(out[1], (2 / 6))
 
-    def test_get_distance_from_fixed_angle(self):
+    def test_misorientation_angle(self):
         # distance between two angles is found correctly
         angle_1 = [1, 1, 3]
         angle_2 = [1, 1, 4]
-        implemented = _distance_from_fixed_angle([angle_1], angle_2)
+        implemented = misorientation_angle(
+            euler2quaternion(angle_1), euler2quaternion(angle_2)
+        )
         testing = get_distance_between_two_angles_longform(angle_1, angle_2)
         assert np.allclose(implemented, testing)
         assert np.allclose(implemented, 1)
@@ -233,6 +233,43 @@ class TestPolarReprojection:
         assert polar_k_axis.units == "$rad$"
 
 
+class TestNavigationMask:
+    @pytest.fixture
+    def dp_with_vacuum(self):
+        data = np.zeros((3, 4, 8, 8))
+        # direct beam everywhere, a diffraction spot on the left half only
+        data[:, :, 3:5, 3:5] = 10
+        data[:, :2, 0, 0] = 30
+        data[2, 3] = 0
+        dp = Diffraction2D(data)
+        dp.axes_manager.navigation_axes[0].scale = 0.5
+        return dp
+
+    def test_total_intensity(self, dp_with_vacuum):
+        mask = dp_with_vacuum.get_navigation_mask(threshold=10)
+        expected = np.ones((3, 4), dtype=bool)
+        expected[2, 3] = False
+        np.testing.assert_equal(mask.data, expected)
+        assert mask.axes_manager.signal_axes[0].scale == 0.5
+
+    @pytest.mark.parametrize("lazy", [False, True])
+    def test_diffracted_fraction(self, dp_with_vacuum, lazy):
+        if lazy:
+            dp_with_vacuum = LazyDiffraction2D(da.from_array(dp_with_vacuum.data))
+        mask = dp_with_vacuum.get_navigation_mask("diffracted_fraction", radius=2)
+        expected = np.zeros((3, 4), dtype=bool)
+        expected[:, :2] = True
+        np.testing.assert_equal(mask.data, expected)
+
+    @pytest.mark.xfail(raises=ValueError)
+    def test_diffracted_fraction_no_radius(self, dp_with_vacuum):
+        dp_with_vacuum.get_navigation_mask("diffracted_fraction")
+
+    @pytest.mark.xfail(raises=NotImplementedError)
+    def test_unknown_method(self, dp_with_vacuum):
+        dp_with_vacuum.get_navigation_mask("magic")
+
+
 class TestVirtualImaging:
     # Tests that virtual imaging runs without failure
 
@@ -20,8 +20,13 @@ import numpy as np
 import pytest
 
 from pyxem.signals.indexation_results import TemplateMatchingResults
+from pyxem.signals.indexation_results import (
+    CompactTemplateMatchingResults,
+    load_CompactTemplateMatchingResults,
+)
 from pyxem.signals.indexation_results import VectorMatchingResults
 from pyxem.signals.diffraction_vectors import DiffractionVectors
+from pyxem.utils.indexation_utils import crystal_from_template_matching
 
 
 def test_template_get_crystallographic_map(
@@ -37,6 +42,71 @@ def test_template_get_crystallographic_map(
     assert cryst_map.method == "template_matching"
 
 
+def test_template_get_crystallographic_map_map_arguments(sp_template_match_result):
+    match_results = TemplateMatchingResults(np.array([sp_template_match_result[0]]))
+    with pytest.warns(UserWarning, match="ignored"):
+        match_results.get_crystallographic_map(show_progressbar=False)
+
+
+@pytest.fixture
+def template_match_results(dp_template_match_result):
+    matches = np.empty((2, 3, 4, 3), dtype="object")
+    for i in range(2):
+        for j in range(3):
+            matches[i, j] = dp_template_match_result
+            matches[i, j, :, 2] = matches[i, j, :, 2] * (i + j + 1)
+    results = TemplateMatchingResults(matches)
+    results.axes_manager.navigation_axes[0].scale = 0.5
+    results.axes_manager.navigation_axes[1].units = "nm"
+    return results
+
+
+def test_compact_round_trip(template_match_results):
+    compact_results = template_match_results.to_compact()
+    assert compact_results.navigation_shape == (2, 3)
+    assert compact_results.euler.shape == (2, 3, 4, 3)
+    assert compact_results.phase_index.dtype == np.int32
+    results = compact_results.to_template_matching_results()
+    assert isinstance(results, TemplateMatchingResults)
+    assert results.axes_manager.navigation_axes[0].scale == 0.5
+    assert results.axes_manager.navigation_axes[1].units == "nm"
+    np.testing.assert_allclose(
+        results.data[..., 2].astype(float),
+        template_match_results.data[..., 2].astype(float),
+    )
+
+
+def test_compact_get_crystallographic_map(template_match_results):
+    cryst_map = template_match_results.to_compact().get_crystallographic_map()
+    expected = template_match_results.map(crystal_from_template_matching, inplace=False)
+    assert cryst_map.method == "template_matching"
+    assert cryst_map.axes_manager.navigation_axes[0].scale == 0.5
+    for result, expected_result in zip(
+        cryst_map.data.reshape(-1, 3), expected.data.reshape(-1, 3)
+    ):
+        assert result[0] == expected_result[0]
+        np.testing.assert_allclose(result[1], expected_result[1])
+        assert result[2].keys() == expected_result[2].keys()
+        for key in result[2]:
+            np.testing.assert_allclose(result[2][key], expected_result[2][key])
+
+
+def test_compact_save_load(tmp_path, template_match_results):
+    compact_results = template_match_results.to_compact()
+    filename = str(tmp_path / "results.hdf5")
+    compact_results.save(filename)
+    loaded = load_CompactTemplateMatchingResults(filename)
+    np.testing.assert_equal(loaded.phase_index, compact_results.phase_index)
+    np.testing.assert_equal(loaded.euler, compact_results.euler)
+    np.testing.assert_equal(loaded.correlation, compact_results.correlation)
+    assert loaded.navigation_axes == compact_results.navigation_axes
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_compact_wrong_shapes():
+    CompactTemplateMatchingResults(np.zeros((2, 3)), np.zeros((2, 3)), np.zeros((2, 3)))
+
+
 def test_vector_get_crystallographic_map(
     dp_vector_match_result, sp_vector_match_result
 ):
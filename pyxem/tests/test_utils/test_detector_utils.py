@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2020 The pyXem developers
+#
+# This file is part of pyXem.
+#
+# pyXem is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyXem is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import pytest
+import numpy as np
+import dask.array as da
+
+from pyxem.utils.detector_utils import apply_index_map, get_index_map, remap_frames
+
+
+@pytest.mark.parametrize("counter_depth", [1, 6, 12, 24])
+@pytest.mark.parametrize(
+    "assembly_size,add_crosses,shape",
+    [("1x1", True, (256, 256)), ("2x2", False, (512, 512)), ("2x2", True, (515, 515))],
+)
+def test_get_index_map(counter_depth, assembly_size, add_crosses, shape):
+    index_map = get_index_map(counter_depth, assembly_size, add_crosses=add_crosses)
+    assert index_map.shape == shape
+    assert index_map is get_index_map(
+        counter_depth, assembly_size, add_crosses=add_crosses
+    )
+    # every raw pixel appears exactly once
+    n_pixels = (int(assembly_size[0]) * 256) ** 2
+    np.testing.assert_array_equal(
+        np.sort(index_map[index_map >= 0]), np.arange(n_pixels)
+    )
+
+
+def test_get_index_map_raw_6bit():
+    index_map = get_index_map(6, "2x2", add_crosses=False)
+    # pixels are reversed within groups of 8
+    np.testing.assert_array_equal(index_map[0, :8], np.arange(8)[::-1])
+    # the bottom chips are rotated by 180 degrees, so that the bottom left
+    # pixel is the last pixel of the third chip in the first raw row
+    assert index_map[-1, 0] == 767 - 7
+
+
+def test_remap_frames():
+    index_map = get_index_map(12, "2x2", raw=False)
+    frames = np.arange(2 * 512 * 512).reshape(2, -1)
+    data = remap_frames(da.from_array(frames, chunks=(1, 512 * 512)), index_map)
+    assert data.shape == (2, 515, 515)
+    assert data.chunks[0] == (1, 1)
+    remapped = data.compute()
+    np.testing.assert_array_equal(remapped, apply_index_map(frames, index_map))
+    assert np.all(remapped[:, 256:259] == 0)
+    assert np.all(remapped[:, :, 256:259] == 0)
+    np.testing.assert_array_equal(
+        remapped[:, :256, :256], frames.reshape(2, 512, 512)[:, :256, :256]
+    )
+    np.testing.assert_array_equal(
+        remapped[:, 259:, 259:], frames.reshape(2, 512, 512)[:, 256:, 256:]
+    )
@@ -17,11 +17,53 @@
 # along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
 
 import numpy as np
+import pytest
+from scipy.ndimage import gaussian_filter
+from transforms3d.euler import euler2mat
 
+from diffsims.libraries.diffraction_library import DiffractionLibrary
+from diffsims.sims.diffraction_simulation import ProfileSimulation
+
+from pyxem.libraries.compiled_template_library import CompiledTemplateLibrary
+from pyxem.utils.expt_utils import radial_average
+from pyxem.utils.orientation_utils import (
+    get_lattice_rotations,
+    misorientation_angle,
+    rotation_matrix2quaternion,
+)
+import pyxem.utils.indexation_utils as indexation_utils
 from pyxem.utils.indexation_utils import (
+    correlate_library,
+    correlate_library_sparse,
+    correlate_library_polar,
+    correlate_library_hierarchical,
+    correlate_library_coherent,
+    correlate_library_low_rank,
+    get_low_rank_templates,
+    correlate_library_ann,
+    get_ann_recall,
+    get_polar_pixel_coords,
+    get_radial_fingerprints,
+    prescreen_phases,
+    get_orientation_hierarchy,
+    get_orientation_neighbours,
     crystal_from_template_matching,
     crystal_from_vector_matching,
+    crystal_arrays_from_template_matching,
+    crystal_arrays_from_vector_matching,
+    vector_matches_to_arrays,
+    matches_to_arrays,
+    arrays_to_matches,
     match_vectors,
+    refine_orientations,
+    _orientation_residuals,
+    get_vector_pair_index,
+    index_magnitudes,
+    _get_phase_fingerprint,
+    _lookup_vector_pairs,
+    _top_n_stable,
+    _score_coherent,
+    _sparse_correlation_scores,
     zero_mean_normalized_correlation,
     fast_correlation,
 )
@@ -45,6 +87,466 @@ def test_fast_correlation():
     np.testing.assert_approx_equal(fast_correlation([1, 1, 1], [1, 0, 0], 1), 1)
 
 
+@pytest.mark.parametrize(
+    "method", ["fast_correlation", "zero_mean_normalized_correlation"]
+)
+def test_correlate_library_sparse(random_template_library, compiled_library, method):
+    images, library = random_template_library
+    matches = correlate_library_sparse(images, compiled_library, 4, method)
+    assert matches.shape == (3, 4, 3)
+    for image, match in zip(images, matches):
+        expected = correlate_library(image, library, 4, method, 1)
+        np.testing.assert_allclose(
+            match[:, 2].astype(float), expected[:, 2].astype(float)
+        )
+        np.testing.assert_allclose(np.stack(match[:, 1]), np.stack(expected[:, 1]))
+
+
+def test_correlate_library_sparse_small_library(
+    random_template_library, compiled_library
+):
+    images, _ = random_template_library
+    matches = correlate_library_sparse(images, compiled_library, 25, "fast_correlation")
+    assert matches.shape == (3, 25, 3)
+    np.testing.assert_allclose(matches[0, 20:, 2].astype(float), 0)
+    np.testing.assert_allclose(np.stack(matches[0, 20:, 1]), 0)
+    assert matches[0, 20, 1] is not matches[0, 21, 1]
+
+
+def two_phase_library():
+    """Library with phase 'A' diffracting at radius 5 and phase 'B' at
+    radius 11 of 32x32 patterns"""
+    library = DiffractionLibrary()
+    for phase_name, radius in (("A", 5), ("B", 11)):
+        angles = np.deg2rad(np.arange(0, 360, 30))
+        pixel_coords = np.empty(4, dtype="object")
+        intensities = np.empty(4, dtype="object")
+        for i in range(4):
+            theta = angles + np.deg2rad(7 * i)
+            x = 16 + radius * np.cos(theta)
+            y = 16 + radius * np.sin(theta)
+            pixel_coords[i] = np.rint(np.stack((x, y), axis=1)).astype(int)
+            intensities[i] = np.ones(len(angles))
+        library[phase_name] = {
+            "orientations": np.array([[7.0 * i, 0, 0] for i in range(4)]),
+            "pixel_coords": pixel_coords,
+            "intensities": intensities,
+        }
+    return library
+
+
+def test_get_radial_fingerprints():
+    images = np.random.RandomState(0).rand(3, 12, 10)
+    fingerprints = get_radial_fingerprints(images)
+    for image, fingerprint in zip(images, fingerprints):
+        np.testing.assert_allclose(fingerprint, radial_average(image))
+
+
+def test_prescreen_phases():
+    library = two_phase_library()
+    compiled_library = CompiledTemplateLibrary.from_diffraction_library(
+        library, (32, 32)
+    )
+    images = np.zeros((3, 32, 32))
+    # a pattern of each phase with a direct beam, and vacuum
+    for image, phase_name in zip(images, ["A", "B"]):
+        pixel_coords = library[phase_name]["pixel_coords"][1]
+        image[pixel_coords[:, 1], pixel_coords[:, 0]] = 1
+        image[15:17, 15:17] = 5
+
+    phase_keys = {name: set(phase) for name, phase in compiled_library.items()}
+    phase_mask = prescreen_phases(images, compiled_library, 0.5)
+    np.testing.assert_equal(phase_mask, [[True, False], [False, True], [True, True]])
+    # the fingerprints are not stored in the library
+    assert {name: set(phase) for name, phase in compiled_library.items()} == phase_keys
+
+    matches = correlate_library_sparse(
+        images, compiled_library, 2, "fast_correlation", phase_mask=phase_mask
+    )
+    expected = correlate_library_sparse(images, compiled_library, 2, "fast_correlation")
+    np.testing.assert_allclose(
+        matches[phase_mask.repeat(2, axis=1)][:, 2].astype(float),
+        expected[phase_mask.repeat(2, axis=1)][:, 2].astype(float),
+    )
+    assert np.all(matches[0, 2:, 2] == 0)
+    np.testing.assert_allclose(matches[0, 2, 1], [0, 0, 0])
+
+
+def test_get_phase_fingerprint_image_shape():
+    phase = {"template_matrix": np.ones((2, 12 * 10))}
+    fingerprint = _get_phase_fingerprint(phase, (12, 10))
+    assert _get_phase_fingerprint(phase, (12, 10)) is fingerprint
+    np.testing.assert_allclose(fingerprint, radial_average(np.full((12, 10), 2.0)))
+    # a reshaped detector gives a different fingerprint
+    reshaped = _get_phase_fingerprint(phase, (10, 12))
+    np.testing.assert_allclose(reshaped, radial_average(np.full((10, 12), 2.0)))
+
+
+def test_get_polar_pixel_coords():
+    pixel_coords = np.empty(1, dtype="object")
+    pixel_coords[0] = np.array([[8, 3], [12, 8], [8, 8]])
+    polar_coords, polar_shape, theta_step = get_polar_pixel_coords(
+        pixel_coords, (16, 16), dr=1, dt=np.deg2rad(2)
+    )
+    assert polar_shape[1] == 180
+    np.testing.assert_allclose(theta_step, np.deg2rad(2))
+    # spots at equal radius, 90 degrees apart
+    r_index = polar_coords[0][:, 1]
+    assert r_index[0] == r_index[1]
+    theta_index = polar_coords[0][:, 0]
+    assert abs(theta_index[0] - theta_index[1]) % 180 in (44, 45, 46)
+
+
+@pytest.mark.parametrize("angle", [0, 30, 100, 250])
+def test_correlate_library_polar(angle):
+    size = 64
+    origin = size / 2 - 0.5
+    rng = np.random.RandomState(1)
+    r = rng.uniform(8, 28, 7)
+    theta = rng.uniform(0, 2 * np.pi, 7)
+    intensities = np.empty(1, dtype="object")
+    intensities[0] = rng.uniform(0.5, 1, 7)
+    pixel_coords = np.empty(1, dtype="object")
+    pixel_coords[0] = np.rint(
+        np.stack((origin + r * np.cos(theta), origin + r * np.sin(theta)), axis=1)
+    ).astype(int)
+    library = DiffractionLibrary()
+    library["A"] = {
+        "orientations": np.array([[0.0, 10.0, 20.0]]),
+        "pixel_coords": pixel_coords,
+        "intensities": intensities,
+    }
+    # rotation by angle of the (x, y) pixel coordinates, see diffsims
+    alpha = np.deg2rad(angle)
+    x = origin + r * np.cos(theta + alpha)
+    y = origin + r * np.sin(theta + alpha)
+    image = np.zeros((size, size))
+    image[np.rint(y).astype(int), np.rint(x).astype(int)] = intensities[0]
+    image = gaussian_filter(image, 1)
+
+    compiled_library = CompiledTemplateLibrary.from_diffraction_library_polar(
+        library, (size, size), dt=np.deg2rad(1)
+    )
+    matches = correlate_library_polar(
+        image[np.newaxis], compiled_library, 1, "fast_correlation"
+    )
+    phi1 = matches[0, 0, 1][0]
+    assert np.abs((phi1 - angle + 180) % 360 - 180) < 3
+    np.testing.assert_allclose(matches[0, 0, 1][1:], [10, 20])
+
+
+@pytest.mark.parametrize("angle", [40, 130, 290])
+def test_correlate_library_polar_matches_cartesian(angle):
+    # a cartesian library holding every in-plane rotation of one template
+    # must find the same in-plane angle as the polar search
+    size = 64
+    origin = size / 2 - 0.5
+    rng = np.random.RandomState(2)
+    r = rng.uniform(8, 28, 7)
+    theta = rng.uniform(0, 2 * np.pi, 7)
+    spot_intensities = rng.uniform(0.5, 1, 7)
+    in_plane = np.arange(0, 360, 2.0)
+    orientations = np.stack(
+        (in_plane, np.full_like(in_plane, 10), np.full_like(in_plane, 20)), axis=1
+    )
+    pixel_coords = np.empty(len(in_plane), dtype="object")
+    intensities = np.empty(len(in_plane), dtype="object")
+    for i, alpha in enumerate(np.deg2rad(in_plane)):
+        x = origin + r * np.cos(theta + alpha)
+        y = origin + r * np.sin(theta + alpha)
+        pixel_coords[i] = np.rint(np.stack((x, y), axis=1)).astype(int)
+        intensities[i] = spot_intensities
+    library = DiffractionLibrary()
+    library["A"] = {
+        "orientations": orientations,
+        "pixel_coords": pixel_coords,
+        "intensities": intensities,
+        "pattern_norms": [np.linalg.norm(spot_intensities)] * len(in_plane),
+    }
+    image = np.zeros((size, size))
+    spots = pixel_coords[angle // 2]
+    image[spots[:, 1], spots[:, 0]] = spot_intensities
+    image = gaussian_filter(image, 1)
+
+    cartesian = correlate_library(image, library, 1, "fast_correlation", 1)
+    polar_library = CompiledTemplateLibrary.from_diffraction_library_polar(
+        {"A": {key: value[:1] for key, value in library["A"].items()}},
+        (size, size),
+        dt=np.deg2rad(1),
+    )
+    polar = correlate_library_polar(
+        image[np.newaxis], polar_library, 1, "fast_correlation"
+    )
+    assert cartesian[0, 1][0] == angle
+    phi1 = polar[0, 0, 1][0]
+    assert np.abs((phi1 - cartesian[0, 1][0] + 180) % 360 - 180) < 3
+
+
+def test_get_orientation_hierarchy():
+    orientations = np.stack((np.arange(0, 90, 1.0), np.zeros(90), np.zeros(90)), axis=1)
+    levels, neighbours = get_orientation_hierarchy(orientations, [4.5, 19.5])
+    assert len(levels) == 3
+    np.testing.assert_equal(levels[0], [0, 20, 40, 60, 80])
+    np.testing.assert_equal(levels[2], np.arange(90))
+    assert neighbours[0].shape == (5, len(levels[1]))
+    assert neighbours[1].shape == (len(levels[1]), 90)
+    # the finest level members close to the 40 degrees template
+    np.testing.assert_equal(neighbours[1][levels[1] == 40].indices, np.arange(36, 45))
+
+
+def in_plane_rotation_library():
+    """Library of in-plane rotations of a set of spots every degree"""
+    size = 64
+    origin = size / 2 - 0.5
+    rng = np.random.RandomState(1)
+    r = rng.uniform(8, 28, 7)
+    theta = rng.uniform(0, 2 * np.pi, 7)
+    angles = np.arange(0, 360, 1.0)
+    pixel_coords = np.empty(len(angles), dtype="object")
+    intensities = np.empty(len(angles), dtype="object")
+    for i, angle in enumerate(np.deg2rad(angles)):
+        x = origin + r * np.cos(theta + angle)
+        y = origin + r * np.sin(theta + angle)
+        pixel_coords[i] = np.rint(np.stack((x, y), axis=1)).astype(int)
+        intensities[i] = np.ones(7)
+    library = DiffractionLibrary()
+    library["A"] = {
+        "orientations": np.stack((angles, np.zeros(360), np.zeros(360)), axis=1),
+        "pixel_coords": pixel_coords,
+        "intensities": intensities,
+    }
+    return CompiledTemplateLibrary.from_diffraction_library(library, (size, size))
+
+
+def rotated_patterns(compiled_library, angles):
+    """Blurred patterns of the templates at the given angles"""
+    template_matrix = compiled_library["A"]["template_matrix"]
+    images = template_matrix[angles].toarray()
+    images = images.reshape((-1,) + compiled_library.image_shape)
+    return gaussian_filter(images, (0, 1.5, 1.5))
+
+
+@pytest.fixture
+def scored_templates(monkeypatch):
+    """Number of templates scored in each call of _sparse_correlation_scores,
+    times the number of patterns scored"""
+    counts = []
+    score = indexation_utils._sparse_correlation_scores
+
+    def counting_score(images, phase, method):
+        counts.append(len(images) * phase["template_matrix"].shape[0])
+        return score(images, phase, method)
+
+    monkeypatch.setattr(indexation_utils, "_sparse_correlation_scores", counting_score)
+    return counts
+
+
+def test_correlate_library_hierarchical(scored_templates):
+    compiled_library = in_plane_rotation_library()
+    compiled_library.build_hierarchy([10, 3])
+    images = rotated_patterns(compiled_library, [37, 211])
+
+    matches = correlate_library_hierarchical(
+        images, compiled_library, 1, "fast_correlation", n_candidates=3
+    )
+    # the coarse levels and the neighbourhoods of 3 candidates are scored
+    assert sum(scored_templates) < 0.25 * 2 * 360
+    expected = correlate_library_sparse(images, compiled_library, 1, "fast_correlation")
+    # neighbouring templates can be identical after rounding to pixels
+    np.testing.assert_allclose(
+        matches[:, 0, 2].astype(float), expected[:, 0, 2].astype(float)
+    )
+    assert np.abs(matches[0, 0, 1][0] - 37) <= 2
+    assert np.abs(matches[1, 0, 1][0] - 211) <= 2
+
+
+def test_get_orientation_neighbours():
+    orientations = np.array([[0, 0, 0], [4, 0, 0], [0, 6, 0], [359, 0, 0]])
+    neighbours = get_orientation_neighbours(orientations, 5)
+    np.testing.assert_equal(
+        neighbours.toarray(), [[1, 1, 0, 1], [1, 1, 0, 1], [0, 0, 1, 0], [1, 1, 0, 1]],
+    )
+
+
+def test_correlate_library_coherent():
+    # two grains, the left one rotated by 37 and the right one by 211 degrees
+    compiled_library = in_plane_rotation_library()
+    compiled_library.build_neighbours(5)
+    patterns = rotated_patterns(compiled_library, [37, 211])
+    images = np.empty((3, 6) + compiled_library.image_shape)
+    images[:, :3] = patterns[0]
+    images[:, 3:] = patterns[1]
+    mask = np.ones((3, 6), dtype=bool)
+    mask[2, 5] = False
+
+    matches, full_search = correlate_library_coherent(
+        images, compiled_library, 2, "fast_correlation", mask=mask
+    )
+    expected = correlate_library_sparse(
+        images.reshape((18,) + compiled_library.image_shape),
+        compiled_library,
+        2,
+        "fast_correlation",
+    ).reshape(3, 6, 2, 3)
+    np.testing.assert_allclose(
+        matches[mask][:, 0, 2].astype(float), expected[mask][:, 0, 2].astype(float)
+    )
+    assert matches[2, 5, 0, 0] is None
+    # the first pattern and the first pattern of the second grain
+    np.testing.assert_equal(np.argwhere(full_search), [[0, 0], [0, 3]])
+
+
+def test_score_coherent_negative_scores():
+    compiled_library = in_plane_rotation_library()
+    compiled_library.build_neighbours(5)
+    phases = list(compiled_library.values())
+    # a negated pattern scores negatively against its neighbouring templates
+    image = -rotated_patterns(compiled_library, [37]).reshape(1, -1)
+    seed_templates = np.array([[[37]]])
+    local_scores = _sparse_correlation_scores(image, phases[0], "fast_correlation")
+    neighbours = phases[0]["orientation_neighbours"][37].indices
+    local_best = local_scores[0, neighbours].max()
+    assert local_best < 0
+    # slightly below a negative seed score, within the margin
+    _, full_search = _score_coherent(
+        image,
+        phases,
+        seed_templates,
+        np.array([[local_best * 0.95]]),
+        "fast_correlation",
+        0.9,
+    )
+    assert not full_search[0]
+    # well below the seed score
+    _, full_search = _score_coherent(
+        image,
+        phases,
+        seed_templates,
+        np.array([[local_best * 0.5]]),
+        "fast_correlation",
+        0.9,
+    )
+    assert full_search[0]
+
+
+def test_get_low_rank_templates(compiled_library):
+    template_matrix = compiled_library["A"]["template_matrix"]
+    basis, projected_templates = get_low_rank_templates(template_matrix, 19)
+    assert basis.shape == (19, 256)
+    assert projected_templates.shape == (20, 19)
+    np.testing.assert_allclose(basis.dot(basis.T), np.eye(19), atol=1e-10)
+    # the rank of 20 templates is at most 20, so 19 vectors nearly suffice
+    residual = template_matrix.toarray() - projected_templates.dot(basis)
+    assert np.linalg.norm(residual) < 0.5 * np.linalg.norm(template_matrix.toarray())
+
+
+def test_get_low_rank_templates_single_template(compiled_library):
+    template_matrix = compiled_library["A"]["template_matrix"][:1]
+    basis, projected_templates = get_low_rank_templates(template_matrix, 5)
+    assert basis.shape == (1, 256)
+    assert projected_templates.shape == (1, 1)
+    np.testing.assert_allclose(
+        projected_templates.dot(basis), template_matrix.toarray(), atol=1e-10
+    )
+
+
+@pytest.mark.parametrize(
+    "method", ["fast_correlation", "zero_mean_normalized_correlation"]
+)
+def test_correlate_library_low_rank(scored_templates, method):
+    compiled_library = in_plane_rotation_library()
+    compiled_library.build_low_rank(100)
+    images = rotated_patterns(compiled_library, [37, 211])
+    matches = correlate_library_low_rank(
+        images, compiled_library, 1, method, n_candidates=10
+    )
+    # only the 10 shortlisted templates of each pattern are scored exactly
+    assert sum(scored_templates) == 2 * 10
+    expected = correlate_library_sparse(images, compiled_library, 1, method)
+    np.testing.assert_allclose(
+        matches[:, 0, 2].astype(float), expected[:, 0, 2].astype(float)
+    )
+    # neighbouring templates can be identical after rounding to pixels
+    np.testing.assert_allclose(matches[0, 0, 1], [37, 0, 0], atol=2)
+    np.testing.assert_allclose(matches[1, 0, 1], [211, 0, 0], atol=2)
+
+
+def test_correlate_library_low_rank_single_template_phase(random_template_library):
+    images, library = random_template_library
+    library["B"] = {key: value[:1] for key, value in library["A"].items()}
+    compiled_library = CompiledTemplateLibrary.from_diffraction_library(
+        library, (16, 16)
+    )
+    compiled_library.build_low_rank(19)
+    assert compiled_library["B"]["low_rank_basis"].shape == (1, 256)
+    matches = correlate_library_low_rank(
+        images, compiled_library, 4, "fast_correlation", n_candidates=10
+    )
+    expected = correlate_library_sparse(images, compiled_library, 4, "fast_correlation")
+    np.testing.assert_allclose(
+        matches[..., 2].astype(float), expected[..., 2].astype(float)
+    )
+    np.testing.assert_allclose(
+        np.stack(matches[..., 1].ravel()), np.stack(expected[..., 1].ravel())
+    )
+
+
+def test_build_ann_index(compiled_library):
+    compiled_library.build_ann_index(n_tables=3, n_bits=4)
+    phase = compiled_library["A"]
+    assert phase["ann_projections"].shape == (12, 256)
+    assert phase["ann_keys"].shape == phase["ann_order"].shape == (3, 20)
+    assert np.all(np.diff(phase["ann_keys"], axis=1) >= 0)
+    assert np.all(phase["ann_keys"] < 2 ** 4)
+    for order in phase["ann_order"]:
+        np.testing.assert_equal(np.sort(order), np.arange(20))
+
+
+@pytest.mark.parametrize(
+    "method", ["fast_correlation", "zero_mean_normalized_correlation"]
+)
+def test_correlate_library_ann_exhaustive(
+    random_template_library, compiled_library, method
+):
+    # probing the flipped bit of a single bit hash visits every template
+    images, _ = random_template_library
+    compiled_library.build_ann_index(n_tables=1, n_bits=1)
+    matches = correlate_library_ann(images, compiled_library, 4, method, n_probes=1)
+    expected = correlate_library_sparse(images, compiled_library, 4, method)
+    np.testing.assert_allclose(
+        matches[..., 2].astype(float), expected[..., 2].astype(float)
+    )
+
+
+@pytest.mark.parametrize(
+    "method", ["fast_correlation", "zero_mean_normalized_correlation"]
+)
+def test_correlate_library_ann(scored_templates, method):
+    compiled_library = in_plane_rotation_library()
+    compiled_library.build_ann_index(n_tables=16, n_bits=8)
+    angles = [37, 100, 211, 300]
+    images = rotated_patterns(compiled_library, angles)
+    images += np.random.RandomState(0).normal(0, 0.01, images.shape)
+    matches = correlate_library_ann(images, compiled_library, 1, method, n_probes=1)
+    # a small fraction of the templates is scored
+    assert 0 < sum(scored_templates) < 0.25 * len(angles) * 360
+    for match, angle in zip(matches[:, 0], angles):
+        np.testing.assert_allclose(match[1], [angle, 0, 0], atol=2)
+
+
+def test_get_ann_recall(random_template_library, compiled_library):
+    # a template always shares its own buckets
+    images, _ = random_template_library
+    compiled_library.build_ann_index(n_tables=2, n_bits=6)
+    images = compiled_library["A"]["template_matrix"][:5].toarray()
+    benchmark = get_ann_recall(
+        images.reshape(5, 16, 16), compiled_library, 1, "fast_correlation"
+    )
+    assert benchmark["recall"] == 1
+    assert 0 < benchmark["candidate_fraction"] <= 1
+    assert benchmark["ann_time"] >= 0 and benchmark["exhaustive_time"] >= 0
+
+
 def test_crystal_from_template_matching_sp(sp_template_match_result):
     # branch single phase
     cmap = crystal_from_template_matching(sp_template_match_result)
@@ -68,6 +570,40 @@ def test_crystal_from_template_matching_dp(dp_template_match_result):
     np.testing.assert_allclose(cmap[2]["phase_reliability"], r_ph)
 
 
+def test_matches_to_arrays(dp_template_match_result):
+    matches = np.empty((2, 4, 3), dtype="object")
+    matches[0] = dp_template_match_result
+    phase_index, euler, correlation = matches_to_arrays(matches)
+    np.testing.assert_equal(phase_index, [[0, 0, 1, 1], [-1, -1, -1, -1]])
+    np.testing.assert_allclose(euler[0, 1], [2, 3, 5])
+    np.testing.assert_allclose(correlation[0], [0.7, 0.8, 0.5, 0.3])
+    assert np.all(np.isnan(euler[1])) and np.all(np.isnan(correlation[1]))
+
+    round_trip = arrays_to_matches(phase_index, euler, correlation)
+    assert round_trip[1, 0, 0] is None
+    for entry, expected in zip(round_trip[0], dp_template_match_result):
+        assert entry[0] == expected[0]
+        np.testing.assert_allclose(entry[1], expected[1])
+        assert entry[2] == expected[2]
+
+
+@pytest.mark.parametrize(
+    "result_fixture", ["sp_template_match_result", "dp_template_match_result"]
+)
+def test_crystal_arrays_from_template_matching(request, result_fixture):
+    z_matches = request.getfixturevalue(result_fixture)
+    expected = crystal_from_template_matching(z_matches)
+    phase, euler, metrics = crystal_arrays_from_template_matching(
+        *matches_to_arrays(z_matches[np.newaxis])
+    )
+    assert phase[0] == expected[0]
+    np.testing.assert_allclose(euler[0], expected[1])
+    for key, value in expected[2].items():
+        np.testing.assert_allclose(metrics[key][0], value)
+    if "phase_reliability" not in expected[2]:
+        assert np.isnan(metrics["phase_reliability"][0])
+
+
 def test_crystal_from_vector_matching_sp(sp_vector_match_result):
     # branch single phase
     cmap = crystal_from_vector_matching(sp_vector_match_result)
@@ -95,10 +631,82 @@ def test_crystal_from_vector_matching_dp(dp_vector_match_result):
     np.testing.assert_allclose(cmap[2]["phase_reliability"], r_ph)
 
 
+@pytest.mark.parametrize(
+    "result_fixture", ["sp_vector_match_result", "dp_vector_match_result"]
+)
+def test_crystal_arrays_from_vector_matching(request, result_fixture):
+    z_matches = request.getfixturevalue(result_fixture)
+    expected = crystal_from_vector_matching(z_matches)
+    matches = np.empty(1, dtype="object")
+    matches[0] = z_matches
+    phase_index, rotations, match_rate, total_error, ehkls = vector_matches_to_arrays(
+        matches
+    )
+    assert phase_index.shape == (1, len(z_matches))
+    best, phase, euler, metrics = crystal_arrays_from_vector_matching(
+        phase_index, rotations, total_error
+    )
+    assert phase[0] == expected[0]
+    np.testing.assert_allclose(euler[0], expected[1], atol=1e-12)
+    np.testing.assert_allclose(match_rate[0, best[0]], expected[2]["match_rate"])
+    np.testing.assert_allclose(ehkls[0, best[0]], expected[2]["ehkls"])
+    for key in ["total_error", "orientation_reliability", "phase_reliability"]:
+        if key in expected[2]:
+            np.testing.assert_allclose(metrics[key][0], expected[2][key])
+        else:
+            assert np.isnan(metrics[key][0])
+
+
+def test_index_magnitudes():
+    rng = np.random.RandomState(0)
+    simulation = ProfileSimulation(
+        magnitudes=list(rng.rand(200) + 0.5),
+        intensities=np.ones(200),
+        hkls=[{(i, 0, 0): 2} for i in range(200)],
+    )
+    z = np.hstack((rng.rand(30) + 0.5, simulation.magnitudes[:3]))
+    indexation = index_magnitudes(z, simulation, tolerance=0.5)
+    sim_mags = np.array(simulation.magnitudes)
+    for mag, (hkls, diffs) in zip(z, [result[1] for result in indexation]):
+        expected_diffs = np.abs((sim_mags - mag) / mag * 100)
+        expected = np.flatnonzero(expected_diffs < 0.5)
+        assert [list(hkl)[0][0] for hkl in hkls] == expected.tolist()
+        np.testing.assert_allclose(
+            np.asarray(diffs, dtype=float), expected_diffs[expected]
+        )
+
+
+def test_lookup_vector_pairs():
+    rng = np.random.RandomState(0)
+    measurements = np.empty((500, 3), dtype="object")
+    measurements[:] = rng.rand(500, 3) * [2, 2, np.pi]
+    pair_index = get_vector_pair_index(measurements)
+    assert pair_index[0].shape == (3, 500)
+    assert np.all(np.diff(pair_index[0][0]) >= 0)
+    values = measurements.astype(float)
+    for q1_len, q2_len, angle in rng.rand(20, 3) * [2, 2, np.pi]:
+        expected = np.flatnonzero(
+            (np.abs(values[:, 0] - q1_len) < 0.2)
+            & (np.abs(values[:, 1] - q2_len) < 0.2)
+            & (np.abs(values[:, 2] - angle) < 0.3)
+        )
+        np.testing.assert_equal(
+            _lookup_vector_pairs(pair_index, q1_len, q2_len, angle, 0.2, 0.3), expected,
+        )
+
+
+@pytest.mark.parametrize("n", [0, 2, 3, 5, 8])
+def test_top_n_stable(n):
+    values = np.array([0.5, 1.0, 0.5, 0.25, 1.0, 0.5, 0.0])
+    expected = sorted(range(len(values)), key=lambda i: values[i], reverse=True)
+    np.testing.assert_equal(_top_n_stable(values, n), expected[:n])
+
+
 def test_match_vectors(vector_match_peaks, vector_library):
     # Wrap to test handling of ragged arrays
     peaks = np.empty(1, dtype="object")
     peaks[0] = vector_match_peaks
+    phase_keys = set(vector_library["A"])
     matches, rhkls = match_vectors(
         peaks,
         vector_library,
@@ -116,6 +724,95 @@ def test_match_vectors(vector_match_peaks, vector_library):
     np.testing.assert_allclose(rhkls[0][0], [1, 0, 0])
     np.testing.assert_allclose(rhkls[0][1], [0, 2, 0])
     np.testing.assert_allclose(rhkls[0][2], [1, 2, 3])
+    # the pair index is not stored in the library
+    assert set(vector_library["A"]) == phase_keys
+
+
+def test_match_vectors_distinct_solutions(vector_match_peaks, vector_library):
+    phase_keys = set(vector_library["A"])
+    matches, rhkls = match_vectors(
+        vector_match_peaks,
+        vector_library,
+        mag_tol=0.1,
+        angle_tol=0.1,
+        index_error_tol=0.3,
+        n_peaks_to_index=2,
+        n_best=5,
+        misorientation_tol=5,
+    )
+    solutions = [m for m in matches if m.match_rate > 0]
+    # the lattice symmetry is not stored in the library
+    assert set(vector_library["A"]) == phase_keys
+    assert len(solutions) > 0
+    np.testing.assert_allclose(solutions[0].match_rate, 1.0)
+    quaternions = rotation_matrix2quaternion([m.rotation_matrix for m in solutions])
+    symmetry = get_lattice_rotations(np.identity(3))
+    for i, q in enumerate(quaternions[1:]):
+        assert np.all(misorientation_angle(quaternions[: i + 1], q, symmetry) >= 5)
+
+
+def test_match_vectors_overlapping_grains(vector_match_peaks, vector_library):
+    rotation = euler2mat(0.3, 0.7, 1.1)
+    peaks = np.vstack((vector_match_peaks, vector_match_peaks @ rotation.T))
+    kwargs = dict(
+        mag_tol=0.1, angle_tol=0.1, index_error_tol=0.2, n_peaks_to_index=6, n_best=1
+    )
+    single, _ = match_vectors(peaks, vector_library, **kwargs)
+    matches, rhkls = match_vectors(peaks, vector_library, n_grains=2, **kwargs)
+    assert len(matches) == 2
+    np.testing.assert_allclose(matches[0].rotation_matrix, single[0].rotation_matrix)
+    np.testing.assert_allclose([m.match_rate for m in matches], [0.5, 0.5])
+    rotations = sorted((m.rotation_matrix for m in matches), key=lambda r: -np.trace(r))
+    np.testing.assert_allclose(rotations[0], np.identity(3), atol=0.1)
+    np.testing.assert_allclose(rotations[1], rotation.T, atol=0.1)
+    # the solutions of the second grain index the three remaining peaks
+    assert rhkls.dtype == object
+    assert rhkls.shape == (2,)
+    assert rhkls[0].shape[1:] == (6, 3) and rhkls[1].shape[1:] == (3, 3)
+    expected = [[1, 0, 0], [0, 2, 0], [1, 2, 3]]
+    assert any(np.allclose(r[3:], expected) for r in rhkls[0])
+    assert any(np.allclose(r, expected) for r in rhkls[1])
+
+
+def test_orientation_residuals_jacobian():
+    rng = np.random.RandomState(0)
+    params = np.hstack((rng.rand(4, 3), rng.rand(4, 2) * 0.1, 1 + rng.rand(4, 1) * 0.1))
+    k_xy = rng.rand(4, 5, 2)
+    peak_mask = np.ones((4, 5))
+    inverse_bases = np.linalg.inv(np.identity(3) + rng.rand(4, 3, 3) * 0.1)
+    residuals, jacobians, hkls = _orientation_residuals(
+        params, k_xy, peak_mask, inverse_bases, 0.5
+    )
+    for i in range(6):
+        step = np.zeros(6)
+        step[i] = 1e-7
+        shifted = _orientation_residuals(
+            params + step, k_xy, peak_mask, inverse_bases, 0.5
+        )[0]
+        np.testing.assert_allclose(
+            (shifted - residuals) / 1e-7, jacobians[..., i], atol=1e-5
+        )
+
+
+def test_refine_orientations():
+    h, k = np.meshgrid(np.arange(-2, 3), np.arange(-2, 3))
+    k_xy = np.stack((h.ravel(), k.ravel()), axis=-1)[np.newaxis].astype(float)
+    peak_mask = np.ones(k_xy.shape[:2], dtype=bool)
+    peak_mask[0, -3:] = False
+    rotation = euler2mat(0, 0, np.deg2rad(2))
+    rotations, centers, scales, hkls, error_hkls = refine_orientations(
+        k_xy,
+        peak_mask,
+        rotation[np.newaxis],
+        np.zeros((1, 2)),
+        np.ones(1),
+        np.identity(3)[np.newaxis],
+        wavelength=1e-5,
+    )
+    np.testing.assert_allclose(rotations[0], np.identity(3), atol=1e-3)
+    np.testing.assert_allclose(scales, 1)
+    np.testing.assert_allclose(hkls[0, :, :2], k_xy[0], atol=1e-3)
+    assert np.all(error_hkls[0][peak_mask[0]] < 1e-3)
 
 
 def test_match_vector_total_error_default(vector_match_peaks, vector_library):
@@ -27,6 +27,12 @@ from pyxem.signals.electron_diffraction2d import ElectronDiffraction2D
 from pyxem.signals.diffraction_vectors import DiffractionVectors, DiffractionVectors2D
 from pyxem.signals.indexation_results import TemplateMatchingResults
 from pyxem.signals.vdf_image import VDFImage
+from pyxem.utils.detector_utils import apply_index_map, get_index_map
+from pyxem.utils.io_utils import (
+    _get_mib_header,
+    _mib_frames_to_daskarr,
+    _read_exposures,
+)
 
 
 @pytest.mark.parametrize(
@@ -79,3 +85,81 @@ def test_load_ElectronDiffraction2D(diffraction_pattern, make_saved_dp):
     assert (
         diffraction_pattern.metadata.Signal.found_from == dp.metadata.Signal.found_from
     )
+
+
+def _write_mib(path, frames, exposure_times=None, raw_binary=False):
+    """Writes a stack of 8 bit, or 1 bit RAW, single chip frames as a .mib file."""
+    if exposure_times is None:
+        exposure_times = [0.001] * len(frames)
+    pixel_depth, counter_depth = ("R64", 1) if raw_binary else ("U08", 6)
+    with open(path, "wb") as f:
+        for frame, exposure_time in zip(frames, exposure_times):
+            header = (
+                "MQ1,000001,00384,01,0256,0256,{},   1x1,01,"
+                "2020-01-01 00:00:00.000000,{:.6f},0,0,0,0,0,0,0,{},".format(
+                    pixel_depth, exposure_time, counter_depth
+                )
+            )
+            f.write(header.encode("ascii").ljust(384, b"\x00"))
+            if raw_binary:
+                f.write(np.packbits(frame.astype(bool)).tobytes())
+            else:
+                f.write(frame.astype(">u1").tobytes())
+
+
+@pytest.fixture()
+def mib_frames():
+    return np.random.RandomState(0).randint(0, 64, size=(6, 256, 256))
+
+
+def test_mib_frames_to_daskarr(tmp_path, mib_frames):
+    mib_path = str(tmp_path / "frames.mib")
+    _write_mib(mib_path, mib_frames)
+    data = _mib_frames_to_daskarr(mib_path, chunks=4)
+    assert data.chunks == ((4, 2), (256 * 256,))
+    assert data.dtype.isnative
+    np.testing.assert_array_equal(data.compute(), mib_frames.reshape(6, -1))
+
+
+def test_load_mib_stack(tmp_path, mib_frames):
+    mib_path = str(tmp_path / "frames.mib")
+    _write_mib(mib_path, mib_frames)
+    dp = pxm.load_mib(mib_path, reshape=False, flip=False)
+    assert dp.metadata.Signal.signal_type == "TEM"
+    np.testing.assert_array_equal(dp.data.compute(), mib_frames)
+
+
+def test_get_mib_header(tmp_path, mib_frames):
+    mib_path = str(tmp_path / "frames.mib")
+    _write_mib(mib_path, mib_frames)
+    header = _get_mib_header(mib_path)
+    assert header is _get_mib_header(mib_path)
+    assert header.depth == 6
+    assert header.offset == 384
+    assert header.hdr_bits == 384
+    assert header.frame_size == 384 + 256 * 256
+    assert header.dtype == np.dtype(">u1")
+    _write_mib(mib_path, mib_frames[:2])
+    os.utime(mib_path, ns=(0, 0))
+    assert _get_mib_header(mib_path).depth == 2
+
+
+def test_read_exposures(tmp_path, mib_frames):
+    mib_path = str(tmp_path / "frames.mib")
+    exposure_times = [0.001, 0.002, 0.001, 0.001, 0.002, 0.001]
+    _write_mib(mib_path, mib_frames, exposure_times)
+    assert _read_exposures(mib_path) == exposure_times
+    assert _read_exposures(mib_path, pct_frames_to_read=0.5) == exposure_times[:3]
+
+
+def test_load_mib_raw_binary(tmp_path, mib_frames):
+    mib_path = str(tmp_path / "frames.mib")
+    frames = mib_frames % 2
+    _write_mib(mib_path, frames, raw_binary=True)
+    dp = pxm.load_mib(mib_path, reshape=False, flip=False)
+    assert dp.data.shape == (6, 256, 256)
+    index_map = get_index_map(1, "1x1")
+    unpacked = frames.reshape(6, -1)
+    np.testing.assert_array_equal(
+        dp.data.compute(), apply_index_map(unpacked, index_map)
+    )
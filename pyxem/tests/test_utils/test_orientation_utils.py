@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2020 The pyXem developers
+#
+# This file is part of pyXem.
+#
+# pyXem is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyXem is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+from transforms3d.euler import euler2quat, euler2mat, mat2euler
+from transforms3d.quaternions import mat2quat
+
+from pyxem.utils.orientation_utils import (
+    quaternion_multiply,
+    euler2quaternion,
+    quaternion2euler,
+    misorientation_angle,
+    rotation_matrix2euler,
+    rotation_matrix2quaternion,
+    get_lattice_rotations,
+    reduce_to_fundamental_zone,
+    get_modal_orientation,
+)
+
+
+euler = np.random.RandomState(0).rand(50, 3) * [360, 180, 360]
+
+
+def test_euler2quaternion():
+    expected = [euler2quat(*np.deg2rad(e), "rzxz") for e in euler]
+    np.testing.assert_allclose(euler2quaternion(euler), expected, atol=1e-12)
+
+
+def test_quaternion2euler_round_trip():
+    round_trip = quaternion2euler(euler2quaternion(euler))
+    for e, r in zip(euler, round_trip):
+        np.testing.assert_allclose(
+            euler2mat(*np.deg2rad(r), "rzxz"),
+            euler2mat(*np.deg2rad(e), "rzxz"),
+            atol=1e-12,
+        )
+
+
+def test_quaternion_multiply_composes_rotations():
+    q1, q2 = euler2quaternion(euler[:2])
+    expected = euler2mat(*np.deg2rad(euler[0]), "rzxz").dot(
+        euler2mat(*np.deg2rad(euler[1]), "rzxz")
+    )
+    product = quaternion2euler(quaternion_multiply(q1, q2))
+    np.testing.assert_allclose(
+        euler2mat(*np.deg2rad(product), "rzxz"), expected, atol=1e-12
+    )
+
+
+def test_misorientation_angle():
+    q1 = euler2quaternion([[10, 20, 30], [0, 0, 0]])
+    q2 = euler2quaternion([[10, 20, 35], [0, 0, 370]])
+    np.testing.assert_allclose(misorientation_angle(q1, q2), [5, 10], atol=1e-5)
+
+
+def test_rotation_matrix2quaternion():
+    matrices = np.array([euler2mat(*np.deg2rad(e), "rzxz") for e in euler])
+    expected = [mat2quat(m) for m in matrices]
+    np.testing.assert_allclose(
+        rotation_matrix2quaternion(matrices), expected, atol=1e-12
+    )
+
+
+@pytest.mark.parametrize("phi", [None, 0, 180])
+def test_rotation_matrix2euler(phi):
+    angles = euler.copy()
+    if phi is not None:
+        angles[:, 1] = phi
+    matrices = np.array([euler2mat(*np.deg2rad(e), "rzxz") for e in angles])
+    expected = np.rad2deg([mat2euler(m, "rzxz") for m in matrices])
+    np.testing.assert_allclose(rotation_matrix2euler(matrices), expected, atol=1e-9)
+
+
+@pytest.mark.parametrize(
+    "base, n_rotations",
+    [
+        (np.identity(3), 24),
+        (np.diag([1.0, 1.0, 2.0]), 8),
+        ([[1.0, 0, 0], [-0.5, np.sqrt(3) / 2, 0], [0, 0, 1.6]], 12),
+        ([[1.0, 0.1, 0], [0.3, 1.2, 0], [0.2, 0, 0.9]], 1),
+    ],
+)
+def test_get_lattice_rotations(base, n_rotations):
+    rotations = get_lattice_rotations(base)
+    assert rotations.shape == (n_rotations, 4)
+    np.testing.assert_allclose(np.linalg.norm(rotations, axis=-1), 1)
+
+
+def test_misorientation_angle_symmetry():
+    symmetry = get_lattice_rotations(np.identity(3))
+    q1 = euler2quaternion([[10, 20, 30], [0, 0, 0]])
+    q2 = euler2quaternion([[100, 20, 30], [0, 0, 95]])
+    np.testing.assert_allclose(
+        misorientation_angle(q1, q2, symmetry), [0, 5], atol=1e-5
+    )
+
+
+def test_reduce_to_fundamental_zone():
+    symmetry = get_lattice_rotations(np.identity(3))
+    q = euler2quaternion(euler)
+    reduced = reduce_to_fundamental_zone(q, symmetry)
+    identity = np.array([1.0, 0, 0, 0])
+    np.testing.assert_allclose(misorientation_angle(q, reduced, symmetry), 0, atol=1e-5)
+    np.testing.assert_allclose(
+        misorientation_angle(identity, reduced),
+        misorientation_angle(identity, q, symmetry),
+        atol=1e-6,
+    )
+    assert np.all(reduced[:, 0] >= 0)
+
+
+def test_get_modal_orientation():
+    symmetry = get_lattice_rotations(np.identity(3))
+    rng = np.random.RandomState(1)
+    grain = np.array([[30, 40, 50], [120, 40, 50]])[rng.randint(2, size=60)]
+    grain = grain + rng.randn(60, 3) * 0.2
+    other = rng.rand(40, 3) * [360, 180, 360]
+    q = euler2quaternion(np.vstack((grain, other, [[np.nan] * 3])))
+    mode, fraction = get_modal_orientation(q, 2, symmetry)
+    assert misorientation_angle(mode, euler2quaternion([30, 40, 50]), symmetry) < 0.5
+    assert fraction >= 0.6
@@ -101,6 +101,21 @@ def test_get_rotation_matrix_between_vectors(
     )
 
 
+def test_get_rotation_matrix_between_vectors_stacked():
+    rng = np.random.RandomState(0)
+    from_v1, from_v2, to_v1, to_v2 = rng.randn(4, 10, 3)
+    rotation_matrices = get_rotation_matrix_between_vectors(
+        from_v1, from_v2, to_v1, to_v2
+    )
+    for i in range(10):
+        np.testing.assert_allclose(
+            rotation_matrices[i],
+            get_rotation_matrix_between_vectors(
+                from_v1[i], from_v2[i], to_v1[i : i + 1], to_v2[i : i + 1]
+            )[0],
+        )
+
+
 @pytest.mark.parametrize(
     "vec_a, vec_b, expected_angle",
     [([0, 0, 1], [0, 1, 0], np.deg2rad(90)), ([0, 0, 0], [0, 0, 1], 0)],
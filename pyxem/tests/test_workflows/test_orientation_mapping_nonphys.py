@@ -17,6 +17,7 @@
 # along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
 
 import numpy as np
+import pytest
 import pyxem as pxm
 from diffsims.sims.diffraction_simulation import DiffractionSimulation
 from pyxem.generators.indexation_generator import IndexationGenerator
@@ -86,6 +87,43 @@ def test_match_results():
         assert match_results.inav[1, 1].data[0][1][zxz_angle] == 3
 
 
+def test_sparse_engine_match_results():
+    sparse_results = indexer.correlate(engine="sparse", chunk_size=3)
+    assert isinstance(sparse_results, pxm.TemplateMatchingResults)
+    assert sparse_results.data.shape == match_results.data.shape
+    for zxz_angle in [0, 1, 2]:
+        assert sparse_results.inav[0, 0].data[0][1][zxz_angle] == 0
+        assert sparse_results.inav[1, 0].data[0][1][zxz_angle] == 1
+        assert sparse_results.inav[0, 1].data[0][1][zxz_angle] == 2
+        assert sparse_results.inav[1, 1].data[0][1][zxz_angle] == 3
+
+
+@pytest.mark.parametrize("engine", ["loop", "sparse"])
+def test_compact_match_results(engine):
+    compact_results = indexer.correlate(engine=engine, compact=True)
+    assert compact_results.navigation_shape == (2, 2)
+    np.testing.assert_allclose(compact_results.euler[:, :, 0, 0], [[0, 1], [2, 3]])
+    np.testing.assert_allclose(
+        compact_results.correlation, match_results.data[..., 2].astype(float)
+    )
+
+
+@pytest.mark.parametrize("engine", ["loop", "sparse"])
+def test_masked_match_results(engine):
+    mask = np.array([[True, False], [False, True]])
+    masked_results = indexer.correlate(mask=mask, engine=engine)
+    for zxz_angle in [0, 1, 2]:
+        assert masked_results.inav[0, 0].data[0][1][zxz_angle] == 0
+        assert masked_results.inav[1, 1].data[0][1][zxz_angle] == 3
+    assert masked_results.inav[1, 0].data[0][1] is None
+    assert masked_results.inav[0, 1].data[0][1] is None
+
+
+@pytest.mark.xfail(raises=ValueError)
+def test_mask_wrong_shape():
+    indexer.correlate(mask=np.ones((3, 2), dtype=bool), engine="sparse")
+
+
 def test_plot_best_template_matching_results_on_signal():
     # for coverage
     match_results.plot_best_matching_results_on_signal(dp, library=library)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2020 The pyXem developers
+#
+# This file is part of pyXem.
+#
+# pyXem is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyXem is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Pixel layouts of Medipix detectors, used to rearrange the frames read
+from .mib files."""
+
+from functools import lru_cache
+
+import numpy as np
+import dask.array as da
+
+# Number of pixels along each side of a single Medipix chip
+CHIP_SIZE = 256
+# Width in pixels of the blank cross between the chips of a quad assembly
+CROSS_WIDTH = 3
+# Number of pixels written in reversed order in each column group of RAW data
+RAW_COLUMNS = {1: 64, 6: 8, 12: 4, 24: 4}
+
+
+def _raw_index_map(counter_depth, assembly_size):
+    """Index of the raw pixel stored at each pixel of the detector.
+
+    Parameters
+    ----------
+    counter_depth : int
+        Counter bit depth of the RAW data.
+    assembly_size : str
+        Configuration of the detector chips, '1x1' or '2x2'.
+
+    Returns
+    -------
+    index_map : numpy.ndarray
+        Array of the detector shape with, at each pixel, the index of that
+        pixel in the raw frame.
+    """
+    n_chips = int(assembly_size[0])
+    size = n_chips * CHIP_SIZE
+    cols = RAW_COLUMNS[counter_depth]
+
+    # pixels are written in reversed order within each group of cols pixels
+    index_map = np.arange(size * size).reshape(-1, cols)[:, ::-1]
+    if n_chips == 2:
+        # the four chips are written side by side as 256 x 1024 strips, the
+        # two bottom chips rotated by 180 degrees
+        index_map = index_map.reshape(size // 2, size * 2)
+        chips = np.split(index_map, 4, axis=1)
+        index_map = np.block(
+            [[chips[0], chips[1]], [chips[2][::-1, ::-1], chips[3][::-1, ::-1]]]
+        )
+    return index_map.reshape(size, size)
+
+
+def _insert_cross(index_map):
+    """Inserts the blank cross between the chips of a quad assembly.
+
+    Parameters
+    ----------
+    index_map : numpy.ndarray
+        Index map of the detector without the cross.
+
+    Returns
+    -------
+    index_map : numpy.ndarray
+        Index map with CROSS_WIDTH rows and columns of -1 inserted at the
+        middle of the detector.
+    """
+    rows, columns = index_map.shape
+    index_map = np.insert(index_map, [columns // 2] * CROSS_WIDTH, -1, axis=1)
+    index_map = np.insert(index_map, [rows // 2] * CROSS_WIDTH, -1, axis=0)
+    return index_map
+
+
+@lru_cache(maxsize=None)
+def get_index_map(counter_depth, assembly_size, raw=True, add_crosses=True):
+    """Index map from the pixel order of a frame on disk to the detector layout.
+
+    Parameters
+    ----------
+    counter_depth : int
+        Counter bit depth of the data.
+    assembly_size : str
+        Configuration of the detector chips, '1x1' or '2x2'.
+    raw : bool
+        Whether the frames are RAW ('R64') data, whose pixels need to be
+        untangled, rather than regular 'MIB' data.
+    add_crosses : bool
+        Whether to insert the blank cross between the chips of a quad
+        assembly. Ignored for single chips.
+
+    Returns
+    -------
+    index_map : numpy.ndarray
+        Read-only array of the output frame shape, e.g. (515, 515) for a quad
+        assembly with crosses, with the index of the pixel on disk at each
+        pixel and -1 at the cross pixels. Maps are cached, so that they are
+        only computed once for each detector configuration.
+    """
+    if raw:
+        index_map = _raw_index_map(counter_depth, assembly_size)
+    else:
+        size = int(assembly_size[0]) * CHIP_SIZE
+        index_map = np.arange(size * size).reshape(size, size)
+    if add_crosses and assembly_size == "2x2":
+        index_map = _insert_cross(index_map)
+    index_map.setflags(write=False)
+    return index_map
+
+
+def apply_index_map(frames, index_map):
+    """Rearranges flat frames to the detector layout of an index map.
+
+    Parameters
+    ----------
+    frames : numpy.ndarray
+        Stack of frames of shape (frames, pixels), in their order on disk.
+    index_map : numpy.ndarray
+        Index map, as returned by get_index_map.
+
+    Returns
+    -------
+    remapped : numpy.ndarray
+        Stack of frames of shape (frames,) + index_map.shape, with zeros at
+        the pixels where the index map is -1.
+    """
+    indices = index_map.ravel()
+    gaps = np.flatnonzero(indices < 0)
+    remapped = frames.take(np.maximum(indices, 0), axis=1)
+    remapped[:, gaps] = 0
+    return remapped.reshape((frames.shape[0],) + index_map.shape)
+
+
+def remap_frames(data, index_map):
+    """Lazily rearranges flat frames to the detector layout of an index map.
+
+    Parameters
+    ----------
+    data : dask.array
+        Stack of frames of shape (frames, pixels), in their order on disk.
+    index_map : numpy.ndarray
+        Index map, as returned by get_index_map.
+
+    Returns
+    -------
+    remapped : dask.array
+        Stack of frames of shape (frames,) + index_map.shape, chunked along
+        the frames like data. Each chunk is rearranged with a single take.
+    """
+    data = data.rechunk({1: -1})
+    return da.map_blocks(
+        apply_index_map,
+        data,
+        index_map=index_map,
+        chunks=(data.chunks[0],) + tuple((n,) for n in index_map.shape),
+        drop_axis=1,
+        new_axis=[1, 2],
+        dtype=data.dtype,
+    )
@@ -203,6 +203,18 @@ def azimuthal_integrate_fast(
     return tth, I
 
 
+def _get_radial_bins(shape):
+    """Integer radius of each pixel of an image of a given shape, as used by
+    radial_average to bin intensities."""
+    # geometric shape work, not 0 indexing
+    center = ((shape[0] / 2) - 0.5, (shape[1] / 2) - 0.5)
+
+    y, x = np.indices(shape)
+    r = np.sqrt((x - center[1]) ** 2 + (y - center[0]) ** 2)
+    # the subtraction of 0.5 gets the 0 in the correct place
+    return np.rint(r - 0.5).astype(int)
+
+
 def radial_average(z, mask=None):
     """Calculate the radial profile by azimuthal averaging about the center.
 
@@ -219,13 +231,7 @@ def radial_average(z, mask=None):
     radial_profile : np.array()
         One-dimensional radial profile of z.
     """
-    # geometric shape work, not 0 indexing
-    center = ((z.shape[0] / 2) - 0.5, (z.shape[1] / 2) - 0.5)
-
-    y, x = np.indices(z.shape)
-    r = np.sqrt((x - center[1]) ** 2 + (y - center[0]) ** 2)
-    r = np.rint(r - 0.5).astype(np.int)
-    # the subtraction of 0.5 gets the 0 in the correct place
+    r = _get_radial_bins(z.shape)
 
     if mask is None:
         tbin = np.bincount(r.ravel(), z.ravel())
@@ -241,7 +247,57 @@ def radial_average(z, mask=None):
     return averaged
 
 
-def reproject_polar(z, dr=1, dt=None, jacobian=True):
+def _get_polar_grid(shape, dr=1, dt=None, periodic=False):
+    """Computes the polar sampling grid used by reproject_polar for data of a
+    given shape.
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape (ny, nx) of the cartesian data.
+    dr : float
+        Radial coordinate spacing for the grid interpolation.
+    dt : float
+        Angular coordinate spacing (in radians). If ``dt=None``, the number of
+        theta values is equal to the largest dimension of the data array.
+    periodic : bool
+        If True, theta is sampled over the full circle [-pi, pi) rather than
+        over the range of theta covered by the pixels.
+
+    Returns
+    -------
+    origin : tuple
+        Origin of the polar coordinate system, in pixels.
+    r_i : numpy.array
+        Radial coordinates of the grid.
+    theta_i : numpy.array
+        Angular coordinates of the grid, in radians.
+    """
+    # geometric shape work, note 0 indexing
+    origin = ((shape[0] / 2) - 0.5, (shape[1] / 2) - 0.5)
+    ny, nx = shape[:2]
+
+    # Determine that the min and max r and theta coords will be...
+    x, y = _index_coords(np.empty(shape[:2]), origin=origin)
+    r, theta = _cart2polar(x, y)  # convert (x,y) -> (r,θ), note θ=0 is vertical
+
+    nr = int(np.ceil((r.max() - r.min()) / dr))
+
+    theta_min, theta_max = (-np.pi, np.pi) if periodic else (theta.min(), theta.max())
+    if dt is None:
+        nt = max(nx, ny)
+    else:
+        # dt in radians
+        nt = int(np.ceil((theta_max - theta_min) / dt))
+
+    # Make a regular (in polar space) grid based on the min and max r & theta
+    r_i = np.linspace(r.min(), r.max(), nr, endpoint=False)
+    theta_i = np.linspace(theta_min, theta_max, nt, endpoint=False)
+
+    return origin, r_i, theta_i
+
+
+def reproject_polar(z, dr=1, dt=None, jacobian=True, periodic=False):
     """Reprojects two-dimensional diffraction data from cartesian to polar
     coordinates.
 
@@ -258,6 +314,9 @@ def reproject_polar(z, dr=1, dt=None, jacobian=True):
         Include ``r`` intensity scaling in the coordinate transform.
         This should be included to account for the changing pixel size that
         occurs during the transform.
+    periodic : bool
+        If True, theta is sampled over the full circle [-pi, pi), so that the
+        output can be treated as periodic along theta.
 
     Returns
     -------
@@ -269,27 +328,8 @@ def reproject_polar(z, dr=1, dt=None, jacobian=True):
     Adapted from: PyAbel, www.github.com/PyAbel/PyAbel
 
     """
-    # geometric shape work, note 0 indexing
-    origin = ((z.shape[0] / 2) - 0.5, (z.shape[1] / 2) - 0.5)
-    # bottom-left coordinate system requires numpy image to be np.flipud
-    data = np.flipud(z)
-    ny, nx = data.shape[:2]
-
-    # Determine that the min and max r and theta coords will be...
-    x, y = _index_coords(z, origin=origin)  # (x,y) coordinates of each pixel
-    r, theta = _cart2polar(x, y)  # convert (x,y) -> (r,θ), note θ=0 is vertical
-
-    nr = np.int(np.ceil((r.max() - r.min()) / dr))
-
-    if dt is None:
-        nt = max(nx, ny)
-    else:
-        # dt in radians
-        nt = np.int(np.ceil((theta.max() - theta.min()) / dt))
-
-    # Make a regular (in polar space) grid based on the min and max r & theta
-    r_i = np.linspace(r.min(), r.max(), nr, endpoint=False)
-    theta_i = np.linspace(theta.min(), theta.max(), nt, endpoint=False)
+    origin, r_i, theta_i = _get_polar_grid(z.shape, dr=dr, dt=dt, periodic=periodic)
+    nr, nt = len(r_i), len(theta_i)
     theta_grid, r_grid = np.meshgrid(theta_i, r_i)
 
     # Project the r and theta grid back into pixel coordinates
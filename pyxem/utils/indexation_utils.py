@@ -21,12 +21,28 @@ from heapq import nlargest
 from itertools import combinations
 import math
 from operator import itemgetter, attrgetter
+import time
+import weakref
 
 import numpy as np
-
-from pyxem.utils.expt_utils import _cart2polar
+from scipy import sparse
+from scipy.sparse.linalg import svds
+
+from pyxem.utils.expt_utils import (
+    _cart2polar,
+    _get_polar_grid,
+    _get_radial_bins,
+    reproject_polar,
+)
+from pyxem.utils.orientation_utils import (
+    euler2quaternion,
+    get_lattice_rotations,
+    misorientation_angle,
+    rotation_matrix2euler,
+    rotation_matrix2quaternion,
+)
 from pyxem.utils.vector_utils import get_rotation_matrix_between_vectors
-from pyxem.utils.vector_utils import get_angle_cartesian
+from pyxem.utils.vector_utils import get_angle_cartesian_vec
 
 from transforms3d.euler import mat2euler, euler2mat
 from transforms3d.quaternions import mat2quat
@@ -40,6 +56,44 @@ OrientationResult = namedtuple(
     "phase_index rotation_matrix match_rate error_hkls total_error scale center_x center_y".split(),
 )
 
+# Values derived from library arrays, see _cached_on
+_DERIVED_CACHE = {}
+
+
+def _cached_on(obj, key, compute):
+    """Value derived from an object, computed once and cached for as long as
+    the object is alive without being stored in the object or its library.
+
+    Parameters
+    ----------
+    obj : object
+        Object the value is derived from, e.g. an array of a library phase.
+        Replacing the object in the library invalidates the value.
+    key : hashable
+        Identifies the value among the values derived from `obj`, including
+        any other parameter it depends on.
+    compute : callable
+        Function without arguments computing the value.
+
+    Returns
+    -------
+    value
+        The cached or computed value. It is not cached if `obj` cannot be
+        weakly referenced.
+    """
+    cache_key = (id(obj), key)
+    entry = _DERIVED_CACHE.get(cache_key)
+    if entry is not None and entry[0]() is obj:
+        return entry[1]
+    value = compute()
+    try:
+        reference = weakref.ref(obj, lambda _: _DERIVED_CACHE.pop(cache_key, None))
+    except TypeError:
+        return value
+    _DERIVED_CACHE[cache_key] = (reference, value)
+    return value
+
+
 # Functions used in correlate_library.
 def fast_correlation(image_intensities, int_local, pn_local, **kwargs):
     """
@@ -254,35 +308,1302 @@ def correlate_library(image, library, n_largest, method, mask):
     return top_matches.reshape(-1, 3)
 
 
-def index_magnitudes(z, simulation, tolerance):
+def get_template_matrix(pixel_coords, intensities, image_shape):
+    """Packs the templates of a library phase into a single sparse matrix.
+
+    Parameters
+    ----------
+    pixel_coords : numpy.array
+        Object array of (m, 2) integer arrays of template pixel coordinates,
+        in (x, y) order.
+    intensities : numpy.array
+        Object array of (m,) arrays of template intensities.
+    image_shape : tuple
+        Shape (height, width) of the diffraction patterns to be matched.
+
+    Returns
+    -------
+    template_matrix : scipy.sparse.csr_matrix
+        Matrix of shape (n_templates, height * width), each row holding the
+        intensities of one template on the flattened detector. Template pixels
+        falling outside the detector are discarded.
+    template_statistics : dict
+        Per template arrays used by the correlation methods, 'pattern_norms'
+        (the norm of the intensities), 'average_pattern_intensities' (mean
+        over the whole detector) and 'zero_mean_norms' (the template part of
+        the zero_mean_normalized_correlation denominator).
+    """
+    height, width = image_shape
+    n_templates = len(intensities)
+    lengths = np.array([len(i) for i in intensities], dtype=np.int64)
+    template_ids = np.repeat(np.arange(n_templates), lengths)
+
+    if lengths.sum() > 0:
+        coords = np.concatenate([np.asarray(p).reshape(-1, 2) for p in pixel_coords])
+        data = np.concatenate([np.asarray(i, dtype=np.float64) for i in intensities])
+    else:
+        coords = np.empty((0, 2), dtype=np.int64)
+        data = np.empty(0, dtype=np.float64)
+    coords = coords.astype(np.int64)
+
+    nb_pixels = height * width
+    squared_sums = np.bincount(template_ids, weights=data ** 2, minlength=n_templates)
+    average_pattern_intensities = (
+        np.bincount(template_ids, weights=data, minlength=n_templates) / nb_pixels
+    )
+    # norm of (intensities - average_pattern_intensity), expanded
+    centred_norms = np.sqrt(
+        np.clip(
+            squared_sums
+            - 2 * nb_pixels * average_pattern_intensities ** 2
+            + lengths * average_pattern_intensities ** 2,
+            0,
+            None,
+        )
+    )
+    template_statistics = {
+        "pattern_norms": np.sqrt(squared_sums),
+        "average_pattern_intensities": average_pattern_intensities,
+        "zero_mean_norms": centred_norms
+        + (nb_pixels - lengths) * average_pattern_intensities ** 2,
+    }
+
+    inside = (
+        (coords[:, 0] >= 0)
+        & (coords[:, 0] < width)
+        & (coords[:, 1] >= 0)
+        & (coords[:, 1] < height)
+    )
+    columns = coords[inside, 1] * width + coords[inside, 0]
+    template_matrix = sparse.csr_matrix(
+        (data[inside], (template_ids[inside], columns)),
+        shape=(n_templates, height * width),
+    )
+
+    return template_matrix, template_statistics
+
+
+def _normalize_scores(dots, images, phase, method):
+    """Turns the dot products of flattened images with the templates of a
+    phase into correlation scores.
+
+    Parameters
+    ----------
+    dots : numpy.array
+        Array of shape (n_images, n_templates) of image . template products.
+    images : numpy.array
+        Array of shape (n_images, n_pixels).
+    phase : dict
+        Phase entry of a CompiledTemplateLibrary.
+    method : str
+        'fast_correlation' or 'zero_mean_normalized_correlation'.
+
+    Returns
+    -------
+    scores : numpy.array
+        Array of shape (n_images, n_templates).
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if method == "fast_correlation":
+            scores = dots / phase["pattern_norms"]
+            scores[:, phase["pattern_norms"] == 0] = 0
+        elif method == "zero_mean_normalized_correlation":
+            nb_pixels = images.shape[1]
+            average_image_intensity = images.mean(axis=1)
+            image_std = np.linalg.norm(
+                images - average_image_intensity[:, np.newaxis], axis=1
+            )
+
+            match_numerator = dots - nb_pixels * np.outer(
+                average_image_intensity, phase["average_pattern_intensities"]
+            )
+            match_denominator = np.outer(image_std, phase["zero_mean_norms"])
+            scores = np.where(
+                match_denominator == 0, 0, match_numerator / match_denominator
+            )
+        else:
+            raise NotImplementedError(
+                "The method `{}` is not implemented. "
+                "See documentation for available "
+                "implementations.".format(method)
+            )
+
+    return scores
+
+
+def _sparse_correlation_scores(images, phase, method):
+    """Scores a stack of flattened images against every template of a phase.
+
+    Parameters
+    ----------
+    images : numpy.array
+        Array of shape (n_images, height * width).
+    phase : dict
+        Phase entry of a CompiledTemplateLibrary.
+    method : str
+        'fast_correlation' or 'zero_mean_normalized_correlation'.
+
+    Returns
+    -------
+    scores : numpy.array
+        Array of shape (n_images, n_templates).
+    """
+    # (n_templates, n_px) x (n_px, n_images) -> (n_images, n_templates)
+    dots = np.asarray(phase["template_matrix"].dot(images.T)).T
+    return _normalize_scores(dots, images, phase, method)
+
+
+def _top_n_indices(scores, n_largest):
+    """Indices of the n_largest scores along the last axis, sorted in
+    descending order, found by partial selection."""
+    n = min(n_largest, scores.shape[1])
+    if n == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if n < scores.shape[1]:
+        top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    else:
+        top = np.broadcast_to(np.arange(n), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+
+def _vector_column(vectors):
+    """Packs an array of shape (..., 3) into an object array of shape (...)
+    holding one vector per entry, for the orientation column of the top
+    matches.
+    """
+    column = np.empty(vectors.shape[0] * vectors.shape[1], dtype="object")
+    column[:] = list(vectors.reshape(-1, 3))
+    return column.reshape(vectors.shape[:2])
+
+
+def correlate_library_sparse(images, library, n_largest, method, phase_mask=None):
+    """Correlates a stack of experimental diffraction patterns with all
+    templates of a sparse template library at once.
+
+    Each phase is scored with a single sparse x dense matrix product and the
+    top n matches are found by partial selection, which gives the same
+    results as :func:`correlate_library` at a fraction of the cost.
+
+    Parameters
+    ----------
+    images : numpy.array
+        Stack of diffraction patterns of shape (n_images, height, width).
+    library : CompiledTemplateLibrary
+        Library of sparse templates compiled for the image shape.
+    n_largest : int
+        The number of well correlated simulations to be retained.
+    method : str
+        Name of method used to compute correlation between templates and
+        diffraction patterns. Can be 'fast_correlation' or
+        'zero_mean_normalized_correlation'.
+    phase_mask : numpy.array
+        Boolean array of shape (n_images, <num phases>), e.g. from
+        :func:`prescreen_phases`. Images are only correlated with the phases
+        where it is True, the matches of the other phases have zero
+        orientation and correlation. If None all phases are correlated.
+
+    Returns
+    -------
+    top_matches : numpy.array
+        Array of shape (n_images, <num phases>*n_largest, 3) containing, for
+        each image, entries on the form [phase index, [z, x, z], correlation]
+        as returned by :func:`correlate_library`.
+
+    See also
+    --------
+    correlate_library, IndexationGenerator.correlate
+    """
+    n_images = images.shape[0]
+    images = np.asarray(images, dtype=np.float64).reshape(n_images, -1)
+    top_matches = np.empty((n_images, len(library), n_largest, 3), dtype="object")
+
+    for phase_index, phase in enumerate(library.values()):
+        top_matches[:, phase_index, :, 0] = phase_index
+        top_matches[:, phase_index, :, 2] = 0.0
+
+        if phase_mask is None:
+            rows = np.arange(n_images)
+        else:
+            rows = np.flatnonzero(phase_mask[:, phase_index])
+            masked = np.flatnonzero(~phase_mask[:, phase_index])
+            top_matches[masked, phase_index, :, 1] = _vector_column(
+                np.zeros((len(masked), n_largest, 3))
+            )
+        if len(rows) == 0:
+            continue
+        scores = _sparse_correlation_scores(images[rows], phase, method)
+        top = _top_n_indices(scores, n_largest)
+        n = top.shape[1]
+
+        top_matches[rows, phase_index, :n, 2] = np.take_along_axis(scores, top, axis=1)
+        top_matches[rows, phase_index, :n, 1] = _vector_column(
+            phase["orientations"][top]
+        )
+        if n < n_largest:
+            top_matches[rows, phase_index, n:, 1] = _vector_column(
+                np.zeros((len(rows), n_largest - n, 3))
+            )
+
+    return top_matches.reshape(n_images, -1, 3)
+
+
+def get_radial_fingerprints(images):
+    """Radial profiles of a stack of diffraction patterns, binned as by
+    :func:`pyxem.utils.expt_utils.radial_average`.
+
+    Parameters
+    ----------
+    images : numpy.array
+        Stack of diffraction patterns of shape (n_images, height, width).
+
+    Returns
+    -------
+    fingerprints : numpy.array
+        Array of shape (n_images, n_radii) of azimuthally averaged intensities.
+    """
+    n_images = images.shape[0]
+    radial_bins = _get_radial_bins(images.shape[1:]).ravel()
+    bin_matrix = sparse.csr_matrix(
+        (np.ones(len(radial_bins)), (np.arange(len(radial_bins)), radial_bins))
+    )
+    profiles = bin_matrix.T.dot(np.reshape(images, (n_images, -1)).T).T
+    return profiles / np.bincount(radial_bins)
+
+
+def _get_phase_fingerprint(phase, image_shape):
+    """Radial profile of the summed templates of a phase, cached for its
+    template matrix and the image shape."""
+
+    def compute():
+        radial_bins = _get_radial_bins(image_shape).ravel()
+        summed_templates = np.asarray(phase["template_matrix"].sum(axis=0)).ravel()
+        return np.bincount(radial_bins, summed_templates) / np.bincount(radial_bins)
+
+    key = ("radial_fingerprint", tuple(image_shape))
+    return _cached_on(phase["template_matrix"], key, compute)
+
+
+def prescreen_phases(images, library, threshold):
+    """Selects the phases worth correlating with each diffraction pattern by
+    comparing radial profiles.
+
+    The radial profile of each pattern is compared, by Pearson correlation,
+    with the radial profile of the sum of the templates of each phase, which
+    shows the radii at which the phase diffracts. Radii inside the innermost
+    template spot, e.g. the direct beam, are ignored.
+
+    Parameters
+    ----------
+    images : numpy.array
+        Stack of diffraction patterns of shape (n_images, height, width).
+    library : CompiledTemplateLibrary
+        Library compiled for the image shape.
+    threshold : float
+        Phases are kept when their profile correlation is at least threshold
+        times that of the best matching phase. All phases are kept when no
+        phase correlates positively.
+
+    Returns
+    -------
+    phase_mask : numpy.array
+        Boolean array of shape (n_images, <num phases>).
+    """
+    phase_profiles = np.array(
+        [
+            _get_phase_fingerprint(phase, library.image_shape)
+            for phase in library.values()
+        ]
+    ).reshape(len(library), -1)
+    diffracting = np.flatnonzero(phase_profiles.any(axis=0))
+    first_radius = diffracting[0] if len(diffracting) else 0
+    phase_profiles = phase_profiles[:, first_radius:]
+    image_profiles = get_radial_fingerprints(images)[:, first_radius:]
+
+    phase_profiles = phase_profiles - phase_profiles.mean(axis=1, keepdims=True)
+    image_profiles = image_profiles - image_profiles.mean(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = image_profiles.dot(phase_profiles.T) / np.outer(
+            np.linalg.norm(image_profiles, axis=1),
+            np.linalg.norm(phase_profiles, axis=1),
+        )
+    scores = np.nan_to_num(scores)
+
+    best_scores = scores.max(axis=1, initial=0)[:, np.newaxis]
+    return (scores >= threshold * best_scores) | (best_scores <= 0)
+
+
+def get_polar_pixel_coords(pixel_coords, image_shape, dr=1, dt=None):
+    """Maps template pixel coordinates onto the periodic polar grid sampled by
+    :func:`pyxem.utils.expt_utils.reproject_polar`.
+
+    Parameters
+    ----------
+    pixel_coords : numpy.array
+        Object array of (m, 2) integer arrays of template pixel coordinates,
+        in (x, y) order.
+    image_shape : tuple
+        Shape (height, width) of the cartesian diffraction patterns.
+    dr : float
+        Radial coordinate spacing of the polar grid.
+    dt : float
+        Angular coordinate spacing of the polar grid, in radians.
+
+    Returns
+    -------
+    polar_coords : numpy.array
+        Object array of (m, 2) integer arrays of template coordinates on the
+        polar grid, in (theta index, r index) order.
+    polar_shape : tuple
+        Shape (nr, ntheta) of the polar patterns.
+    theta_step : float
+        Angular spacing of the polar grid, in radians.
+    """
+    origin, r_i, theta_i = _get_polar_grid(image_shape, dr=dr, dt=dt, periodic=True)
+    r_step = r_i[1] - r_i[0] if len(r_i) > 1 else dr
+    theta_step = theta_i[1] - theta_i[0]
+
+    polar_coords = np.empty(len(pixel_coords), dtype="object")
+    for i, px in enumerate(pixel_coords):
+        px = np.asarray(px, dtype=np.float64).reshape(-1, 2)
+        r, theta = _cart2polar(px[:, 0] - origin[0], px[:, 1] - origin[1])
+        r_index = np.rint((r - r_i[0]) / r_step).astype(np.int64)
+        theta_index = np.rint((theta - theta_i[0]) / theta_step).astype(np.int64)
+        polar_coords[i] = np.stack((theta_index % len(theta_i), r_index), axis=1)
+
+    return polar_coords, (len(r_i), len(theta_i)), theta_step
+
+
+def _polar_correlation_scores(polar_images, phase, method, template_chunk_size=4096):
+    """Scores a stack of polar images against every template of a phase for
+    all in-plane rotations at once.
+
+    The circular cross-correlation along theta of each image with each
+    template is computed in Fourier space, as the templates are sparse only
+    the Fourier coefficients of the image at the template spots are needed.
+
+    Parameters
+    ----------
+    polar_images : numpy.array
+        Array of shape (n_images, nr, ntheta).
+    phase : dict
+        Phase entry of a polar CompiledTemplateLibrary.
+    method : str
+        'fast_correlation' or 'zero_mean_normalized_correlation'.
+    template_chunk_size : int
+        Number of templates handled at once, bounding the memory used.
+
+    Returns
+    -------
+    scores : numpy.array
+        Array of shape (n_images, n_templates) of the best score of each
+        template over all in-plane rotations.
+    shifts : numpy.array
+        Array of shape (n_images, n_templates) of the theta shift, in polar
+        pixels, giving the best score.
+    """
+    n_images, nr, nt = polar_images.shape
+    flat_images = polar_images.reshape(n_images, -1)
+    spectra = np.fft.rfft(polar_images, axis=2)  # (n_images, nr, nk)
+    k = np.arange(spectra.shape[2])
+
+    template_matrix = phase["template_matrix"]
+    n_templates = template_matrix.shape[0]
+    scores = np.zeros((n_images, n_templates))
+    shifts = np.zeros((n_images, n_templates), dtype=np.int64)
+
+    for start in range(0, n_templates, template_chunk_size):
+        chunk = template_matrix[start : start + template_chunk_size].tocoo()
+        if chunk.nnz == 0:
+            continue
+        r_index, theta_index = np.divmod(chunk.col, nt)
+        # Phase factors moving the image spectrum to each spot position
+        spot_factors = chunk.data[:, np.newaxis] * np.exp(
+            2j * np.pi * np.outer(theta_index, k) / nt
+        )
+        membership = sparse.csr_matrix(
+            (np.ones(chunk.nnz), (chunk.row, np.arange(chunk.nnz))),
+            shape=(chunk.shape[0], chunk.nnz),
+        )
+        for i in range(n_images):
+            template_spectra = membership.dot(spectra[i, r_index] * spot_factors)
+            # dots[t, s] = sum_j I_j P(r_j, theta_j + s)
+            dots = np.fft.irfft(template_spectra, n=nt, axis=1)
+            best = np.argmax(dots, axis=1)
+            shifts[i, start : start + chunk.shape[0]] = best
+            scores[i, start : start + chunk.shape[0]] = dots[
+                np.arange(chunk.shape[0]), best
+            ]
+
+    return _normalize_scores(scores, flat_images, phase, method), shifts
+
+
+def correlate_library_polar(images, library, n_largest, method):
+    """Correlates a stack of experimental diffraction patterns with a polar
+    template library, scoring all in-plane rotations of every template at
+    once.
+
+    Each pattern is reprojected to polar coordinates with
+    :func:`pyxem.utils.expt_utils.reproject_polar` and cross-correlated along
+    theta with each template using FFTs. The library therefore only needs to
+    sample out-of-plane orientations, the in-plane rotation giving the best
+    correlation is added to the first (z) Euler angle of the template.
+
+    Parameters
+    ----------
+    images : numpy.array
+        Stack of cartesian diffraction patterns of shape
+        (n_images, height, width).
+    library : CompiledTemplateLibrary
+        Library compiled with
+        :meth:`CompiledTemplateLibrary.from_diffraction_library_polar`.
+    n_largest : int
+        The number of well correlated simulations to be retained.
+    method : str
+        Name of method used to compute correlation between templates and
+        diffraction patterns. Can be 'fast_correlation' or
+        'zero_mean_normalized_correlation'.
+
+    Returns
+    -------
+    top_matches : numpy.array
+        Array of shape (n_images, <num phases>*n_largest, 3) containing, for
+        each image, entries on the form [phase index, [z, x, z], correlation].
+
+    See also
+    --------
+    correlate_library_sparse, IndexationGenerator.correlate_polar
+    """
+    n_images = images.shape[0]
+    dr, dt = library.polar_sampling
+    polar_images = np.array(
+        [
+            reproject_polar(
+                np.asarray(image, dtype=np.float64),
+                dr=dr,
+                dt=dt,
+                jacobian=False,
+                periodic=True,
+            )
+            for image in images
+        ]
+    ).reshape((n_images,) + library.image_shape)
+    top_matches = np.empty((n_images, len(library), n_largest, 3), dtype="object")
+
+    for phase_index, phase in enumerate(library.values()):
+        scores, shifts = _polar_correlation_scores(polar_images, phase, method)
+        top = _top_n_indices(scores, n_largest)
+        n = top.shape[1]
+
+        top_matches[:, phase_index, :, 0] = phase_index
+        top_matches[:, phase_index, :, 2] = 0.0
+        top_matches[:, phase_index, :n, 2] = np.take_along_axis(scores, top, axis=1)
+        orientations = phase["orientations"][top]
+        # The pattern is the template rotated in-plane by -shift * theta_step
+        in_plane = -np.rad2deg(
+            np.take_along_axis(shifts, top, axis=1) * library.theta_step
+        )
+        orientations[..., 0] = np.mod(orientations[..., 0] + in_plane, 360)
+        for i in range(n_images):
+            for j in range(n_largest):
+                top_matches[i, phase_index, j, 1] = (
+                    orientations[i, j] if j < n else np.zeros(3)
+                )
+
+    return top_matches.reshape(n_images, -1, 3)
+
+
+def _cover_orientations(quaternions, resolution):
+    """Greedily selects orientations so that every orientation lies within
+    `resolution` degrees of a selected one, returns their indices."""
+    cos_half_angle = np.cos(np.deg2rad(resolution) / 2)
+    covered = np.zeros(len(quaternions), dtype=bool)
+    representatives = []
+    for i in range(len(quaternions)):
+        if covered[i]:
+            continue
+        representatives.append(i)
+        covered |= np.abs(quaternions.dot(quaternions[i])) >= cos_half_angle
+    return np.array(representatives, dtype=np.int64)
+
+
+def _neighbour_matrix(coarse_quaternions, fine_quaternions, radius, chunk_size=1024):
+    """Sparse boolean matrix of shape (n_coarse, n_fine), true where the
+    misorientation is at most `radius` degrees."""
+    cos_half_angle = np.cos(np.deg2rad(radius) / 2)
+    blocks = [
+        sparse.csr_matrix(
+            np.abs(coarse_quaternions[start : start + chunk_size] @ fine_quaternions.T)
+            >= cos_half_angle
+        )
+        for start in range(0, len(coarse_quaternions), chunk_size)
+    ]
+    if not blocks:
+        return sparse.csr_matrix((0, len(fine_quaternions)), dtype=bool)
+    return sparse.vstack(blocks, format="csr")
+
+
+def get_orientation_hierarchy(orientations, resolutions):
+    """Builds a coarse-to-fine hierarchy over the orientations of a template
+    library.
+
+    Each level is a subset of the templates covering orientation space at a
+    given angular resolution, the finest level being the full library. Each
+    template of a level is linked to the templates of the next finer level
+    that lie within the resolution of the level.
+
+    Parameters
+    ----------
+    orientations : numpy.array
+        Array of shape (n_templates, 3) of Euler angles (rzxz, degrees).
+    resolutions : list of float
+        Angular resolutions (degrees) of the coarse levels. They should be
+        larger than the spacing of the library orientations.
+
+    Returns
+    -------
+    levels : list of numpy.array
+        Template indices of each level, from the coarsest to the full
+        library.
+    neighbours : list of scipy.sparse.csr_matrix
+        For each level but the last, boolean matrix of shape
+        (n_level, n_next_level) linking each template to its neighbours in
+        the next level.
+    """
+    quaternions = euler2quaternion(np.asarray(orientations).reshape(-1, 3))
+    resolutions = sorted(resolutions, reverse=True)
+    levels = [_cover_orientations(quaternions, r) for r in resolutions]
+    levels.append(np.arange(len(quaternions)))
+    neighbours = [
+        _neighbour_matrix(
+            quaternions[levels[i]], quaternions[levels[i + 1]], resolutions[i]
+        )
+        for i in range(len(resolutions))
+    ]
+    return levels, neighbours
+
+
+def _phase_subset(phase, template_indices):
+    """Phase entry restricted to a subset of its templates, as used by
+    :func:`_sparse_correlation_scores`."""
+    return {
+        "template_matrix": phase["template_matrix"][template_indices],
+        "pattern_norms": phase["pattern_norms"][template_indices],
+        "average_pattern_intensities": phase["average_pattern_intensities"][
+            template_indices
+        ],
+        "zero_mean_norms": phase["zero_mean_norms"][template_indices],
+    }
+
+
+def correlate_library_hierarchical(images, library, n_largest, method, n_candidates=5):
+    """Correlates a stack of experimental diffraction patterns with a template
+    library by a coarse-to-fine search over orientations.
+
+    Each pattern is first scored against the coarsest level of the library
+    hierarchy. At each finer level only the templates neighbouring the
+    `n_candidates` best templates of the previous level are scored. The top
+    n matches are chosen among all scored templates.
+
+    Parameters
+    ----------
+    images : numpy.array
+        Stack of diffraction patterns of shape (n_images, height, width).
+    library : CompiledTemplateLibrary
+        Library on which :meth:`CompiledTemplateLibrary.build_hierarchy` has
+        been called.
+    n_largest : int
+        The number of well correlated simulations to be retained.
+    method : str
+        Name of method used to compute correlation between templates and
+        diffraction patterns. Can be 'fast_correlation' or
+        'zero_mean_normalized_correlation'.
+    n_candidates : int
+        Number of templates refined at each level of the hierarchy. Larger
+        values are slower but less likely to miss the best match.
+
+    Returns
+    -------
+    top_matches : numpy.array
+        Array of shape (n_images, <num phases>*n_largest, 3) containing, for
+        each image, entries on the form [phase index, [z, x, z], correlation].
+
+    See also
+    --------
+    get_orientation_hierarchy, IndexationGenerator.correlate_hierarchical
+    """
+    n_images = images.shape[0]
+    images = np.asarray(images, dtype=np.float64).reshape(n_images, -1)
+    top_matches = np.empty((n_images, len(library), n_largest, 3), dtype="object")
+
+    for phase_index, phase in enumerate(library.values()):
+        levels = phase["hierarchy_levels"]
+        neighbours = phase["hierarchy_neighbours"]
+        coarse_scores = _sparse_correlation_scores(
+            images, _phase_subset(phase, levels[0]), method
+        )
+        coarse_candidates = _top_n_indices(coarse_scores, n_candidates)
+
+        for i in range(n_images):
+            scored_templates = [levels[0]]
+            template_scores = [coarse_scores[i]]
+            candidates = coarse_candidates[i]
+            for level in range(1, len(levels)):
+                members = np.unique(neighbours[level - 1][candidates].indices)
+                level_scores = _sparse_correlation_scores(
+                    images[i : i + 1],
+                    _phase_subset(phase, levels[level][members]),
+                    method,
+                )
+                scored_templates.append(levels[level][members])
+                template_scores.append(level_scores[0])
+                candidates = members[_top_n_indices(level_scores, n_candidates)[0]]
+
+            # Templates of coarse levels are scored again in finer levels
+            scored_templates, first = np.unique(
+                np.concatenate(scored_templates), return_index=True
+            )
+            template_scores = np.concatenate(template_scores)[first]
+            _set_top_matches(
+                top_matches[i, phase_index],
+                phase_index,
+                phase["orientations"],
+                scored_templates,
+                template_scores,
+            )
+
+    return top_matches.reshape(n_images, -1, 3)
+
+
+def _set_top_matches(phase_matches, phase_index, orientations, templates, scores):
+    """Fills the (n_largest, 3) matches of one pattern and phase with the best
+    of the scored templates, padding with zero orientations and scores.
+
+    Returns the indices of the retained templates, best first.
+    """
+    n_largest = phase_matches.shape[0]
+    top = _top_n_indices(scores[np.newaxis], n_largest)[0]
+    phase_matches[:, 0] = phase_index
+    for j in range(n_largest):
+        if j < len(top):
+            phase_matches[j, 1] = orientations[templates[top[j]]]
+            phase_matches[j, 2] = scores[top[j]]
+        else:
+            phase_matches[j, 1] = np.zeros(3)
+            phase_matches[j, 2] = 0.0
+    return templates[top]
+
+
+def get_orientation_neighbours(orientations, radius):
+    """Links each orientation of a template library to the orientations
+    within a given misorientation, crystal symmetry not considered.
+
+    Parameters
+    ----------
+    orientations : numpy.array
+        Array of shape (n_templates, 3) of Euler angles (rzxz, degrees).
+    radius : float
+        Largest misorientation (degrees) between neighbours.
+
+    Returns
+    -------
+    neighbours : scipy.sparse.csr_matrix
+        Boolean matrix of shape (n_templates, n_templates).
+    """
+    quaternions = euler2quaternion(np.asarray(orientations).reshape(-1, 3))
+    return _neighbour_matrix(quaternions, quaternions, radius)
+
+
+def _score_coherent(images, phases, seed_templates, seed_scores, method, threshold):
+    """Scores a batch of patterns against the templates neighbouring the best
+    matches of their seeds, falling back to the full library.
+
+    Parameters
+    ----------
+    images : numpy.array
+        Array of shape (n_images, n_pixels) of flattened patterns.
+    phases : list
+        Phase entries of a CompiledTemplateLibrary with neighbours built.
+    seed_templates : numpy.array
+        Array of shape (n_images, n_seeds, n_phases) of the best template of
+        each seed in each phase, -1 where there is none.
+    seed_scores : numpy.array
+        Array of shape (n_images, n_seeds) of the best score of each seed,
+        nan where there is no seed.
+    method : str
+        'fast_correlation' or 'zero_mean_normalized_correlation'.
+    threshold : float
+        The local search is accepted if its best score is no more than
+        (1 - threshold) times the magnitude of the best seed score below it.
+
+    Returns
+    -------
+    scored : list
+        For each image, a list of (templates, scores) for each phase.
+    full_search : numpy.array
+        Boolean array of shape (n_images,), True where the full library was
+        scored.
+    """
+    n_images = len(images)
+    has_seeds = ~np.all(np.isnan(seed_scores), axis=1)
+    seeded = np.flatnonzero(has_seeds)
+    scored = [[None] * len(phases) for _ in range(n_images)]
+    local_best = np.full(n_images, -np.inf)
+
+    for phase_index, phase in enumerate(phases):
+        candidates = {}
+        for i in seeded:
+            seeds = seed_templates[i, :, phase_index]
+            candidates[i] = np.unique(
+                phase["orientation_neighbours"][seeds[seeds >= 0]].indices
+            )
+        if not candidates:
+            continue
+        # all the candidates of the batch are scored in a single product
+        union = np.unique(np.concatenate(list(candidates.values())))
+        scores = _sparse_correlation_scores(
+            images[seeded], _phase_subset(phase, union), method
+        )
+        for k, i in enumerate(seeded):
+            local_scores = scores[k, np.searchsorted(union, candidates[i])]
+            scored[i][phase_index] = (candidates[i], local_scores)
+            if len(local_scores):
+                local_best[i] = max(local_best[i], local_scores.max())
+
+    # The local search may fall short of the best seed by a fraction of the
+    # magnitude of its score, as scores can be negative with
+    # zero_mean_normalized_correlation
+    seed_best = np.where(np.isnan(seed_scores), -np.inf, seed_scores).max(axis=1)
+    seed_best[~has_seeds] = 0
+    margin = (1 - threshold) * np.abs(seed_best)
+    full_search = ~has_seeds | (seed_best - local_best > margin)
+    full = np.flatnonzero(full_search)
+    if len(full):
+        for phase_index, phase in enumerate(phases):
+            scores = _sparse_correlation_scores(images[full], phase, method)
+            templates = np.arange(len(phase["orientations"]))
+            for k, i in enumerate(full):
+                scored[i][phase_index] = (templates, scores[k])
+
+    return scored, full_search
+
+
+def correlate_library_coherent(
+    images, library, n_largest, method, mask=None, threshold=0.9
+):
+    """Correlates a map of experimental diffraction patterns with a template
+    library, seeding the search of each pattern with the best orientations of
+    its already indexed neighbours.
+
+    The patterns are visited row by row. The templates neighbouring the best
+    matches of the three neighbours in the row above are scored first, for
+    all the patterns of a row at once, and the patterns of the first row are
+    seeded by their left neighbour. The full library is only scored, again
+    for all such patterns of a row at once, when the best of the local scores
+    falls below the best score of the neighbours by more than a fraction
+    1 - `threshold` of its magnitude, e.g. at grain boundaries, or when no
+    neighbour has been indexed.
+
+    Parameters
+    ----------
+    images : numpy.array
+        Array of diffraction patterns of shape (ny, nx, height, width), rows
+        are read one at a time so a dask array can be passed.
+    library : CompiledTemplateLibrary
+        Library on which :meth:`CompiledTemplateLibrary.build_neighbours` has
+        been called.
+    n_largest : int
+        The number of well correlated simulations to be retained.
+    method : str
+        Name of method used to compute correlation between templates and
+        diffraction patterns. Can be 'fast_correlation' or
+        'zero_mean_normalized_correlation'.
+    mask : numpy.array
+        Boolean array of shape (ny, nx), patterns where it is False are not
+        indexed. If None all patterns are indexed.
+    threshold : float
+        Fraction of the best score of the neighbours that the local search
+        must reach to be accepted. For negative scores, which
+        zero_mean_normalized_correlation allows, the local search may fall
+        below the neighbours by the same fraction of their magnitude.
+
+    Returns
+    -------
+    top_matches : numpy.array
+        Array of shape (ny, nx, <num phases>*n_largest, 3) containing, for
+        each indexed pattern, entries on the form
+        [phase index, [z, x, z], correlation], None elsewhere.
+    full_search : numpy.array
+        Boolean array of shape (ny, nx), True where the full library was
+        scored.
+
+    See also
+    --------
+    get_orientation_neighbours, IndexationGenerator.correlate_coherent
+    """
+    ny, nx = images.shape[:2]
+    phases = list(library.values())
+    if mask is None:
+        mask = np.ones((ny, nx), dtype=bool)
+    top_matches = np.empty((ny, nx, len(phases), n_largest, 3), dtype="object")
+    full_search = np.zeros((ny, nx), dtype=bool)
+    best_templates = np.full((ny, nx, len(phases)), -1, dtype=np.int64)
+    best_scores = np.full((ny, nx), np.nan)
+
+    for y in range(ny):
+        row = np.asarray(images[y], dtype=np.float64).reshape(nx, -1)
+        columns = np.flatnonzero(mask[y])
+        if y == 0:
+            # the first row is seeded by the left neighbour, one at a time
+            offsets = np.array([-1])
+            batches = np.split(columns, np.arange(1, len(columns)))
+            seed_row = 0
+        else:
+            offsets = np.array([-1, 0, 1])
+            batches = [columns]
+            seed_row = y - 1
+
+        for batch in batches:
+            if len(batch) == 0:
+                continue
+            seed_columns = batch[:, np.newaxis] + offsets
+            inside = (seed_columns >= 0) & (seed_columns < nx)
+            seed_columns = np.clip(seed_columns, 0, nx - 1)
+            seed_templates = np.where(
+                inside[..., np.newaxis], best_templates[seed_row, seed_columns], -1
+            )
+            seed_scores = np.where(inside, best_scores[seed_row, seed_columns], np.nan)
+
+            scored, batch_full_search = _score_coherent(
+                row[batch], phases, seed_templates, seed_scores, method, threshold
+            )
+            full_search[y, batch] = batch_full_search
+
+            for x, pattern_scored in zip(batch, scored):
+                for phase_index, (templates, scores) in enumerate(pattern_scored):
+                    top = _set_top_matches(
+                        top_matches[y, x, phase_index],
+                        phase_index,
+                        phases[phase_index]["orientations"],
+                        templates,
+                        scores,
+                    )
+                    if len(top):
+                        best_templates[y, x, phase_index] = top[0]
+                best_scores[y, x] = max(
+                    (s.max() for _, s in pattern_scored if len(s)), default=-np.inf
+                )
+
+    return top_matches.reshape(ny, nx, -1, 3), full_search
+
+
+def get_low_rank_templates(template_matrix, rank):
+    """Truncated singular value decomposition of a template matrix.
+
+    Parameters
+    ----------
+    template_matrix : scipy.sparse.csr_matrix
+        Matrix of shape (n_templates, n_pixels) as returned by
+        :func:`get_template_matrix`.
+    rank : int
+        Number of singular vectors retained, at most
+        min(n_templates, n_pixels) - 1, or 1 for a single template.
+
+    Returns
+    -------
+    basis : numpy.array
+        Array of shape (rank, n_pixels) of orthonormal basis images.
+    projected_templates : numpy.array
+        Array of shape (n_templates, rank) of the templates in the basis, so
+        that ``projected_templates @ basis`` approximates the templates.
+    """
+    rank = min(rank, min(template_matrix.shape) - 1)
+    if rank < 1:
+        # svds needs 0 < k < min(shape), so a single template or pixel is
+        # decomposed densely
+        u, singular_values, basis = np.linalg.svd(
+            template_matrix.toarray().astype(np.float64), full_matrices=False
+        )
+        return basis, u * singular_values
+    u, singular_values, basis = svds(
+        template_matrix.astype(np.float64),
+        k=rank,
+        v0=np.ones(min(template_matrix.shape)),
+    )
+    order = np.argsort(singular_values)[::-1]
+    return basis[order], u[:, order] * singular_values[order]
+
+
+def correlate_library_low_rank(images, library, n_largest, method, n_candidates=50):
+    """Correlates a stack of experimental diffraction patterns with a template
+    library compressed by a truncated singular value decomposition.
+
+    The patterns are projected onto the basis of each phase and approximate
+    correlation scores are computed in that low dimensional space. The
+    `n_candidates` best candidates of each pattern are then scored exactly.
+
+    Parameters
+    ----------
+    images : numpy.array
+        Stack of diffraction patterns of shape (n_images, height, width).
+    library : CompiledTemplateLibrary
+        Library on which :meth:`CompiledTemplateLibrary.build_low_rank` has
+        been called.
+    n_largest : int
+        The number of well correlated simulations to be retained.
+    method : str
+        Name of method used to compute correlation between templates and
+        diffraction patterns. Can be 'fast_correlation' or
+        'zero_mean_normalized_correlation'.
+    n_candidates : int
+        Number of candidates per pattern and phase scored exactly, at least
+        n_largest.
+
+    Returns
+    -------
+    top_matches : numpy.array
+        Array of shape (n_images, <num phases>*n_largest, 3) containing, for
+        each image, entries on the form [phase index, [z, x, z], correlation].
+
+    See also
+    --------
+    get_low_rank_templates, IndexationGenerator.correlate_low_rank
+    """
+    n_images = images.shape[0]
+    images = np.asarray(images, dtype=np.float64).reshape(n_images, -1)
+    top_matches = np.empty((n_images, len(library), n_largest, 3), dtype="object")
+
+    for phase_index, phase in enumerate(library.values()):
+        projected_images = images.dot(phase["low_rank_basis"].T)
+        approximate_scores = _normalize_scores(
+            projected_images.dot(phase["low_rank_templates"].T), images, phase, method
+        )
+        candidates = _top_n_indices(approximate_scores, max(n_candidates, n_largest))
+
+        for i in range(n_images):
+            scores = _sparse_correlation_scores(
+                images[i : i + 1], _phase_subset(phase, candidates[i]), method
+            )[0]
+            _set_top_matches(
+                top_matches[i, phase_index],
+                phase_index,
+                phase["orientations"],
+                candidates[i],
+                scores,
+            )
+
+    return top_matches.reshape(n_images, -1, 3)
+
+
+def get_lsh_projections(n_pixels, n_tables, n_bits, seed=0):
+    """Random hyperplanes of a locality sensitive hashing index.
+
+    Parameters
+    ----------
+    n_pixels : int
+        Number of pixels of the flattened templates.
+    n_tables : int
+        Number of hash tables.
+    n_bits : int
+        Number of hyperplanes, i.e. bits of the hash, per table.
+    seed : int
+        Seed of the random number generator, the same seed always gives the
+        same hyperplanes.
+
+    Returns
+    -------
+    projections : numpy.array
+        Array of shape (n_tables * n_bits, n_pixels) of hyperplane normals.
+    """
+    random_state = np.random.RandomState(seed)
+    return random_state.standard_normal((n_tables * n_bits, n_pixels)).astype(
+        np.float32
+    )
+
+
+def _lsh_keys(projected, n_bits):
+    """Hash keys of vectors from their projections on the hyperplanes, as an
+    array of shape (..., n_tables)."""
+    bits = projected.reshape(projected.shape[:-1] + (-1, n_bits)) > 0
+    return bits.dot(2 ** np.arange(n_bits, dtype=np.int64))
+
+
+def build_lsh_index(template_matrix, projections, n_bits):
+    """Random hyperplane locality sensitive hashing index of the templates
+    of a phase.
+
+    Each table hashes a template by the signs of its projections on `n_bits`
+    random hyperplanes, so that templates at a small angle, i.e. with a high
+    normalized correlation, are likely to share a bucket. The sign does not
+    depend on the template norm, so the index is over normalized templates.
+
+    Parameters
+    ----------
+    template_matrix : scipy.sparse.csr_matrix
+        Matrix of shape (n_templates, n_pixels) as returned by
+        :func:`get_template_matrix`.
+    projections : numpy.array
+        Hyperplanes as returned by :func:`get_lsh_projections`.
+    n_bits : int
+        Number of bits of the hash of each table, at most 62.
+
+    Returns
+    -------
+    keys : numpy.array
+        Array of shape (n_tables, n_templates) of the sorted hash keys of each
+        table.
+    order : numpy.array
+        Array of shape (n_tables, n_templates) of the template indices in the
+        order of `keys`.
+    """
+    template_keys = _lsh_keys(np.asarray(template_matrix.dot(projections.T)), n_bits)
+    order = np.argsort(template_keys, axis=0, kind="stable").T
+    keys = np.take_along_axis(template_keys.T, order, axis=1)
+    return keys, order
+
+
+def _lsh_candidates(projected_images, keys, order, n_bits, n_probes):
+    """Templates sharing a bucket with each image in any table.
+
+    Besides the bucket of an image, `n_probes` buckets per table are probed,
+    obtained by flipping each of the bits whose hyperplanes are closest to
+    the image.
+
+    Returns a list of arrays of template indices, one per image.
+    """
+    n_tables = keys.shape[0]
+    powers = 2 ** np.arange(n_bits, dtype=np.int64)
+    query_keys = _lsh_keys(projected_images, n_bits)[..., np.newaxis]
+    if n_probes > 0:
+        projected_images = projected_images.reshape(-1, n_tables, n_bits)
+        flipped = np.argsort(np.abs(projected_images), axis=2)[..., :n_probes]
+        query_keys = np.concatenate((query_keys, query_keys ^ powers[flipped]), 2)
+
+    candidates = []
+    for image_keys in query_keys:
+        buckets = []
+        for table in range(n_tables):
+            start = np.searchsorted(keys[table], image_keys[table], side="left")
+            end = np.searchsorted(keys[table], image_keys[table], side="right")
+            buckets.extend(order[table, s:e] for s, e in zip(start, end))
+        candidates.append(np.unique(np.concatenate(buckets)))
+    return candidates
+
+
+def correlate_library_ann(images, library, n_largest, method, n_probes=0):
+    """Correlates a stack of experimental diffraction patterns with the
+    templates found by an approximate nearest neighbour search.
+
+    The candidates of each pattern are the templates sharing a bucket of the
+    locality sensitive hashing index of the library, which are then scored
+    exactly. The cost of the query does not depend on the library size.
+
+    Parameters
+    ----------
+    images : numpy.array
+        Stack of diffraction patterns of shape (n_images, height, width).
+    library : CompiledTemplateLibrary
+        Library on which :meth:`CompiledTemplateLibrary.build_ann_index` has
+        been called.
+    n_largest : int
+        The number of well correlated simulations to be retained.
+    method : str
+        Name of method used to compute correlation between templates and
+        diffraction patterns. Can be 'fast_correlation' or
+        'zero_mean_normalized_correlation'.
+    n_probes : int
+        Number of additional buckets probed per table. Larger values increase
+        the recall at the cost of scoring more templates.
+
+    Returns
+    -------
+    top_matches : numpy.array
+        Array of shape (n_images, <num phases>*n_largest, 3) containing, for
+        each image, entries on the form [phase index, [z, x, z], correlation].
+        Patterns with fewer than n_largest candidates are padded with zero
+        orientations and correlations.
+
+    See also
+    --------
+    build_lsh_index, get_ann_recall, IndexationGenerator.correlate_ann
+    """
+    n_images = images.shape[0]
+    images = np.asarray(images, dtype=np.float64).reshape(n_images, -1)
+    top_matches = np.empty((n_images, len(library), n_largest, 3), dtype="object")
+
+    for phase_index, phase in enumerate(library.values()):
+        candidates = _lsh_candidates(
+            images.dot(phase["ann_projections"].T),
+            phase["ann_keys"],
+            phase["ann_order"],
+            library.ann_parameters[1],
+            n_probes,
+        )
+        for i in range(n_images):
+            scores = _sparse_correlation_scores(
+                images[i : i + 1], _phase_subset(phase, candidates[i]), method
+            )[0]
+            _set_top_matches(
+                top_matches[i, phase_index],
+                phase_index,
+                phase["orientations"],
+                candidates[i],
+                scores,
+            )
+
+    return top_matches.reshape(n_images, -1, 3)
+
+
+def get_ann_recall(images, library, n_largest, method, n_probes=0):
+    """Benchmarks the approximate nearest neighbour search of
+    :func:`correlate_library_ann` against exhaustive matching.
+
+    Parameters
+    ----------
+    images : numpy.array
+        Stack of diffraction patterns of shape (n_images, height, width).
+    library : CompiledTemplateLibrary
+        Library on which :meth:`CompiledTemplateLibrary.build_ann_index` has
+        been called.
+    n_largest : int
+        The number of well correlated simulations compared.
+    method : str
+        Name of method used to compute correlation between templates and
+        diffraction patterns. Can be 'fast_correlation' or
+        'zero_mean_normalized_correlation'.
+    n_probes : int
+        Number of additional buckets probed per table.
+
+    Returns
+    -------
+    benchmark : dict
+        'recall', the fraction of the exhaustive top n matches with a non zero
+        correlation that are also found by the approximate search,
+        'candidate_fraction', the mean fraction of the templates scored per
+        pattern and phase, and 'ann_time' and 'exhaustive_time', the run
+        times in seconds.
+    """
+    start = time.perf_counter()
+    ann_matches = correlate_library_ann(images, library, n_largest, method, n_probes)
+    ann_time = time.perf_counter() - start
+    start = time.perf_counter()
+    exact_matches = correlate_library_sparse(images, library, n_largest, method)
+    exhaustive_time = time.perf_counter() - start
+
+    found = 0
+    total = 0
+    for ann_match, exact_match in zip(ann_matches, exact_matches):
+        ann_solutions = {
+            (phase_index, tuple(orientation))
+            for phase_index, orientation, _ in ann_match
+        }
+        for phase_index, orientation, correlation in exact_match:
+            if correlation > 0:
+                total += 1
+                found += (phase_index, tuple(orientation)) in ann_solutions
+
+    flat_images = np.asarray(images, dtype=np.float64).reshape(len(images), -1)
+    candidate_fractions = []
+    for phase in library.values():
+        candidates = _lsh_candidates(
+            flat_images.dot(phase["ann_projections"].T),
+            phase["ann_keys"],
+            phase["ann_order"],
+            library.ann_parameters[1],
+            n_probes,
+        )
+        n_templates = len(phase["orientations"])
+        candidate_fractions.extend(len(c) / n_templates for c in candidates)
+
+    return {
+        "recall": found / total if total else 1.0,
+        "candidate_fraction": float(np.mean(candidate_fractions)),
+        "ann_time": ann_time,
+        "exhaustive_time": exhaustive_time,
+    }
+
+
+def get_magnitude_index(simulation):
+    """Sorts the simulated magnitudes of a profile simulation for searching
+    with :func:`index_magnitudes`.
+
+    Parameters
+    ----------
+    simulation : DiffractionProfileSimulation
+        Simulation of the diffraction profile.
+
+    Returns
+    -------
+    magnitude_index : tuple
+        The sorted simulated magnitudes, the order sorting them and the
+        simulated hkls in their original order.
+    """
+    sim_mags = np.asarray(simulation.magnitudes, dtype=np.float64)
+    order = np.argsort(sim_mags, kind="stable")
+    return sim_mags[order], order, np.array(simulation.hkls)
+
+
+def index_magnitudes(z, simulation, tolerance, magnitude_index=None):
     """Assigns hkl indices to peaks in the diffraction profile.
 
+    The simulated magnitudes within `tolerance` of each peak are found for
+    all peaks at once, by binary search in the sorted simulated magnitudes.
+
     Parameters
     ----------
+    z : np.array()
+        Magnitudes of the peaks in the diffraction profile.
     simulation : DiffractionProfileSimulation
         Simulation of the diffraction profile.
     tolerance : float
-        The n orientations with the highest correlation values are returned.
+        Max allowed difference in percent between a peak magnitude and a
+        simulated magnitude for assigning the hkl of the latter to the peak.
+    magnitude_index : tuple, optional
+        The result of :func:`get_magnitude_index` for `simulation`, to avoid
+        sorting the simulated magnitudes again when indexing many profiles.
 
     Returns
     -------
     indexation : np.array()
-        indexation results.
+        indexation results, for each peak an array of its magnitude and an
+        array of the matching hkls and their differences in percent.
 
     """
-    mags = z
-    sim_mags = np.array(simulation.magnitudes)
-    sim_hkls = np.array(simulation.hkls)
-    indexation = np.zeros(len(mags), dtype=object)
+    if magnitude_index is None:
+        magnitude_index = get_magnitude_index(simulation)
+    sorted_mags, order, sim_hkls = magnitude_index
+
+    mags = np.asarray(z)
+    if mags.dtype == object and mags.shape == (1,):
+        mags = np.asarray(mags[0])
+    mags = mags.astype(np.float64).ravel()
+
+    # Windows of simulated magnitudes within tolerance, slightly widened to
+    # be filtered with the exact criterion below.
+    half_width = np.abs(mags) * (tolerance / 100) * (1 + 1e-9)
+    starts = np.searchsorted(sorted_mags, mags - half_width, side="left")
+    stops = np.searchsorted(sorted_mags, mags + half_width, side="right")
+    counts = stops - starts
+    peaks = np.repeat(np.arange(len(mags)), counts)
+    # Position of each candidate within the sorted simulated magnitudes
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    positions = np.repeat(starts, counts) + offsets
+    candidates = order[positions]
+
+    diffs = np.absolute((sorted_mags[positions] - mags[peaks]) / mags[peaks] * 100)
+    within = diffs < tolerance
+    peaks, candidates, diffs = peaks[within], candidates[within], diffs[within]
+    # Keep the candidates of each peak in the order of the simulation
+    by_peak = np.lexsort((candidates, peaks))
+    peaks, candidates, diffs = peaks[by_peak], candidates[by_peak], diffs[by_peak]
+    splits = np.cumsum(np.bincount(peaks, minlength=len(mags)))[:-1]
 
-    for i in np.arange(len(mags)):
-        diff = np.absolute((sim_mags - mags.data[i]) / mags.data[i] * 100)
-
-        hkls = sim_hkls[np.where(diff < tolerance)]
-        diffs = diff[np.where(diff < tolerance)]
-
-        indices = np.array((hkls, diffs))
-        indexation[i] = np.array((mags.data[i], indices))
+    indexation = np.zeros(len(mags), dtype=object)
+    for i, (mag, peak_candidates, peak_diffs) in enumerate(
+        zip(mags, np.split(candidates, splits), np.split(diffs, splits))
+    ):
+        indices = np.array((sim_hkls[peak_candidates], peak_diffs))
+        indexation[i] = np.array((mag, indices))
 
     return indexation
 
@@ -307,7 +1628,7 @@ def _choose_peak_ids(peaks, n_peaks_to_index):
     """
     r, angles = _cart2polar(peaks[:, 0], peaks[:, 1])
     return angles.argsort()[
-        np.linspace(0, angles.shape[0] - 1, n_peaks_to_index, dtype=np.int)
+        np.linspace(0, angles.shape[0] - 1, n_peaks_to_index, dtype=int)
     ]
 
 
@@ -352,8 +1673,172 @@ def get_nth_best_solution(
     return best_fit
 
 
+def get_vector_pair_index(measurements):
+    """Sorted lookup index over the measurements of a vector library phase.
+
+    Parameters
+    ----------
+    measurements : numpy.array
+        Array of shape (n_pairs, 3) of the (|q1|, |q2|, angle) of each pair of
+        reciprocal lattice vectors in the library, possibly of object dtype.
+
+    Returns
+    -------
+    sorted_measurements : numpy.array
+        Float array of shape (3, n_pairs) of the |q1|, |q2| and angle rows,
+        sorted by |q1|.
+    order : numpy.array
+        Indices of the library pairs in the order of `sorted_measurements`.
+    """
+    measurements = np.asarray(measurements, dtype=np.float64).reshape(-1, 3)
+    order = np.argsort(measurements[:, 0], kind="stable")
+    return np.ascontiguousarray(measurements[order].T), order
+
+
+def _get_vector_pair_index(phase):
+    """Pair index of a vector library phase, computed once and cached for its
+    measurements."""
+    measurements = phase["measurements"]
+    return _cached_on(
+        measurements, "pair_index", lambda: get_vector_pair_index(measurements)
+    )
+
+
+def _lookup_vector_pairs(pair_index, q1_len, q2_len, angle, mag_tol, angle_tol):
+    """Library pairs matching a pair of experimental vectors within
+    tolerances, found by binary search on |q1|.
+
+    Returns the indices of the matching library pairs in library order.
+    """
+    sorted_measurements, order = pair_index
+    q1_lengths = sorted_measurements[0]
+    start = np.searchsorted(q1_lengths, q1_len - mag_tol, side="right")
+    end = np.searchsorted(q1_lengths, q1_len + mag_tol, side="left")
+    window = sorted_measurements[:, start:end]
+    tolerance_mask = (
+        (np.abs(window[0] - q1_len) < mag_tol)
+        & (np.abs(window[1] - q2_len) < mag_tol)
+        & (np.abs(window[2] - angle) < angle_tol)
+    )
+    return np.sort(order[start:end][tolerance_mask])
+
+
+def _top_n_stable(values, n):
+    """Indices of the n largest values in descending order, found by partial
+    selection. Ties are broken by first occurrence, as a stable sort would."""
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+    if n < len(values):
+        kth = np.partition(values, len(values) - n)[len(values) - n]
+        candidates = np.flatnonzero(values >= kth)
+    else:
+        candidates = np.arange(len(values))
+    order = np.argsort(-values[candidates], kind="stable")[:n]
+    return candidates[order]
+
+
+def _select_distinct_solutions(rotations, match_rates, n, symmetry, tolerance):
+    """Indices of the n solutions with the highest match rates, in descending
+    order, skipping solutions misoriented by less than `tolerance` degrees
+    under `symmetry` from a better one."""
+    quaternions = rotation_matrix2quaternion(rotations)
+    remaining = np.argsort(-match_rates, kind="stable")
+    selected = []
+    while len(remaining) > 0 and len(selected) < n:
+        best, remaining = remaining[0], remaining[1:]
+        selected.append(best)
+        angles = misorientation_angle(
+            quaternions[remaining], quaternions[best], symmetry
+        )
+        remaining = remaining[angles >= tolerance]
+    return np.array(selected, dtype=np.int64)
+
+
+def _get_lattice_symmetry(lattice, lattice_recip):
+    """Rotational symmetry of the reciprocal lattice of a structure lattice,
+    computed once and cached for the lattice and its basis."""
+    base = lattice_recip.base
+    key = ("lattice_symmetry", base.tobytes())
+    return _cached_on(lattice, key, lambda: get_lattice_rotations(base))
+
+
+def _vector_pair_candidates(
+    peaks, pair_ids, pair_index, phase_indices, lattice_recip, mag_tol, angle_tol
+):
+    """Rotations of every library pair matching each of the given pairs of
+    experimental peaks, computed in one batch.
+
+    Returns the peak pair of each candidate as an array of shape (n, 2) and
+    its rotation as an array of shape (n, 3, 3), ordered by peak pair and then
+    library pair.
+    """
+    q1s, q2s = peaks[pair_ids[:, 0]], peaks[pair_ids[:, 1]]
+    q1_lens, q2_lens = np.linalg.norm(q1s, axis=-1), np.linalg.norm(q2s, axis=-1)
+
+    # Ensure q1 is longer than q2 for consistent order.
+    swap = q1_lens < q2_lens
+    q1s, q2s = np.where(swap[:, None], q2s, q1s), np.where(swap[:, None], q1s, q2s)
+    q1_lens, q2_lens = np.maximum(q1_lens, q2_lens), np.minimum(q1_lens, q2_lens)
+    angles = get_angle_cartesian_vec(q1s, q2s)
+
+    # Get library indices for hkls matching each peak pair within tolerances.
+    matched = [
+        _lookup_vector_pairs(pair_index, q1_len, q2_len, angle, mag_tol, angle_tol)
+        for q1_len, q2_len, angle in zip(q1_lens, q2_lens, angles)
+    ]
+    candidate_pairs = np.repeat(np.arange(len(matched)), [len(m) for m in matched])
+    if len(candidate_pairs) == 0:
+        return np.empty((0, 2), dtype=int), np.empty((0, 3, 3))
+
+    # Reference vectors are cartesian coordinates of hkls
+    reference_vectors = lattice_recip.cartesian(phase_indices[np.concatenate(matched)])
+
+    # Rotation from experimental to reference frame
+    rotations = get_rotation_matrix_between_vectors(
+        q1s[candidate_pairs],
+        q2s[candidate_pairs],
+        reference_vectors[:, 0],
+        reference_vectors[:, 1],
+    )
+    return pair_ids[candidate_pairs], rotations
+
+
+def _score_rotations(rotations, peaks, lattice_recip, index_error_tol, num_peaks):
+    """Indexes the peaks with each rotation in one batch.
+
+    Returns the rounded hkls, hkl errors, match rates and mean errors of each
+    rotation, with match rates relative to `num_peaks` peaks.
+    """
+    # Index the peaks by rotating them to the reference coordinate
+    # system. Use rotation directly since it is multiplied from the
+    # right. Einsum gives list of peaks.dot(rotation).
+    hklss = lattice_recip.fractional(np.einsum("ijk,lk->ilj", rotations, peaks))
+
+    # Evaluate error of peak hkl indexation
+    rhklss = np.rint(hklss)
+    ehklss = np.abs(hklss - rhklss)
+    valid_peak_mask = np.max(ehklss, axis=-1) < index_error_tol
+    valid_peak_counts = np.count_nonzero(valid_peak_mask, axis=-1)
+    error_means = ehklss.mean(axis=(1, 2))
+    match_rates = valid_peak_counts * (1 / num_peaks)
+    return rhklss, ehklss, match_rates, error_means
+
+
+def _pair_keys(pair_ids, num_peaks):
+    """Order independent integer key of each pair of peak indices."""
+    return np.min(pair_ids, axis=1) * num_peaks + np.max(pair_ids, axis=1)
+
+
 def match_vectors(
-    peaks, library, mag_tol, angle_tol, index_error_tol, n_peaks_to_index, n_best
+    peaks,
+    library,
+    mag_tol,
+    angle_tol,
+    index_error_tol,
+    n_peaks_to_index,
+    n_best,
+    misorientation_tol=None,
+    n_grains=1,
 ):
     # TODO: Sort peaks by intensity or SNR
     """Assigns hkl indices to pairs of diffraction vectors.
@@ -376,160 +1861,399 @@ def match_vectors(
         The maximum number of peak to index.
     n_best : int
         The maximum number of good solutions to be retained for each phase.
+    misorientation_tol : float, optional
+        If given, solutions misoriented by less than this angle in degrees
+        from a better solution, under the rotational symmetry of the phase
+        lattice, are discarded so that the n_best solutions are distinct
+        orientations. If None all solutions are kept.
+    n_grains : int
+        The maximum number of overlapping grains indexed. After each grain
+        the peaks indexed by its best solution are removed and the remaining
+        peaks are indexed again, until `n_grains` grains are found or fewer
+        than two peaks remain. The solutions of each grain are indexed on
+        the remaining peaks only, with match rates relative to all peaks.
 
     Returns
     -------
     indexation : np.array()
         A numpy array containing the indexation results, each result consisting of 5 entries:
             [phase index, rotation matrix, match rate, error hkls, total error]
+        The results of each grain follow those of the previous grain.
+    rhkls : np.array()
+        The rounded hkl indices of the peaks for each solution with a nonzero
+        match rate, of shape (n_solutions, n_peaks, 3). With `n_grains` > 1,
+        an object array with such an array for each grain found, since the
+        peaks of the later grains exclude those indexed by the previous
+        grains.
 
     """
-    if peaks.shape == (1,) and peaks.dtype == np.object:
+    if peaks.shape == (1,) and peaks.dtype == object:
         peaks = peaks[0]
 
-    # Assign empty array to hold indexation results. The n_best best results
-    # from each phase is returned.
-    top_matches = np.empty(len(library) * n_best, dtype="object")
+    num_peaks = len(peaks)
+    remaining = np.arange(num_peaks)
+    res_top_matches = []
     res_rhkls = []
 
-    # Iterate over phases in DiffractionVectorLibrary and perform indexation
-    # on each phase, storing the best results in top_matches.
-    for phase_index, (phase, structure) in enumerate(
-        zip(library.values(), library.structures)
-    ):
-        solutions = []
-        lattice_recip = structure.lattice.reciprocal()
-        phase_indices = phase["indices"]
-        phase_measurements = phase["measurements"]
+    # Rotations of the library pairs matching each pair of peaks, for each
+    # phase, reused by the following grains.
+    candidates = [(np.empty((0, 2), dtype=int), np.empty((0, 3, 3))) for _ in library]
 
-        if peaks.shape[0] < 2:  # pragma: no cover
-            continue
+    for grain in range(n_grains):
+        remaining_peaks = peaks[remaining]
 
-        # Choose up to n_peaks_to_index unindexed peaks to be paired in all
-        # combinations.
-        # TODO: Matching can be done iteratively where successfully indexed
-        #       peaks are removed after each iteration. This can possibly
-        #       handle overlapping patterns.
-        # unindexed_peak_ids = range(min(peaks.shape[0], n_peaks_to_index))
-        # TODO: Better choice of peaks (longest, highest SNR?)
-        # TODO: Inline after choosing the best, and possibly require external sorting (if using sorted)?
-        unindexed_peak_ids = _choose_peak_ids(peaks, n_peaks_to_index)
-
-        # Find possible solutions for each pair of peaks.
-        for vector_pair_index, peak_pair_indices in enumerate(
-            list(combinations(unindexed_peak_ids, 2))
+        # Assign empty array to hold indexation results. The n_best best
+        # results from each phase is returned.
+        top_matches = np.empty(len(library) * n_best, dtype="object")
+        grain_rhkls = []
+
+        # Iterate over phases in DiffractionVectorLibrary and perform
+        # indexation on each phase, storing the best results in top_matches.
+        for phase_index, (phase, structure) in enumerate(
+            zip(library.values(), library.structures)
         ):
-            # Consider a pair of experimental scattering vectors.
-            q1, q2 = peaks[peak_pair_indices, :]
-            q1_len, q2_len = np.linalg.norm(q1), np.linalg.norm(q2)
-
-            # Ensure q1 is longer than q2 for consistent order.
-            if q1_len < q2_len:
-                q1, q2 = q2, q1
-                q1_len, q2_len = q2_len, q1_len
-
-            # Calculate the angle between experimental scattering vectors.
-            angle = get_angle_cartesian(q1, q2)
-
-            # Get library indices for hkls matching peaks within tolerances.
-            # TODO: phase are object arrays. Test performance of direct float arrays
-            tolerance_mask = np.abs(phase_measurements[:, 0] - q1_len) < mag_tol
-            tolerance_mask[tolerance_mask] &= (
-                np.abs(phase_measurements[tolerance_mask, 1] - q2_len) < mag_tol
-            )
-            tolerance_mask[tolerance_mask] &= (
-                np.abs(phase_measurements[tolerance_mask, 2] - angle) < angle_tol
-            )
+            lattice_recip = structure.lattice.reciprocal()
+            phase_indices = phase["indices"]
+            pair_index = _get_vector_pair_index(phase)
 
-            # Iterate over matched library vectors determining the error in the
-            # associated indexation.
-            if np.count_nonzero(tolerance_mask) == 0:
+            if remaining_peaks.shape[0] < 2:  # pragma: no cover
                 continue
 
-            # Reference vectors are cartesian coordinates of hkls
-            reference_vectors = lattice_recip.cartesian(phase_indices[tolerance_mask])
-
-            # Rotation from experimental to reference frame
-            rotations = get_rotation_matrix_between_vectors(
-                q1, q2, reference_vectors[:, 0], reference_vectors[:, 1]
+            # Choose up to n_peaks_to_index unindexed peaks to be paired in all
+            # combinations.
+            # TODO: Better choice of peaks (longest, highest SNR?)
+            # TODO: Inline after choosing the best, and possibly require external sorting (if using sorted)?
+            unindexed_peak_ids = remaining[
+                _choose_peak_ids(remaining_peaks, n_peaks_to_index)
+            ]
+            pair_ids = np.array(
+                list(combinations(unindexed_peak_ids, 2)), dtype=int
+            ).reshape(-1, 2)
+
+            # Only look up the peak pairs not seen by a previous grain.
+            candidate_pairs, candidate_rotations = candidates[phase_index]
+            pair_keys = _pair_keys(pair_ids, num_peaks)
+            new_pairs, new_rotations = _vector_pair_candidates(
+                peaks,
+                pair_ids[~np.isin(pair_keys, _pair_keys(candidate_pairs, num_peaks))],
+                pair_index,
+                phase_indices,
+                lattice_recip,
+                mag_tol,
+                angle_tol,
             )
+            candidate_pairs = np.concatenate((candidate_pairs, new_pairs))
+            candidate_rotations = np.concatenate((candidate_rotations, new_rotations))
+            candidates[phase_index] = candidate_pairs, candidate_rotations
 
-            # Index the peaks by rotating them to the reference coordinate
-            # system. Use rotation directly since it is multiplied from the
-            # right. Einsum gives list of peaks.dot(rotation).
-            hklss = lattice_recip.fractional(np.einsum("ijk,lk->ilj", rotations, peaks))
-
-            # Evaluate error of peak hkl indexation
-            rhklss = np.rint(hklss)
-            ehklss = np.abs(hklss - rhklss)
-            valid_peak_mask = np.max(ehklss, axis=-1) < index_error_tol
-            valid_peak_counts = np.count_nonzero(valid_peak_mask, axis=-1)
-            error_means = ehklss.mean(axis=(1, 2))
-
-            num_peaks = len(peaks)
-            match_rates = (valid_peak_counts * (1 / num_peaks)) if num_peaks else 0
+            rotations = candidate_rotations[
+                np.isin(_pair_keys(candidate_pairs, num_peaks), pair_keys)
+            ]
+            rhklss, ehklss, match_rates, error_means = _score_rotations(
+                rotations, remaining_peaks, lattice_recip, index_error_tol, num_peaks
+            )
 
             possible_solution_mask = match_rates > 0
-            solutions += [
-                OrientationResult(
-                    phase_index=phase_index,
-                    rotation_matrix=R,
-                    match_rate=match_rate,
-                    error_hkls=ehkls,
-                    total_error=error_mean,
-                    scale=1.0,
-                    center_x=0.0,
-                    center_y=0.0,
-                )
-                for R, match_rate, ehkls, error_mean in zip(
-                    rotations[possible_solution_mask],
-                    match_rates[possible_solution_mask],
-                    ehklss[possible_solution_mask],
-                    error_means[possible_solution_mask],
+            rotations = rotations[possible_solution_mask]
+            ehklss = ehklss[possible_solution_mask]
+            match_rates = match_rates[possible_solution_mask]
+            error_means = error_means[possible_solution_mask]
+            grain_rhkls += rhklss[possible_solution_mask].tolist()
+
+            if misorientation_tol is None:
+                top_n = _top_n_stable(match_rates, n_best)
+            else:
+                top_n = _select_distinct_solutions(
+                    rotations,
+                    match_rates,
+                    n_best,
+                    _get_lattice_symmetry(structure.lattice, lattice_recip),
+                    misorientation_tol,
                 )
-            ]
-
-            res_rhkls += rhklss[possible_solution_mask].tolist()
-
-        n_solutions = min(n_best, len(solutions))
-
-        i = phase_index * n_best  # starting index in unfolded array
+            n_solutions = len(top_n)
+
+            i = phase_index * n_best  # starting index in unfolded array
+
+            if n_solutions > 0:
+                # Only the top n ranked solutions are made into results
+                top_matches[i : i + n_solutions] = [
+                    OrientationResult(
+                        phase_index=phase_index,
+                        rotation_matrix=rotations[j],
+                        match_rate=match_rates[j],
+                        error_hkls=ehklss[j],
+                        total_error=error_means[j],
+                        scale=1.0,
+                        center_x=0.0,
+                        center_y=0.0,
+                    )
+                    for j in top_n
+                ]
+
+            if n_solutions < n_best:
+                # Fill with dummy values
+                top_matches[i + n_solutions : i + n_best] = [
+                    OrientationResult(
+                        phase_index=0,
+                        rotation_matrix=np.identity(3),
+                        match_rate=0.0,
+                        error_hkls=np.array([]),
+                        total_error=1.0,
+                        scale=1.0,
+                        center_x=0.0,
+                        center_y=0.0,
+                    )
+                    for x in range(n_best - n_solutions)
+                ]
 
-        if n_solutions > 0:
-            top_n = sorted(solutions, key=attrgetter("match_rate"), reverse=True)[
-                :n_solutions
-            ]
+        res_top_matches.append(top_matches)
+        res_rhkls.append(grain_rhkls)
 
-            # Put the top n ranked solutions in the output array
-            top_matches[i : i + n_solutions] = top_n
-
-        if n_solutions < n_best:
-            # Fill with dummy values
-            top_matches[i + n_solutions : i + n_best] = [
-                OrientationResult(
-                    phase_index=0,
-                    rotation_matrix=np.identity(3),
-                    match_rate=0.0,
-                    error_hkls=np.array([]),
-                    total_error=1.0,
-                    scale=1.0,
-                    center_x=0.0,
-                    center_y=0.0,
-                )
-                for x in range(n_best - n_solutions)
-            ]
+        # Remove the peaks indexed by the best solution of this grain.
+        solutions = [m for m in top_matches if m is not None and m.match_rate > 0]
+        if grain + 1 == n_grains or not solutions:
+            break
+        best = max(solutions, key=attrgetter("match_rate"))
+        remaining = remaining[np.max(best.error_hkls, axis=-1) >= index_error_tol]
+        if len(remaining) < 2:
+            break
 
     # Because of a bug in numpy (https://github.com/numpy/numpy/issues/7453),
     # triggered by the way HyperSpy reads results (np.asarray(res), which fails
     # when the two tuple values have the same first dimension), we cannot
     # return a tuple directly, but instead have to format the result as an
     # array ourselves.
-    res = np.empty(2, dtype=np.object)
-    res[0] = top_matches
-    res[1] = np.asarray(res_rhkls)
+    res = np.empty(2, dtype=object)
+    res[0] = np.concatenate(res_top_matches)
+    if n_grains == 1:
+        res[1] = np.asarray(res_rhkls[0])
+    else:
+        res[1] = np.empty(len(res_rhkls), dtype=object)
+        for i, grain_rhkls in enumerate(res_rhkls):
+            res[1][i] = np.asarray(grain_rhkls)
     return res
 
 
+def _euler2mat_sxyz(angles):
+    """Rotation matrices and their derivatives for arrays of Euler angles in
+    the static xyz convention, as ``transforms3d.euler.euler2mat(*angles)``.
+
+    Parameters
+    ----------
+    angles : numpy.array
+        Array of shape (n, 3) of the angles (ai, aj, ak) in radians.
+
+    Returns
+    -------
+    R : numpy.array
+        Array of shape (n, 3, 3) of the rotation matrices Rz(ak) Ry(aj) Rx(ai).
+    dR : numpy.array
+        Array of shape (n, 3, 3, 3) of the derivatives of `R` with respect to
+        each of the three angles, along the second axis.
+    """
+    c, s = np.cos(angles), np.sin(angles)
+    zeros, ones = np.zeros(len(angles)), np.ones(len(angles))
+
+    def stack(rows):
+        return np.stack([np.stack(row, axis=-1) for row in rows], axis=-2)
+
+    cx, cy, cz = c.T
+    sx, sy, sz = s.T
+    Rx = stack([[ones, zeros, zeros], [zeros, cx, -sx], [zeros, sx, cx]])
+    Ry = stack([[cy, zeros, sy], [zeros, ones, zeros], [-sy, zeros, cy]])
+    Rz = stack([[cz, -sz, zeros], [sz, cz, zeros], [zeros, zeros, ones]])
+    dRx = stack([[zeros, zeros, zeros], [zeros, -sx, -cx], [zeros, cx, -sx]])
+    dRy = stack([[-sy, zeros, cy], [zeros, zeros, zeros], [-cy, zeros, -sy]])
+    dRz = stack([[-sz, -cz, zeros], [cz, -sz, zeros], [zeros, zeros, zeros]])
+
+    RzRy = np.matmul(Rz, Ry)
+    R = np.matmul(RzRy, Rx)
+    dR = np.stack(
+        (
+            np.matmul(RzRy, dRx),
+            np.matmul(np.matmul(Rz, dRy), Rx),
+            np.matmul(np.matmul(dRz, Ry), Rx),
+        ),
+        axis=1,
+    )
+    return R, dR
+
+
+def _mat2euler_sxyz(R):
+    """Euler angles in the static xyz convention of an array of rotation
+    matrices, as ``transforms3d.euler.mat2euler(R)``."""
+    cy = np.hypot(R[:, 0, 0], R[:, 1, 0])
+    regular = cy > 4 * np.finfo(float).eps
+    ai = np.where(
+        regular,
+        np.arctan2(R[:, 2, 1], R[:, 2, 2]),
+        np.arctan2(-R[:, 1, 2], R[:, 1, 1]),
+    )
+    aj = np.arctan2(-R[:, 2, 0], cy)
+    ak = np.where(regular, np.arctan2(R[:, 1, 0], R[:, 0, 0]), 0.0)
+    return np.stack((ai, aj, ak), axis=-1)
+
+
+def _orientation_residuals(params, k_xy, peak_mask, inverse_bases, wavelength):
+    """Residual hkl errors of a batch of orientations and their Jacobians with
+    respect to the parameters (ai, aj, ak, center_x, center_y, scale).
+
+    Returns the residuals of shape (n, n_peaks, 3), their Jacobians of shape
+    (n, n_peaks, 3, 6) and the unscaled hkls of shape (n, n_peaks, 3).
+    """
+    centers, scales = params[:, 3:5], params[:, 5]
+    R, dR = _euler2mat_sxyz(params[:, :3])
+
+    # Detector coordinates to reciprocal space, see detector_to_fourier
+    k = k_xy + (scales[:, None] * centers)[:, None, :]
+    root = np.sqrt(1 / wavelength ** 2 - np.sum(k ** 2, axis=-1))
+    q = np.concatenate((k, (root - 1 / wavelength)[..., None]), axis=-1)
+    # Derivative of q with respect to the detector coordinates
+    dq = np.zeros(k.shape[:2] + (3, 2))
+    dq[..., 0, 0] = dq[..., 1, 1] = 1
+    dq[..., 2, :] = -k / root[..., None]
+
+    # hkl = scale * inverse_base.T @ R @ q
+    M = np.einsum("nji,njk->nik", inverse_bases, R)
+    hkls = np.einsum("nij,npj->npi", M, q)
+    scaled_hkls = scales[:, None, None] * hkls
+    residuals = (scaled_hkls - np.rint(scaled_hkls)) * peak_mask[..., None]
+
+    jacobians = np.empty(residuals.shape + (6,))
+    jacobians[..., :3] = scales[:, None, None, None] * np.einsum(
+        "nji,najk,npk->npia", inverse_bases, dR, q
+    )
+    M_dq = np.einsum("nij,npjc->npic", M, dq)
+    jacobians[..., 3:5] = (scales ** 2)[:, None, None, None] * M_dq
+    jacobians[..., 5] = hkls + scales[:, None, None] * np.einsum(
+        "npic,nc->npi", M_dq, centers
+    )
+    jacobians *= peak_mask[..., None, None]
+    return residuals, jacobians, hkls
+
+
+def refine_orientations(
+    k_xy,
+    peak_mask,
+    rotation_matrices,
+    centers,
+    scales,
+    inverse_bases,
+    wavelength,
+    vary_angles=True,
+    vary_center=False,
+    vary_scale=False,
+    max_iterations=100,
+    tolerance=1e-10,
+):
+    """Refines a batch of orientations against their diffraction vectors at
+    once, with Levenberg-Marquardt steps using analytic Jacobians.
+
+    Each orientation minimizes the sum of the squared hkl indexation errors of
+    its vectors over the Euler angles, and optionally the pattern center and
+    the scale, like the lmfit objective of `VectorIndexationGenerator`.
+
+    Parameters
+    ----------
+    k_xy : numpy.array
+        Array of shape (n, n_peaks, 2) of the detector coordinates of the
+        vectors of each orientation, padded to the largest number of peaks.
+    peak_mask : numpy.array
+        Boolean array of shape (n, n_peaks), False at the padding.
+    rotation_matrices : numpy.array
+        Array of shape (n, 3, 3) of the initial rotation matrices.
+    centers : numpy.array
+        Array of shape (n, 2) of the initial pattern centers.
+    scales : numpy.array
+        Array of shape (n,) of the initial scales.
+    inverse_bases : numpy.array
+        Array of shape (n, 3, 3) of the inverse of the reciprocal lattice base
+        of the phase of each orientation.
+    wavelength : float
+        Electron wavelength in Ångström.
+    vary_angles, vary_center, vary_scale : bool
+        Free the Euler angles, the pattern center and the scale.
+    max_iterations : int
+        Maximum number of Levenberg-Marquardt steps.
+    tolerance : float
+        Relative decrease of the squared error below which an orientation is
+        considered converged.
+
+    Returns
+    -------
+    rotation_matrices : numpy.array
+        Array of shape (n, 3, 3) of the refined rotation matrices.
+    centers : numpy.array
+        Array of shape (n, 2) of the refined centers.
+    scales : numpy.array
+        Array of shape (n,) of the refined scales, within [0.8, 1.2].
+    hkls : numpy.array
+        Array of shape (n, n_peaks, 3) of the unscaled hkls of the vectors.
+    error_hkls : numpy.array
+        Array of shape (n, n_peaks, 3) of the absolute hkl errors.
+    """
+    peak_mask = np.asarray(peak_mask, dtype=float)
+    params = np.concatenate(
+        (
+            _mat2euler_sxyz(np.asarray(rotation_matrices, dtype=float)),
+            np.asarray(centers, dtype=float).reshape(-1, 2),
+            np.clip(np.asarray(scales, dtype=float), 0.8, 1.2)[:, None],
+        ),
+        axis=1,
+    )
+    free = np.flatnonzero(np.repeat([vary_angles, vary_center, vary_scale], [3, 2, 1]))
+    residuals, jacobians, hkls = _orientation_residuals(
+        params, k_xy, peak_mask, inverse_bases, wavelength
+    )
+    costs = np.sum(residuals ** 2, axis=(1, 2))
+    damping = np.full(len(params), 1e-3)
+    active = np.flatnonzero(costs > 0) if len(free) else np.empty(0, dtype=int)
+
+    for _ in range(max_iterations):
+        if len(active) == 0:
+            break
+        J = jacobians[active][..., free].reshape(len(active), -1, len(free))
+        r = residuals[active].reshape(len(active), -1)
+        JTJ = np.einsum("nmi,nmj->nij", J, J)
+        gradient = np.einsum("nmi,nm->ni", J, r)
+        diagonal = np.einsum("nii->ni", JTJ) + 1e-12
+        damped = JTJ + damping[active, None, None] * (
+            diagonal[:, :, None] * np.identity(len(free))
+        )
+        step = -np.linalg.solve(damped, gradient[..., None])[..., 0]
+
+        trial = params[active].copy()
+        trial[:, free] += step
+        trial[:, 5] = np.clip(trial[:, 5], 0.8, 1.2)
+        trial_residuals, trial_jacobians, trial_hkls = _orientation_residuals(
+            trial, k_xy[active], peak_mask[active], inverse_bases[active], wavelength
+        )
+        trial_costs = np.sum(trial_residuals ** 2, axis=(1, 2))
+
+        improved = trial_costs < costs[active]
+        converged = improved & (
+            costs[active] - trial_costs <= tolerance * costs[active]
+        )
+        accepted = active[improved]
+        params[accepted] = trial[improved]
+        residuals[accepted] = trial_residuals[improved]
+        jacobians[accepted] = trial_jacobians[improved]
+        hkls[accepted] = trial_hkls[improved]
+        costs[accepted] = trial_costs[improved]
+
+        damping[active] = np.where(improved, damping[active] / 10, damping[active] * 10)
+        active = active[~converged & (damping[active] < 1e10) & (trial_costs > 0)]
+
+    rotation_matrices, _ = _euler2mat_sxyz(params[:, :3])
+    return (
+        rotation_matrices,
+        params[:, 3:5],
+        params[:, 5],
+        hkls,
+        np.abs(residuals),
+    )
+
+
 def crystal_from_template_matching(z_matches):
     """Takes template matching results for a single navigation position and
     returns the best matching phase and orientation with correlation and
@@ -593,6 +2317,122 @@ def crystal_from_template_matching(z_matches):
     return results_array
 
 
+def matches_to_arrays(matches):
+    """Converts template matching results to contiguous typed arrays.
+
+    Parameters
+    ----------
+    matches : numpy.array
+        Object array of shape (..., m, 3) with entries
+        [phase index, [z, x, z], correlation], as returned by
+        :func:`correlate_library`. Entries of unindexed positions may be None.
+
+    Returns
+    -------
+    phase_index : numpy.array
+        Integer array of shape (..., m), -1 for missing entries.
+    euler : numpy.array
+        Float array of shape (..., m, 3) of Euler angles (rzxz, degrees), nan
+        for missing entries.
+    correlation : numpy.array
+        Float array of shape (..., m), nan for missing entries.
+    """
+    matches = np.asarray(matches, dtype="object")
+    shape = matches.shape[:-1]
+    phase_index = np.full(shape, -1, dtype=np.int32)
+    euler = np.full(shape + (3,), np.nan)
+    correlation = np.full(shape, np.nan)
+
+    valid = np.array(
+        [entry is not None for entry in matches[..., 0].ravel()], dtype=bool
+    ).reshape(shape)
+    if valid.any():
+        phase_index[valid] = matches[..., 0][valid].astype(np.int32)
+        euler[valid] = np.stack(matches[..., 1][valid]).astype(np.float64)
+        correlation[valid] = matches[..., 2][valid].astype(np.float64)
+
+    return phase_index, euler, correlation
+
+
+def arrays_to_matches(phase_index, euler, correlation):
+    """Converts typed template matching arrays, as returned by
+    :func:`matches_to_arrays`, back to an object array of shape (..., m, 3)
+    with entries [phase index, [z, x, z], correlation]. Entries with a
+    negative phase index are set to None."""
+    shape = np.shape(phase_index)
+    matches = np.empty(shape + (3,), dtype="object")
+    flat_matches = matches.reshape(-1, 3)
+    flat_euler = np.reshape(euler, (-1, 3))
+    for i, (phase, corr) in enumerate(
+        zip(np.ravel(phase_index).tolist(), np.ravel(correlation).tolist())
+    ):
+        if phase >= 0:
+            flat_matches[i] = (phase, flat_euler[i].copy(), corr)
+
+    return matches
+
+
+def crystal_arrays_from_template_matching(phase_index, euler, correlation):
+    """Vectorized :func:`crystal_from_template_matching` over typed template
+    matching arrays.
+
+    Parameters
+    ----------
+    phase_index : numpy.array
+        Integer array of shape (..., m), negative for missing entries.
+    euler : numpy.array
+        Float array of shape (..., m, 3).
+    correlation : numpy.array
+        Float array of shape (..., m).
+
+    Returns
+    -------
+    best_phase : numpy.array
+        Integer array of shape (...) of the best matching phase, -1 where no
+        match is available.
+    best_euler : numpy.array
+        Float array of shape (..., 3) of the best matching orientation.
+    metrics : dict
+        Float arrays of shape (...) for 'correlation',
+        'orientation_reliability' and 'phase_reliability'. The phase
+        reliability is nan at positions matched against a single phase.
+    """
+    phase_index = np.asarray(phase_index)
+    valid = phase_index >= 0
+    correlation = np.where(valid, correlation, -np.inf)
+    best = np.argmax(correlation, axis=-1)[..., np.newaxis]
+    best_phase = np.take_along_axis(phase_index, best, axis=-1)
+    best_correlation = np.take_along_axis(correlation, best, axis=-1)[..., 0]
+    best_euler = np.take_along_axis(euler, best[..., np.newaxis], axis=-2)[..., 0, :]
+
+    same_phase = phase_index == best_phase
+    other_phases = valid & ~same_phase
+    single_phase = ~other_phases.any(axis=-1)
+    same_phase_correlation = np.where(same_phase, correlation, -np.inf)
+    np.put_along_axis(same_phase_correlation, best, -np.inf, axis=-1)
+    second_orientation = same_phase_correlation.max(axis=-1)
+    second_phase = np.where(other_phases, correlation, -np.inf).max(axis=-1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        orientation_reliability = 100 * (1 - second_orientation / best_correlation)
+        phase_reliability = 100 * (1 - second_phase / best_correlation)
+    orientation_reliability = np.where(
+        single_phase & (best_correlation <= 0), 100, orientation_reliability
+    )
+    phase_reliability = np.where(single_phase, np.nan, phase_reliability)
+
+    indexed = valid.any(axis=-1)
+    best_phase = np.where(indexed, best_phase[..., 0], -1)
+    best_euler[~indexed] = np.nan
+    metrics = {
+        "correlation": np.where(indexed, best_correlation, np.nan),
+        "orientation_reliability": np.where(indexed, orientation_reliability, np.nan),
+        "phase_reliability": np.where(indexed, phase_reliability, np.nan),
+    }
+
+    return best_phase, best_euler, metrics
+
+
 def crystal_from_vector_matching(z_matches):
     """Takes vector matching results for a single navigation position and
     returns the best matching phase and orientation with correlation and
@@ -666,6 +2506,146 @@ def crystal_from_vector_matching(z_matches):
     return results_array
 
 
+def vector_matches_to_arrays(matches):
+    """Converts vector matching results to contiguous typed arrays.
+
+    Parameters
+    ----------
+    matches : numpy.array
+        Object array of shape (...) holding an array of `OrientationResult`
+        at each navigation position, as returned by :func:`match_vectors`, or
+        of shape (..., m) holding the `OrientationResult` themselves. Missing
+        entries may be None.
+
+    Returns
+    -------
+    phase_index : numpy.array
+        Integer array of shape (..., m), -1 for missing entries, where m is
+        the largest number of results at a navigation position.
+    rotation_matrix : numpy.array
+        Float array of shape (..., m, 3, 3), nan for missing entries.
+    match_rate : numpy.array
+        Float array of shape (..., m), nan for missing entries.
+    total_error : numpy.array
+        Float array of shape (..., m), nan for missing entries.
+    error_hkls : numpy.array
+        Object array of shape (..., m) of the hkl errors, None for missing
+        entries.
+    """
+    matches = np.asarray(matches, dtype="object")
+    shape = matches.shape
+    flat_matches = matches.ravel()
+    if any(isinstance(m, OrientationResult) for m in flat_matches[:1]):
+        # Results along the last axis rather than in an array per position
+        shape = shape[:-1]
+        flat_matches = matches.reshape(-1, matches.shape[-1])
+    positions = []
+    for position in flat_matches:
+        if isinstance(position, np.ndarray) and position.shape == (1,):
+            position = position[0]
+        positions.append(
+            [] if position is None else [m for m in position if m is not None]
+        )
+    counts = np.array([len(position) for position in positions], dtype=int)
+    n_results = counts.max(initial=0)
+    entries = [m for position in positions for m in position]
+    # Flat indices of the entries in the padded (n_positions, m) arrays
+    filled = (np.arange(n_results) < counts[:, np.newaxis]).ravel()
+
+    phase_index = np.full(counts.size * n_results, -1, dtype=np.int32)
+    rotation_matrix = np.full((counts.size * n_results, 3, 3), np.nan)
+    match_rate = np.full(counts.size * n_results, np.nan)
+    total_error = np.full(counts.size * n_results, np.nan)
+    error_hkls = np.empty(counts.size * n_results, dtype="object")
+    if entries:
+        phase_index[filled] = [m.phase_index for m in entries]
+        rotation_matrix[filled] = [m.rotation_matrix for m in entries]
+        match_rate[filled] = [m.match_rate for m in entries]
+        total_error[filled] = [m.total_error for m in entries]
+        for i, m in zip(np.flatnonzero(filled), entries):
+            error_hkls[i] = m.error_hkls
+
+    shape += (n_results,)
+    return (
+        phase_index.reshape(shape),
+        rotation_matrix.reshape(shape + (3, 3)),
+        match_rate.reshape(shape),
+        total_error.reshape(shape),
+        error_hkls.reshape(shape),
+    )
+
+
+def crystal_arrays_from_vector_matching(phase_index, rotation_matrix, total_error):
+    """Vectorized :func:`crystal_from_vector_matching` over typed vector
+    matching arrays, as returned by :func:`vector_matches_to_arrays`.
+
+    Parameters
+    ----------
+    phase_index : numpy.array
+        Integer array of shape (..., m), negative for missing entries.
+    rotation_matrix : numpy.array
+        Float array of shape (..., m, 3, 3).
+    total_error : numpy.array
+        Float array of shape (..., m).
+
+    Returns
+    -------
+    best : numpy.array
+        Integer array of shape (...) of the index of the best match along the
+        last axis of the inputs.
+    best_phase : numpy.array
+        Integer array of shape (...) of the best matching phase, -1 where no
+        match is available.
+    best_euler : numpy.array
+        Float array of shape (..., 3) of the best matching orientation as
+        Euler angles (rzxz, degrees).
+    metrics : dict
+        Float arrays of shape (...) for 'total_error',
+        'orientation_reliability' and 'phase_reliability'. The phase
+        reliability is nan at positions matched against a single phase, the
+        orientation reliability where the best phase has a single match.
+    """
+    phase_index = np.asarray(phase_index)
+    valid = phase_index >= 0
+    total_error = np.where(valid, total_error, np.inf)
+    best = np.argmin(total_error, axis=-1)[..., np.newaxis]
+    best_phase = np.take_along_axis(phase_index, best, axis=-1)
+    best_error = np.take_along_axis(total_error, best, axis=-1)[..., 0]
+    best_rotation = np.take_along_axis(
+        rotation_matrix, best[..., np.newaxis, np.newaxis], axis=-3
+    )[..., 0, :, :]
+
+    same_phase = valid & (phase_index == best_phase)
+    other_phases = valid & ~same_phase
+    single_phase = ~other_phases.any(axis=-1)
+    same_phase_error = np.where(same_phase, total_error, np.inf)
+    np.put_along_axis(same_phase_error, best, np.inf, axis=-1)
+    second_orientation = same_phase_error.min(axis=-1)
+    second_phase = np.where(other_phases, total_error, np.inf).min(axis=-1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        orientation_reliability = 100 * (
+            1 - best_error / np.where(second_orientation == 0, 1.0, second_orientation)
+        )
+        phase_reliability = 100 * (1 - best_error / second_phase)
+    orientation_reliability = np.where(
+        np.isinf(second_orientation), np.nan, orientation_reliability
+    )
+    phase_reliability = np.where(single_phase, np.nan, phase_reliability)
+
+    indexed = valid.any(axis=-1)
+    best_phase = np.where(indexed, best_phase[..., 0], -1)
+    best_euler = rotation_matrix2euler(best_rotation)
+    best_euler[~indexed] = np.nan
+    metrics = {
+        "total_error": np.where(indexed, best_error, np.nan),
+        "orientation_reliability": np.where(indexed, orientation_reliability, np.nan),
+        "phase_reliability": np.where(indexed, phase_reliability, np.nan),
+    }
+
+    return best[..., 0], best_phase, best_euler, metrics
+
+
 def peaks_from_best_template(single_match_result, library, rank=0):
     """ Takes a TemplateMatchingResults object and return the associated peaks,
     to be used in combination with map().
@@ -19,15 +19,16 @@
 # a lot of stuff depends on this, so we have to create it first
 
 import os
+from functools import lru_cache
 
 import numpy as np
 import dask.array as da
 from math import floor
 from scipy.signal import find_peaks
 import h5py
-from struct import unpack
 
 from pyxem.signals.electron_diffraction2d import LazyElectronDiffraction2D
+from pyxem.utils.detector_utils import get_index_map, remap_frames
 
 
 def load_mib(mib_path, reshape=True, flip=True):
@@ -73,43 +74,31 @@ def load_mib(mib_path, reshape=True, flip=True):
                     ├── scan_X = None
                     └── signal_type = TEM
     """
-    hdr_stuff = _parse_hdr(mib_path)
-    width = hdr_stuff["width"]
-    height = hdr_stuff["height"]
-    width_height = width * height
-
-    data = _mib_to_daskarr(mib_path)
-    depth = _get_mib_depth(hdr_stuff, mib_path)
-    hdr_bits = _get_hdr_bits(hdr_stuff)
-    if hdr_stuff["Counter Depth (number)"] == 1:
+    header = _get_mib_header(mib_path)
+    hdr_stuff = header.hdr_info
+    width = header.width
+    height = header.height
+
+    # frames with the headers skipped, chunked along the frames
+    data = _mib_frames_to_daskarr(mib_path)
+    depth = header.depth
+    if hdr_stuff["Counter Depth (number)"] == 1 and hdr_stuff["raw"] == "R64":
         # RAW 1 bit data: the header bits are written as uint8 but the frames
         # are binary and need to be unpacked as such.
-        data = data.reshape(-1, int(width_height / 8 + hdr_bits))
-        data = data[:, hdr_bits:]
-        # get the shape axis 1 before unpackbit
-        s0 = data.shape[0]
-        s1 = data.shape[1]
-        data = np.unpackbits(data)
-        data.reshape(s0, s1 * 8)
+        data = _unpack_raw_binary(data)
+    if hdr_stuff["raw"] == "R64" or hdr_stuff["Assembly Size"] == "2x2":
+        # untangle the RAW pixels and insert the blank cross between the
+        # quad chips with a single gather per chunk
+        index_map = get_index_map(
+            header.counter_depth, header.assembly_size, raw=header.raw == "R64"
+        )
+        data = remap_frames(data, index_map)
     else:
-        data = data.reshape(-1, int(width_height + hdr_bits))
-        data = data[:, hdr_bits:]
-    if hdr_stuff["raw"] == "R64":
-        data = _untangle_raw(data, hdr_stuff, depth)
-    elif hdr_stuff["raw"] == "MIB":
         data = data.reshape(depth, width, height)
 
-    # if small mib file read all the exposure times otherwise just the 10% default
-    if os.stat(mib_path).st_size * 1e9 < 0.1:
-        exp_times_list = _read_exposures(mib_path, pct_frames_to_read=1.0)
-    else:
-        exp_times_list = _read_exposures(mib_path)
+    exp_times_list = _read_exposures(mib_path)
     data_dict = _STEM_flag_dict(exp_times_list)
 
-    if hdr_stuff["Assembly Size"] == "2x2":
-        # add_crosses expects a dask array object
-        data = _add_crosses(data)
-
     data_pxm = LazyElectronDiffraction2D(data)
 
     # Tranferring dict info to metadata
@@ -195,23 +184,21 @@ def mib_to_h5stack(fp, save_path, mmap_mode="r"):
             "The h5 path provided already exists. Change file name to avoid overwrite."
         )
         return
-    hdr_info = _parse_hdr(fp)
-    width = hdr_info["width"]
-    height = hdr_info["height"]
+    header = _get_mib_header(fp)
+    hdr_info = header.hdr_info
+    width = header.width
+    height = header.height
 
     record_by = hdr_info["record-by"]
-    depth = _get_mib_depth(hdr_info, fp)
+    depth = header.depth
 
     data = _mib_to_daskarr(fp)
-    hdr_bits = _get_hdr_bits(hdr_info)
 
     if record_by == "vector":  # spectral image
         size = (height, width, depth)
         data = data.reshape(size)
 
     elif record_by == "image":  # stack of images
-        width_height = width * height
-
         # remove headers at the beginning of each frame and reshape
         if hdr_info["raw"] == "R64":
             if hdr_info["Assembly Size"] == "2x2":
@@ -244,7 +231,7 @@ def h5stack_to_pxm(h5_path, mib_path, flip=True):
     -------
     data_pxm: pyxem.signals.LazyElectronDiffraction2D
     """
-    hdr_info = _parse_hdr(mib_path)
+    hdr_info = _get_mib_header(mib_path).hdr_info
     f = h5py.File(h5_path, "r")
 
     data = f["data_stack"]
@@ -260,10 +247,7 @@ def h5stack_to_pxm(h5_path, mib_path, flip=True):
         data = _add_crosses(data)
         data_pxm = LazyElectronDiffraction2D(data)
 
-    if os.stat(mib_path).st_size * 1e9 < 0.1:
-        exp_times_list = _read_exposures(mib_path, pct_frames_to_read=1.0)
-    else:
-        exp_times_list = _read_exposures(mib_path)
+    exp_times_list = _read_exposures(mib_path)
     data_dict = _STEM_flag_dict(exp_times_list)
 
     # Tranferring dict info to metadata
@@ -337,15 +321,16 @@ def _manageHeader(fname):
     #(768, 4, 'U16', '2x2', '2019-06-06 11:12:42.001309', 0.001, 12)
 
     """
-    Header = str()
+    Header = bytes()
     with open(fname, "rb") as input:
-        aByte = input.read(1)
-        Header += str(aByte.decode("ascii"))
-        # This gets rid of the header
-        while aByte and ord(aByte) != 0:
-
-            aByte = input.read(1)
-            Header += str(aByte.decode("ascii"))
+        # The header is terminated by a null byte and fits in a single block
+        # for all the detector configurations
+        while b"\x00" not in Header:
+            aBlock = input.read(1024)
+            if not aBlock:
+                break
+            Header += aBlock
+    Header = Header.split(b"\x00")[0].decode("ascii")
 
     elements_in_header = Header.split(",")
 
@@ -480,6 +465,82 @@ def _parse_hdr(fp):
     return hdr_info
 
 
+class MibHeader:
+    """Header information of a .mib file, shared by all the .mib readers.
+
+    Parameters
+    ----------
+    fp : str
+        Filepath to .mib file.
+
+    Attributes
+    ----------
+    hdr_info : dict
+        Dictionary containing header info, as returned by _parse_hdr.
+    width : int
+        Detector number of pixels in x direction.
+    height : int
+        Detector number of pixels in y direction.
+    assembly_size : str
+        Configuration of the detector chips, e.g. '2x2' for quad.
+    counter_depth : int
+        Counter bit depth.
+    raw : str
+        Regular binary 'MIB' or raw binary 'R64'.
+    dtype : numpy.dtype
+        Big-endian dtype of the pixel values stored on disk.
+    offset : int
+        Number of bytes of the header of each frame.
+    hdr_bits : int
+        Number of pixel values spanned by the header of each frame.
+    frame_pixels : int
+        Number of pixel values stored after the header of each frame.
+    frame_size : int
+        Number of bytes of each frame, including its header.
+    depth : int
+        Number of frames in the file.
+    """
+
+    def __init__(self, fp):
+        self.hdr_info = _parse_hdr(fp)
+        self.width = self.hdr_info["width"]
+        self.height = self.hdr_info["height"]
+        self.assembly_size = self.hdr_info["Assembly Size"]
+        self.counter_depth = self.hdr_info["Counter Depth (number)"]
+        self.raw = self.hdr_info["raw"]
+        self.dtype = _get_mib_dtype(self.hdr_info)
+        self.offset = self.hdr_info["data offset"]
+        self.hdr_bits = _get_hdr_bits(self.hdr_info)
+        self.frame_pixels = _get_frame_pixels(self.hdr_info)
+        self.frame_size = _get_frame_size(self.hdr_info)
+        self.depth = _get_mib_depth(self.hdr_info, fp)
+
+
+@lru_cache(maxsize=64)
+def _cached_mib_header(fp, mtime, size):
+    return MibHeader(fp)
+
+
+def _get_mib_header(fp):
+    """Gets the parsed header of a .mib file, parsing it only once per file.
+
+    Headers are cached by path, modification time and size, so that a file
+    that is rewritten is parsed again.
+
+    Parameters
+    ----------
+    fp : str
+        Filepath to .mib file.
+
+    Returns
+    -------
+    header : MibHeader
+        Header information of the .mib file.
+    """
+    stat = os.stat(fp)
+    return _cached_mib_header(os.path.abspath(fp), stat.st_mtime_ns, stat.st_size)
+
+
 def _add_crosses(a):
     """
     Adds 3 pixel buffer cross to quad chip data.
@@ -495,42 +556,14 @@ def _add_crosses(a):
     b : dask.array
         Stack of frames or reshaped 4DSTEM object including 3 pixel buffer cross in the diffraction plane.
     """
+    a = da.asarray(a)
     original_shape = a.shape
+    # the counter depth only matters for RAW data
+    index_map = get_index_map(24, "2x2", raw=False)
 
-    if len(original_shape) == 4:
-        a = a.reshape(
-            original_shape[0] * original_shape[1], original_shape[2], original_shape[3]
-        )
-
-    a_half = int(original_shape[-1] / 2), int(original_shape[-2] / 2)
-    # Define 3 pixel wide cross of zeros to pad raw data
-    if len(original_shape) == 4:
-        z_array = da.zeros(
-            (original_shape[0] * original_shape[1], original_shape[-2], 3),
-            dtype=a.dtype,
-        )
-        z_array2 = da.zeros(
-            (original_shape[0] * original_shape[1], 3, original_shape[-1] + 3),
-            dtype=a.dtype,
-        )
-    else:
-        z_array = da.zeros((original_shape[0], original_shape[-2], 3), dtype=a.dtype)
-        z_array2 = da.zeros(
-            (original_shape[0], 3, original_shape[-1] + 3), dtype=a.dtype
-        )
-
-    # Insert blank cross into raw data
-    b = da.concatenate((a[:, :, : a_half[1]], z_array, a[:, :, a_half[1] :]), axis=-1)
-
-    b = da.concatenate((b[:, : a_half[0], :], z_array2, b[:, a_half[0] :, :]), axis=-2)
-
-    if len(original_shape) == 4:
-        b = b.reshape(
-            original_shape[0],
-            original_shape[1],
-            original_shape[2] + 3,
-            original_shape[3] + 3,
-        )
+    a = a.reshape(-1, original_shape[-2] * original_shape[-1])
+    b = remap_frames(a, index_map)
+    b = b.reshape(original_shape[:-2] + index_map.shape)
 
     return b
 
@@ -550,61 +583,74 @@ def _get_mib_depth(hdr_info, fp):
     depth : int
         Number of frames in the stack
     """
-    # Define standard frame sizes for quad and single medipix chips
-    if hdr_info["Assembly Size"] == "2x2":
-        mib_file_size_dict = {
-            "1": 33536,
-            "6": 262912,
-            "12": 525056,
-            "24": 1049344,
-        }
-    if hdr_info["Assembly Size"] == "1x1":
-        mib_file_size_dict = {
-            "1": 8576,
-            "6": 65920,
-            "12": 131456,
-            "24": 262528,
-        }
-
     file_size = os.path.getsize(fp[:-3] + "mib")
-    if hdr_info["raw"] == "R64":
-
-        single_frame = mib_file_size_dict.get(str(hdr_info["Counter Depth (number)"]))
-        depth = int(file_size / single_frame)
-    elif hdr_info["raw"] == "MIB":
-        if hdr_info["Counter Depth (number)"] == "1":
-            # 1 bit and 6 bit non-raw frames have the same size
-            single_frame = mib_file_size_dict.get("6")
-            depth = int(file_size / single_frame)
-        else:
-            single_frame = mib_file_size_dict.get(
-                str(hdr_info["Counter Depth (number)"])
-            )
-            depth = int(file_size / single_frame)
+    depth = file_size // _get_frame_size(hdr_info)
 
     return depth
 
 
-def _mib_to_daskarr(fp, mmap_mode="r"):
+def _get_frame_pixels(hdr_info):
     """
-    Reads the binary mib file into a numpy memmap object and returns as dask array object
+    Gets the number of pixel values stored on disk for each frame of a .mib file.
 
     Parameters
-    --------------
-    fp: str
-        MIB file name / path
-    mmap_mode: str
-        memmpap read mode - default is 'r'
+    ----------
+    hdr_info: dict
+        output of the parse_hdr function
+
     Returns
-    --------------
-    data_da: dask array
-        data as a dask array object
+    -------
+    frame_pixels: int
+        number of pixel values, or of bytes of bit packed pixel values for
+        1 bit RAW data, after the header of each frame
+    """
+    frame_pixels = hdr_info["width"] * hdr_info["height"]
+    if hdr_info["Counter Depth (number)"] == 1 and hdr_info["raw"] == "R64":
+        # RAW 1 bit data: 8 pixels are packed in every byte, whereas 1 bit
+        # and 6 bit non-raw frames have the same size
+        frame_pixels = frame_pixels // 8
+
+    return frame_pixels
+
+
+def _get_frame_size(hdr_info):
+    """
+    Gets the number of bytes of each frame of a .mib file, including its header.
+
+    Parameters
+    ----------
+    hdr_info: dict
+        output of the parse_hdr function
+
+    Returns
+    -------
+    frame_size: int
+        number of bytes per frame
+    """
+    frame_size = (
+        hdr_info["data offset"]
+        + _get_frame_pixels(hdr_info) * _get_mib_dtype(hdr_info).itemsize
+    )
+
+    return frame_size
+
+
+def _get_mib_dtype(hdr_info):
+    """
+    Gets the big-endian numpy dtype of the pixel values in a .mib file.
+
+    Parameters
+    ----------
+    hdr_info: dict
+        output of the parse_hdr function
+
+    Returns
+    -------
+    data_type: numpy.dtype
+        dtype of the pixel values as stored on disk
     """
-    hdr_info = _parse_hdr(fp)
     data_length = hdr_info["data-length"]
     data_type = hdr_info["data-type"]
-    endian = hdr_info["byte-order"]
-    read_offset = 0
 
     if data_type == "signed":
         data_type = "int"
@@ -626,11 +672,99 @@ def _mib_to_daskarr(fp, mmap_mode="r"):
         data_type = np.dtype(data_type)
     data_type = data_type.newbyteorder(endian)
 
+    return data_type
+
+
+def _mib_to_daskarr(fp, mmap_mode="r"):
+    """
+    Reads the binary mib file into a numpy memmap object and returns as dask array object
+
+    Parameters
+    --------------
+    fp: str
+        MIB file name / path
+    mmap_mode: str
+        memmpap read mode - default is 'r'
+    Returns
+    --------------
+    data_da: dask array
+        data as a dask array object
+    """
+    data_type = _get_mib_header(fp).dtype
+    read_offset = 0
+
     data_mem = np.memmap(fp, offset=read_offset, dtype=data_type, mode=mmap_mode)
     data_da = da.from_array(data_mem)
     return data_da
 
 
+def _mib_frames_to_daskarr(fp, mmap_mode="r", chunks="auto"):
+    """
+    Memory maps the frames of a .mib file as a lazy stack with the frame
+    headers skipped.
+
+    Each frame is read as a record of its header bytes followed by its pixel
+    values, so selecting the pixel values gives a strided view of the file
+    and no data is copied until the dask array is computed. The stack is
+    chunked along the frames only and every chunk is converted from the
+    big-endian file order to native byte order when it is computed.
+
+    Parameters
+    ----------
+    fp: str
+        MIB file name / path
+    mmap_mode: str
+        memmap read mode - default is 'r'
+    chunks: int or str
+        number of frames per chunk, default 'auto' lets dask choose the number
+        of frames from its configured chunk size
+
+    Returns
+    -------
+    data_da: dask array
+        frames as a (frames, pixels) dask array object, where pixels is the
+        number of bytes of bit packed pixel values for 1 bit RAW data
+    """
+    header = _get_mib_header(fp)
+    frame_type = np.dtype(
+        [
+            ("header", "V" + str(header.offset)),
+            ("data", header.dtype, (header.frame_pixels,)),
+        ]
+    )
+    frames = np.memmap(fp, dtype=frame_type, mode=mmap_mode, shape=(header.depth,))
+    frames = frames["data"]
+
+    data_da = da.from_array(frames, chunks=(chunks, -1))
+    data_da = data_da.astype(header.dtype.newbyteorder("="))
+    return data_da
+
+
+def _unpack_raw_binary(data):
+    """
+    Lazily unpacks the pixels of 1 bit RAW frames, one chunk of frames at a time.
+
+    Parameters
+    ----------
+    data: dask array
+        stack of bit packed frames as (frames, bytes)
+
+    Returns
+    -------
+    unpacked: dask array
+        stack of frames as (frames, pixels) with one uint8 value per pixel,
+        chunked along the frames like data
+    """
+    data = data.rechunk({1: -1})
+    unpacked = data.map_blocks(
+        np.unpackbits,
+        axis=1,
+        chunks=(data.chunks[0], (data.shape[1] * 8,)),
+        dtype=np.uint8,
+    )
+    return unpacked
+
+
 def _get_hdr_bits(hdr_info):
     """
     gets the number of character bits for the header for each frame given the data type
@@ -644,141 +778,50 @@ def _get_hdr_bits(hdr_info):
     hdr_bits: int
         number of characters in the header
     """
-    data_length = hdr_info["data-length"]
-    data_type = hdr_info["data-type"]
-
-    if data_type == "signed":
-        data_type = "int"
-    elif data_type == "unsigned":
-        data_type = "uint"
-    elif data_type == "float":
-        pass
-    else:
-        raise TypeError('Unknown "data-type" string.')
-
-    # mib data always big-endian
-    endian = ">"
-    data_type += str(int(data_length))
-    # uint1 not a valid dtype
-    if data_type == "uint1":
-        data_type = "uint8"
-        data_type = np.dtype(data_type)
-    else:
-        data_type = np.dtype(data_type)
-    data_type = data_type.newbyteorder(endian)
-
-    if data_length == "1":
-        hdr_multiplier = 1
-    else:
-        hdr_multiplier = (int(data_length) / 8) ** -1
-
-    hdr_bits = int(hdr_info["data offset"] * hdr_multiplier)
+    hdr_bits = hdr_info["data offset"] // _get_mib_dtype(hdr_info).itemsize
 
     return hdr_bits
 
 
-def _read_exposures(fp, pct_frames_to_read=0.1):
+def _read_exposures(fp, pct_frames_to_read=1.0):
     """
     Looks into the frame times of the first frames to see if they are all the same (TEM) or there is a more intense
     flyback (4D-STEM). This works due to the way we trigger the 4DSTEM acquisitions at ePSIC.
     For this to work, the tick in the Merlin software to print exp time into header must be selected!
 
+    The frame headers are read through a strided view of the file and the
+    exposure times of all the frames are decoded at once.
+
     Parameters
     -------------
     fp: str
         MIB file name / path
     pct_frames_to_read : float
-        Percentage of frames to read, default value 0.1
+        Fraction of frames to read, default value 1.0
 
     Returns
     ------------
     exp_time: list
         List of frame exposure times in seconds
     """
-    hdr_info = _parse_hdr(fp)
-    width = hdr_info["width"]
-    height = hdr_info["height"]
-    depth = _get_mib_depth(hdr_info, fp)
-
-    record_by = hdr_info["record-by"]
-
-    data = _mib_to_daskarr(fp)
-    hdr_bits = _get_hdr_bits(hdr_info)
-
-    if record_by == "vector":  # spectral image
-        size = (height, width, depth)
-        data = data.reshape(size)
-    elif record_by == "image":  # stack of images
-        width_height = width * height
-        # remove headers at the beginning of each frame and reshape
-
-        if hdr_info["raw"] == "R64":
-            try:
-                # the header for the case of 12 bit data should be unpacked first
-                if hdr_info["Counter Depth (number)"] == 12:
-                    data = data.reshape(-1, width_height + hdr_bits)[:, :68]
-                    data_crop = data[: int(depth * pct_frames_to_read)]
-                    d = data_crop.compute()
-                    exp_time = []
-                    for frame in range(d.shape[0]):
-                        frame_text = str()
-                        for item in d[frame]:
-                            temp = unpack("cc", item)
-                            c1 = temp[1].decode("ascii")
-                            c2 = temp[0].decode("ascii")
-                            frame_text = frame_text + c1
-                            frame_text = frame_text + c2
-                        exp_time.append(float(frame_text[71:79]))
-                else:
-                    if hdr_info["Counter Depth (number)"] == 1:
-                        # RAW 1 bit data: the header bits are written as uint8 but the frames
-                        # are binary and need to be unpacked as such.
-                        data = data.reshape(-1, width_height / 8 + hdr_bits)[:, 71:79]
-
-                    else:
-                        data = data.reshape(-1, width_height + hdr_bits)[:, 71:79]
-                    data = data[
-                        :,
-                    ]
-                    data_crop = data[: int(depth * pct_frames_to_read)]
-                    d = data_crop.compute()
-                    exp_time = []
-                    for line in range(d.shape[0]):
-                        str_list = [chr(d[line][n]) for n in range(d.shape[1])]
-                        exp_time.append(float("".join(str_list)))
-            except ValueError:
-                print("Frame exposure times are not appearing in header!")
-        elif hdr_info["raw"] == "MIB":
-            try:
-                # the header for the case of 12 bit data should be unpacked first
-                if hdr_info["Counter Depth (number)"] == 12:
-                    data = data.reshape(-1, width_height + hdr_bits)[:, :68]
-                    data_crop = data[: int(depth * pct_frames_to_read)]
-                    d = data_crop.compute()
-                    exp_time = []
-                    for frame in range(d.shape[0]):
-                        frame_text = str()
-                        for item in d[frame]:
-                            temp = unpack("cc", item)
-                            c1 = temp[1].decode("ascii")
-                            c2 = temp[0].decode("ascii")
-                            frame_text = frame_text + c1
-                            frame_text = frame_text + c2
-                        exp_time.append(float(frame_text[71:79]))
-                # all the other cases are 8 bit
-                else:
-                    data = data.reshape(-1, width_height + hdr_bits)[:, 71:79]
-                    data = data[
-                        :,
-                    ]
-                    data_crop = data[: int(depth * pct_frames_to_read)]
-                    d = data_crop.compute()
-                    exp_time = []
-                    for line in range(d.shape[0]):
-                        str_list = [chr(d[line][n]) for n in range(d.shape[1])]
-                        exp_time.append(float("".join(str_list)))
-            except ValueError:
-                print("Frame exposure times are not appearing in header!")
+    header = _get_mib_header(fp)
+    n_frames = int(header.depth * pct_frames_to_read)
+
+    # the header characters are stored in file order for all the counter
+    # depths, so the headers can be read as bytes whatever the pixel dtype
+    frame_type = np.dtype(
+        [
+            ("header", "u1", (header.offset,)),
+            ("data", "V" + str(header.frame_size - header.offset)),
+        ]
+    )
+    headers = np.memmap(fp, dtype=frame_type, mode="r", shape=(n_frames,))["header"]
+    exp_chars = np.ascontiguousarray(headers[:, 71:79])
+    try:
+        exp_time = exp_chars.view("S8").ravel().astype(float).tolist()
+    except ValueError:
+        print("Frame exposure times are not appearing in header!")
+        exp_time = []
     return exp_time
 
 
@@ -895,8 +938,7 @@ def _stack_h5dump(data, hdr_info, saving_path, raw_binary=False, stack_num=1000)
             if i == 0:
                 data_dump0 = data[: (i + 1) * stack_num, :]
                 if raw_binary is True:
-                    data_dump1 = np.unpackbits(data_dump0)
-                    data_dump1.reshape(data_dump0.shape[0], data_dump0.shape[1] * 8)
+                    data_dump1 = _unpack_raw_binary(data_dump0)
                     data_dump1 = _untangle_raw(
                         data_dump1, hdr_info, data_dump0.shape[0]
                     )
@@ -911,8 +953,7 @@ def _stack_h5dump(data, hdr_info, saving_path, raw_binary=False, stack_num=1000)
             else:
                 data_dump0 = data[i * stack_num : (i + 1) * stack_num, :]
                 if raw_binary is True:
-                    data_dump1 = np.unpackbits(data_dump0)
-                    data_dump1.reshape(data_dump0.shape[0], data_dump0.shape[1] * 8)
+                    data_dump1 = _unpack_raw_binary(data_dump0)
                     data_dump1 = _untangle_raw(
                         data_dump1, hdr_info, data_dump0.shape[0]
                     )
@@ -926,8 +967,7 @@ def _stack_h5dump(data, hdr_info, saving_path, raw_binary=False, stack_num=1000)
         else:
             data_dump0 = data[i * stack_num :, :]
             if raw_binary is True:
-                data_dump1 = np.unpackbits(data_dump0)
-                data_dump1.reshape(data_dump0.shape[0], data_dump0.shape[1] * 8)
+                data_dump1 = _unpack_raw_binary(data_dump0)
                 data_dump1 = _untangle_raw(data_dump1, hdr_info, data_dump0.shape[0])
             else:
                 data_dump1 = _untangle_raw(data_dump0, hdr_info, data_dump0.shape[0])
@@ -972,7 +1012,7 @@ def _h5_chunk_write(data, saving_path):
 
 def _untangle_raw(data, hdr_info, stack_size):
     """
-    Corrects for the tangled raw mib format - Only the case for quad chip is considered here.
+    Corrects for the tangled raw mib format.
 
     Parameters
     --------
@@ -989,45 +1029,11 @@ def _untangle_raw(data, hdr_info, stack_size):
         corrected dask array object reshaped on the detector plane, e.g. for a single frame case
         as above: (1, 512, 512)
     """
-    width = hdr_info["width"]
-    height = hdr_info["height"]
-    width_height = width * height
-    if (
-        hdr_info["Counter Depth (number)"] == 24
-        or hdr_info["Counter Depth (number)"] == 12
-    ):
-        cols = 4
-
-    elif hdr_info["Counter Depth (number)"] == 1:
-        cols = 64
-
-    elif hdr_info["Counter Depth (number)"] == 6:
-        cols = 8
-
-    data = data.reshape((stack_size * width_height))
-
-    data = data.reshape(stack_size, height * (height // cols), cols)
-
-    data = da.flip(data, 2)
-
-    if hdr_info["Assembly Size"] == "2x2":
-        data = data.reshape((stack_size * width_height))
-        data = data.reshape(stack_size, 512 // 2, 512 * 2)
-
-        det1 = data[:, :, 0:256]
-        det2 = data[:, :, 256:512]
-        det3 = data[:, :, 512 : 512 + 256]
-        det4 = data[:, :, 512 + 256 :]
-
-        det3 = da.flip(det3, 2)
-        det3 = da.flip(det3, 1)
-
-        det4 = da.flip(det4, 2)
-        det4 = da.flip(det4, 1)
-
-        untangled_data = da.concatenate(
-            (da.concatenate((det1, det3), 1), da.concatenate((det2, det4), 1)), 2
-        )
+    index_map = get_index_map(
+        hdr_info["Counter Depth (number)"], hdr_info["Assembly Size"], add_crosses=False
+    )
+    data = da.asarray(data).reshape(stack_size, -1)
+    untangled_data = remap_frames(data, index_map)
     return untangled_data
 
 
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+# Copyright 2017-2020 The pyXem developers
+#
+# This file is part of pyXem.
+#
+# pyXem is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyXem is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyXem.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Vectorized orientation utilities based on unit quaternions, stored as
+(..., 4) arrays in (w, x, y, z) order as in transforms3d.
+"""
+
+import numpy as np
+
+
+def quaternion_multiply(q1, q2):
+    """Hamilton product of two arrays of quaternions.
+
+    Parameters
+    ----------
+    q1, q2 : numpy.array
+        Arrays of quaternions of broadcastable shapes (..., 4).
+
+    Returns
+    -------
+    q : numpy.array
+        The products q1 * q2, of shape (..., 4).
+    """
+    w1, x1, y1, z1 = np.moveaxis(np.asarray(q1), -1, 0)
+    w2, x2, y2, z2 = np.moveaxis(np.asarray(q2), -1, 0)
+    return np.stack(
+        (
+            w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+            w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+            w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+            w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2,
+        ),
+        axis=-1,
+    )
+
+
+def quaternion_conjugate(q):
+    """Conjugates, i.e. inverse rotations, of an array of unit quaternions of
+    shape (..., 4)."""
+    return np.asarray(q) * np.array([1, -1, -1, -1])
+
+
+def euler2quaternion(euler):
+    """Converts Euler angles in the Bunge (rzxz) convention to quaternions.
+
+    Parameters
+    ----------
+    euler : numpy.array
+        Array of shape (..., 3) of Euler angles in degrees.
+
+    Returns
+    -------
+    q : numpy.array
+        Array of shape (..., 4) of unit quaternions, equal to
+        ``transforms3d.euler.euler2quat(*np.deg2rad(euler), 'rzxz')``.
+    """
+    half = np.deg2rad(np.asarray(euler, dtype=np.float64)) / 2
+    zeros = np.zeros(half.shape[:-1])
+    qz1 = np.stack((np.cos(half[..., 0]), zeros, zeros, np.sin(half[..., 0])), -1)
+    qx = np.stack((np.cos(half[..., 1]), np.sin(half[..., 1]), zeros, zeros), -1)
+    qz2 = np.stack((np.cos(half[..., 2]), zeros, zeros, np.sin(half[..., 2])), -1)
+    return quaternion_multiply(quaternion_multiply(qz1, qx), qz2)
+
+
+def quaternion2euler(q):
+    """Converts quaternions to Euler angles in the Bunge (rzxz) convention.
+
+    Parameters
+    ----------
+    q : numpy.array
+        Array of shape (..., 4) of unit quaternions.
+
+    Returns
+    -------
+    euler : numpy.array
+        Array of shape (..., 3) of Euler angles in degrees, with the first
+        and last angle in [0, 360) and the second in [0, 180].
+    """
+    w, x, y, z = np.moveaxis(np.asarray(q, dtype=np.float64), -1, 0)
+    # angles of the sum and difference of the two z rotations
+    sum_angle = np.arctan2(z, w)
+    difference_angle = np.arctan2(y, x)
+    phi = 2 * np.arctan2(np.hypot(x, y), np.hypot(w, z))
+    phi1 = sum_angle + difference_angle
+    phi2 = sum_angle - difference_angle
+    return np.mod(np.rad2deg(np.stack((phi1, phi, phi2), axis=-1)), 360)
+
+
+def rotation_matrix2euler(R):
+    """Converts rotation matrices to Euler angles in the Bunge (rzxz)
+    convention.
+
+    Parameters
+    ----------
+    R : numpy.array
+        Array of shape (..., 3, 3) of rotation matrices.
+
+    Returns
+    -------
+    euler : numpy.array
+        Array of shape (..., 3) of Euler angles in degrees, equal to
+        ``np.rad2deg(transforms3d.euler.mat2euler(R, 'rzxz'))``.
+    """
+    R = np.asarray(R, dtype=np.float64)
+    sin_phi = np.hypot(R[..., 2, 0], R[..., 2, 1])
+    regular = sin_phi > 4 * np.finfo(float).eps
+    phi1 = np.where(regular, np.arctan2(R[..., 0, 2], -R[..., 1, 2]), 0.0)
+    phi = np.arctan2(sin_phi, R[..., 2, 2])
+    phi2 = np.where(
+        regular,
+        np.arctan2(R[..., 2, 0], R[..., 2, 1]),
+        np.arctan2(-R[..., 0, 1], R[..., 0, 0]),
+    )
+    return np.rad2deg(np.stack((phi1, phi, phi2), axis=-1))
+
+
+def rotation_matrix2quaternion(R):
+    """Converts rotation matrices to quaternions.
+
+    Parameters
+    ----------
+    R : numpy.array
+        Array of shape (..., 3, 3) of rotation matrices.
+
+    Returns
+    -------
+    q : numpy.array
+        Array of shape (..., 4) of unit quaternions with non-negative w,
+        equal to ``transforms3d.quaternions.mat2quat(R)``.
+    """
+    R = np.asarray(R, dtype=np.float64)
+    trace = R[..., 0, 0] + R[..., 1, 1] + R[..., 2, 2]
+    # Four times the squares of the components, of which the largest is
+    # used to find the others without loss of precision.
+    squares = np.stack(
+        (
+            1 + trace,
+            1 + 2 * R[..., 0, 0] - trace,
+            1 + 2 * R[..., 1, 1] - trace,
+            1 + 2 * R[..., 2, 2] - trace,
+        ),
+        axis=-1,
+    )
+    # Products of pairs of components times four, [i][j] for w, x, y, z
+    wx = R[..., 2, 1] - R[..., 1, 2]
+    wy = R[..., 0, 2] - R[..., 2, 0]
+    wz = R[..., 1, 0] - R[..., 0, 1]
+    xy = R[..., 0, 1] + R[..., 1, 0]
+    xz = R[..., 0, 2] + R[..., 2, 0]
+    yz = R[..., 1, 2] + R[..., 2, 1]
+    products = np.stack(
+        (
+            np.stack((squares[..., 0], wx, wy, wz), axis=-1),
+            np.stack((wx, squares[..., 1], xy, xz), axis=-1),
+            np.stack((wy, xy, squares[..., 2], yz), axis=-1),
+            np.stack((wz, xz, yz, squares[..., 3]), axis=-1),
+        ),
+        axis=-2,
+    )
+    largest = np.argmax(squares, axis=-1)[..., None, None]
+    q = np.take_along_axis(products, largest, axis=-2)[..., 0, :]
+    q /= np.linalg.norm(q, axis=-1, keepdims=True)
+    return q * np.where(q[..., :1] < 0, -1, 1)
+
+
+def get_lattice_rotations(base):
+    """Proper rotations mapping a lattice onto itself, i.e. the rotation part
+    of its holohedry.
+
+    The rotations are found as the unimodular matrices with entries in
+    {-1, 0, 1} preserving the metric tensor, which finds all of them for
+    reduced lattice bases.
+
+    Parameters
+    ----------
+    base : numpy.array
+        Array of shape (3, 3) with the lattice basis vectors as rows, in
+        Cartesian coordinates, e.g. ``diffpy.structure.Lattice.base``.
+
+    Returns
+    -------
+    q : numpy.array
+        Array of shape (n, 4) of the quaternions of the rotations in the
+        Cartesian frame of `base`.
+    """
+    base = np.asarray(base, dtype=np.float64)
+    metric = base.dot(base.T)
+    entries = np.array([0, 1, -1])
+    grid = np.meshgrid(*[entries] * 9, indexing="ij")
+    candidates = np.stack(grid, axis=-1).reshape(-1, 3, 3)
+    candidates = candidates[np.linalg.det(candidates).round() == 1]
+    transformed = np.einsum("nij,jk,nlk->nil", candidates, metric, candidates)
+    preserving = np.all(
+        np.isclose(transformed, metric, atol=1e-6 * np.abs(metric).max()), axis=(1, 2),
+    )
+    # base.dot(R.T) = M.dot(base) for the rotation R in Cartesian frame
+    rotations = np.einsum(
+        "ji,nkj,kl->nil", base, candidates[preserving], np.linalg.inv(base).T
+    )
+    return rotation_matrix2quaternion(rotations)
+
+
+def misorientation_angle(q1, q2, symmetry=None):
+    """Rotation angle between orientations, optionally the smallest one over
+    the symmetrically equivalent orientations of `q2`.
+
+    Parameters
+    ----------
+    q1, q2 : numpy.array
+        Arrays of unit quaternions of broadcastable shapes (..., 4).
+    symmetry : numpy.array, optional
+        Array of shape (n, 4) of the quaternions of the crystal symmetry
+        rotations, e.g. from :func:`get_lattice_rotations`, applied as
+        ``symmetry * q2``. If None crystal symmetry is not considered.
+
+    Returns
+    -------
+    angle : numpy.array
+        Misorientation angles in degrees, in [0, 180].
+    """
+    q1, q2 = np.asarray(q1), np.asarray(q2)
+    if symmetry is None:
+        dot = np.abs(np.sum(q1 * q2, axis=-1))
+    else:
+        # <q1, s * q2> = <q1 * conj(q2), s>, so that the equivalents are
+        # compared with a single product per pair of orientations.
+        difference = quaternion_multiply(q1, quaternion_conjugate(q2))
+        dot = np.abs(np.dot(difference, np.asarray(symmetry).T)).max(axis=-1)
+    return np.rad2deg(2 * np.arccos(np.clip(dot, 0, 1)))
+
+
+def reduce_to_fundamental_zone(q, symmetry):
+    """Symmetrically equivalent orientations with the smallest rotation
+    angle, i.e. in the fundamental zone around the identity.
+
+    Parameters
+    ----------
+    q : numpy.array
+        Array of shape (..., 4) of unit quaternions.
+    symmetry : numpy.array
+        Array of shape (n, 4) of the quaternions of the crystal symmetry
+        rotations, applied as ``symmetry * q``.
+
+    Returns
+    -------
+    q : numpy.array
+        Array of shape (..., 4) of the reduced unit quaternions, with
+        non-negative w.
+    """
+    q, symmetry = np.asarray(q, dtype=np.float64), np.asarray(symmetry)
+    # The real part of s * q is <conj(s), q>
+    real = np.dot(q, quaternion_conjugate(symmetry).T)
+    best = np.argmax(np.abs(real), axis=-1)
+    reduced = quaternion_multiply(symmetry[best], q)
+    return reduced * np.where(reduced[..., :1] < 0, -1, 1)
+
+
+def get_modal_orientation(q, tolerance, symmetry=None):
+    """Finds the most frequent orientation, up to a tolerance.
+
+    The orientations are binned on a grid of the vector part of their
+    quaternions in the fundamental zone, with spacing of about `tolerance`.
+    The modal orientation is the mean of the orientations within
+    `tolerance` of the mean of the most populated neighbourhood of bins.
+
+    Parameters
+    ----------
+    q : numpy.array
+        Array of shape (..., 4) of unit quaternions, nan for missing
+        orientations.
+    tolerance : float
+        Misorientation in degrees within which orientations are counted as
+        the same.
+    symmetry : numpy.array, optional
+        Array of shape (n, 4) of the quaternions of the crystal symmetry
+        rotations. If None crystal symmetry is not considered.
+
+    Returns
+    -------
+    mode : numpy.array
+        Unit quaternion of the modal orientation.
+    fraction : float
+        Fraction of the orientations within `tolerance` of `mode`.
+    """
+    q = np.asarray(q, dtype=np.float64).reshape(-1, 4)
+    q = q[np.isfinite(q).all(axis=-1)]
+    if len(q) == 0:
+        return np.full(4, np.nan), 0.0
+    if symmetry is None:
+        symmetry = np.array([[1.0, 0, 0, 0]])
+    reduced = reduce_to_fundamental_zone(q, symmetry)
+
+    # A misorientation of angle t moves the vector part by about t / 2.
+    # Bins are counted together with their neighbours, so that clusters
+    # split by bin edges are found in full.
+    spacing = np.deg2rad(tolerance) / 2
+    bins = np.floor(reduced[:, 1:] / spacing).astype(np.int64)
+    bins -= bins.min(axis=0) - 1
+    dims = bins.max(axis=0) + 2
+    keys = np.ravel_multi_index(bins.T, dims)
+    offsets = np.ravel_multi_index(np.indices((3, 3, 3)).reshape(3, -1), dims)
+    offsets -= np.ravel_multi_index((1, 1, 1), dims)
+    unique, counts = np.unique(keys, return_counts=True)
+    neighbourhood_counts = np.zeros(len(unique), dtype=int)
+    for offset in offsets:
+        index = np.minimum(np.searchsorted(unique, unique + offset), len(unique) - 1)
+        found = unique[index] == unique + offset
+        neighbourhood_counts[found] += counts[index[found]]
+    densest = unique[np.argmax(neighbourhood_counts)]
+    centre = reduced[np.isin(keys, densest + offsets)].mean(axis=0)
+    centre /= np.linalg.norm(centre)
+
+    # Average the equivalents closest to the centre of the members
+    difference = quaternion_multiply(centre, quaternion_conjugate(reduced))
+    real = np.dot(difference, symmetry.T)
+    best = np.argmax(np.abs(real), axis=-1)
+    members = np.abs(real[np.arange(len(q)), best]) >= np.cos(np.deg2rad(tolerance) / 2)
+    aligned = quaternion_multiply(symmetry[best[members]], reduced[members])
+    aligned *= np.where(np.dot(aligned, centre) < 0, -1, 1)[:, np.newaxis]
+    mode = aligned.sum(axis=0)
+    return mode / np.linalg.norm(mode), np.count_nonzero(members) / len(q)
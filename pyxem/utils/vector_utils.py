@@ -19,8 +19,6 @@
 import numpy as np
 import math
 
-from transforms3d.axangles import axangle2mat
-
 
 def detector_to_fourier(k_xy, wavelength, camera_length):
     """Maps two-dimensional Cartesian coordinates in the detector plane to
@@ -164,16 +162,53 @@ def normalize_or_zero(v):
         v[nonzero_mask] /= norms[nonzero_mask].reshape(-1, 1)
 
 
+def _axangle2mat_vec(axes, angles):
+    """Rotation matrices for a list of normalized axes and angles, as
+    :func:`transforms3d.axangles.axangle2mat` for each pair.
+
+    Parameters
+    ----------
+    axes : np.array()
+        Nx3 array of normalized rotation axes.
+    angles : np.array()
+        Length N array of rotation angles in radians.
+
+    Returns
+    -------
+    R : np.array()
+        Nx3x3 array of rotation matrices.
+    """
+    x, y, z = axes[:, 0], axes[:, 1], axes[:, 2]
+    c = np.cos(angles)
+    s = np.sin(angles)
+    C = 1 - c
+    xs, ys, zs = x * s, y * s, z * s
+    xC, yC, zC = x * C, y * C, z * C
+    xyC, yzC, zxC = x * yC, y * zC, z * xC
+    R = np.empty((len(angles), 3, 3))
+    R[:, 0, 0] = x * xC + c
+    R[:, 0, 1] = xyC - zs
+    R[:, 0, 2] = zxC + ys
+    R[:, 1, 0] = xyC + zs
+    R[:, 1, 1] = y * yC + c
+    R[:, 1, 2] = yzC - xs
+    R[:, 2, 0] = zxC - ys
+    R[:, 2, 1] = yzC + xs
+    R[:, 2, 2] = z * zC + c
+    return R
+
+
 def get_rotation_matrix_between_vectors(from_v1, from_v2, to_v1, to_v2):
     """Calculates the rotation matrix from one pair of vectors to the other.
-    Handles multiple to-vectors from a single from-vector.
+    Handles multiple to-vectors from a single from-vector, or one from-vector
+    per to-vector.
 
     Find `R` such that `v_to = R @ v_from`.
 
     Parameters
     ----------
     from_v1, from_v2 : np.array()
-        Vector to rotate _from_.
+        Vector to rotate _from_, or Nx3 array of vectors to rotate from.
     to_v1, to_v2 : np.array()
         Nx3 array of vectors to rotate _to_.
 
@@ -182,6 +217,9 @@ def get_rotation_matrix_between_vectors(from_v1, from_v2, to_v1, to_v2):
     R : np.array()
         Nx3x3 list of rotation matrices between the vector pairs.
     """
+    from_v1 = np.broadcast_to(from_v1, to_v1.shape)
+    from_v2 = np.broadcast_to(from_v2, to_v2.shape)
+
     # Find normals to rotate around
     plane_normal_from = np.cross(from_v1, from_v2, axis=-1)
     plane_normal_to = np.cross(to_v1, to_v2, axis=-1)
@@ -190,9 +228,13 @@ def get_rotation_matrix_between_vectors(from_v1, from_v2, to_v1, to_v2):
     # Try to remove normals from degenerate to-planes by replacing them with
     # the rotation axes between from and to vectors.
     to_degenerate = np.isclose(np.sum(np.abs(plane_normal_to), axis=-1), 0.0)
-    plane_normal_to[to_degenerate] = np.cross(from_v1, to_v1[to_degenerate], axis=-1)
+    plane_normal_to[to_degenerate] = np.cross(
+        from_v1[to_degenerate], to_v1[to_degenerate], axis=-1
+    )
     to_degenerate = np.isclose(np.sum(np.abs(plane_normal_to), axis=-1), 0.0)
-    plane_normal_to[to_degenerate] = np.cross(from_v2, to_v2[to_degenerate], axis=-1)
+    plane_normal_to[to_degenerate] = np.cross(
+        from_v2[to_degenerate], to_v2[to_degenerate], axis=-1
+    )
 
     # Normalize the axes used for rotation
     normalize_or_zero(plane_normal_to)
@@ -200,24 +242,16 @@ def get_rotation_matrix_between_vectors(from_v1, from_v2, to_v1, to_v2):
 
     # Create rotation from-plane -> to-plane
     common_valid = ~np.isclose(np.sum(np.abs(plane_common_axes), axis=-1), 0.0)
-    angles = get_angle_cartesian_vec(
-        np.broadcast_to(plane_normal_from, plane_normal_to.shape), plane_normal_to
-    )
+    angles = get_angle_cartesian_vec(plane_normal_from, plane_normal_to)
     R1 = np.empty((angles.shape[0], 3, 3))
-    if np.any(common_valid):
-        R1[common_valid] = np.array(
-            [
-                axangle2mat(axis, angle, is_normalized=True)
-                for axis, angle in zip(
-                    plane_common_axes[common_valid], angles[common_valid]
-                )
-            ]
-        )
+    R1[common_valid] = _axangle2mat_vec(
+        plane_common_axes[common_valid], angles[common_valid]
+    )
     R1[~common_valid] = np.identity(3)
 
     # Rotate from-plane into to-plane
-    rot_from_v1 = np.matmul(R1, from_v1)
-    rot_from_v2 = np.matmul(R1, from_v2)
+    rot_from_v1 = np.einsum("ijk,ik->ij", R1, from_v1)
+    rot_from_v2 = np.einsum("ijk,ik->ij", R1, from_v2)
 
     # Create rotation in the now common plane
 
@@ -235,12 +269,7 @@ def get_rotation_matrix_between_vectors(from_v1, from_v2, to_v1, to_v2):
     np.negative(angles, out=angles, where=neg_angle_mask)
 
     # To-plane normal still the same
-    R2 = np.array(
-        [
-            axangle2mat(axis, angle, is_normalized=True)
-            for axis, angle in zip(plane_normal_to, angles)
-        ]
-    )
+    R2 = _axangle2mat_vec(plane_normal_to, angles)
 
     # Total rotation is the combination of to plane R1 and in plane R2
     R = np.matmul(R2, R1)